@@ -18,8 +18,9 @@ from models import (
     Patient,
     ConversationDiseaseLikelihood,
     create_patient,
-    get_next_global_patient_identifier,
+    create_patient_with_next_identifier,
     delete_conversation_by_id,
+    get_role_id,
 )
 
 # Optional: FAISS-driven disease likelihoods
@@ -31,7 +32,7 @@ admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
 # Auth guards
 # --------------------------
 def _require_admin():
-    return current_user.is_authenticated and any(r.name == "admin" for r in current_user.roles)
+    return current_user.is_authenticated and current_user.has_role("admin")
 
 def admin_guard():
     if not _require_admin():
@@ -133,15 +134,13 @@ def summary():
         clinicians = (
             db.query(User)
               .join(user_roles, user_roles.c.user_id == User.id)
-              .join(Role, Role.id == user_roles.c.role_id)
-              .filter(Role.name == "clinician")
+              .filter(user_roles.c.role_id == get_role_id("clinician", db=db))
               .count()
         )
         admins = (
             db.query(User)
               .join(user_roles, user_roles.c.user_id == User.id)
-              .join(Role, Role.id == user_roles.c.role_id)
-              .filter(Role.name == "admin")
+              .filter(user_roles.c.role_id == get_role_id("admin", db=db))
               .count()
         )
         total_convos = db.query(Conversation).count()
@@ -163,8 +162,7 @@ def summary():
         top_clinician_rows = (
             db.query(User, func.count(Conversation.id).label("cnt"))
               .join(user_roles, user_roles.c.user_id == User.id)
-              .join(Role, Role.id == user_roles.c.role_id)
-              .filter(Role.name == "clinician")
+              .filter(user_roles.c.role_id == get_role_id("clinician", db=db))
               .outerjoin(Conversation, Conversation.owner_user_id == User.id)
               .group_by(User.id, User.email, User.username)
               .order_by(desc(func.count(Conversation.id)))
@@ -209,8 +207,7 @@ def clinicians():
         rows = (
             db.query(User, func.count(Conversation.id).label("convos"))
               .join(user_roles, user_roles.c.user_id == User.id)
-              .join(Role, Role.id == user_roles.c.role_id)
-              .filter(Role.name == "clinician")
+              .filter(user_roles.c.role_id == get_role_id("clinician", db=db))
               .outerjoin(Conversation, Conversation.owner_user_id == User.id)
               .group_by(User.id, User.email, User.username)
               .order_by(desc("convos"))
@@ -398,7 +395,8 @@ def create_user():
 
         # Assign roles
         for role_name in role_names:
-            role = db.query(Role).filter(Role.name == role_name).first()
+            rid = get_role_id(role_name, db=db)
+            role = db.get(Role, rid) if rid is not None else None
             if role:
                 new_user.roles.append(role)
 
@@ -439,7 +437,8 @@ def update_user(user_id):
         # Update roles
         user.roles = []
         for role_name in role_names:
-            role = db.query(Role).filter(Role.name == role_name).first()
+            rid = get_role_id(role_name, db=db)
+            role = db.get(Role, rid) if rid is not None else None
             if role:
                 user.roles.append(role)
 
@@ -553,10 +552,11 @@ def admin_create_patient():
     except (TypeError, ValueError):
         return jsonify({"ok": False, "error": "clinician_id must be an integer"}), 400
     identifier = (data.get("identifier") or "").strip()
-    if not identifier:
-        identifier = get_next_global_patient_identifier()
     display_name = (data.get("display_name") or "").strip() or None
-    pid = create_patient(identifier=identifier, clinician_id=clinician_id, display_name=display_name)
+    if identifier:
+        pid = create_patient(identifier=identifier, clinician_id=clinician_id, display_name=display_name)
+    else:
+        pid, identifier = create_patient_with_next_identifier(clinician_id=clinician_id, display_name=display_name)
     return jsonify({"ok": True, "patient_id": pid, "identifier": identifier})
 
 
@@ -1357,8 +1357,7 @@ def export_clinicians(format: str):
         rows_data = (
             db.query(User, func.count(Conversation.id).label("convos"))
               .join(user_roles, user_roles.c.user_id == User.id)
-              .join(Role, Role.id == user_roles.c.role_id)
-              .filter(Role.name == "clinician")
+              .filter(user_roles.c.role_id == get_role_id("clinician", db=db))
               .outerjoin(Conversation, Conversation.owner_user_id == User.id)
               .group_by(User.id, User.email, User.username)
               .order_by(desc("convos"))
@@ -28,21 +28,29 @@ from crew_runner import (
     rank_questions_for_unasked,  # ✅ NEW
     normalize_text,  # ✅ NEW
     build_listener_bundle,  # ✅ NEW (Listener summary + final plan for Live Stop)
+    forget_session,
 )
 
 from models import (
     init_db,
+    bind_request_session,
+    release_request_session,
     create_conversation,
-    log_message,
+    log_messages_bulk,
     list_conversations_for_user,
     get_conversation_if_owned_by,
     get_conversation_messages,
+    iter_conversation_messages,
+    message_previews_for_user,
     delete_conversation_if_owned_by,
     update_conversation_patient,
     list_patients_for_user,
+    patient_labels_for_user,
+    patient_label_for,
+    find_patient_id_for_clinician,
     create_patient,
     get_patient,
-    get_next_global_patient_identifier,
+    create_patient_with_next_identifier,
     get_conversation_status_if_owned,
     set_conversation_status_if_owned,
 )
@@ -90,6 +98,18 @@ csrf.exempt(stt_bp)  # keep old behavior: allow JS uploads without CSRF header
 register_ws_routes(sock)  # WS /ws/stt
 
 
+@app.before_request
+def _bind_db_session():
+    # One session per request, shared by the models helpers
+    bind_request_session()
+
+
+@app.teardown_appcontext
+def _remove_db_session(exc=None):
+    # Drop the request's session so its connection goes back to the pool
+    release_request_session()
+
+
 # -----------------------------------------------------------------------------
 # CSRF token endpoint (frontend can fetch this for other POST routes)
 # -----------------------------------------------------------------------------
@@ -109,7 +129,8 @@ def initialize_faiss():
     """Initialize the FAISS system on startup."""
     global faiss_system
     try:
-        faiss_system = MedicalCaseFAISS()
+        # FAISS_NUM_THREADS: OpenMP threads per worker (e.g. 1, or cores / gunicorn workers)
+        faiss_system = MedicalCaseFAISS(num_threads=int(os.getenv("FAISS_NUM_THREADS", "0")) or None)
 
         if (os.path.exists(app.config["FAISS_INDEX_PATH"]) and
                 os.path.exists(app.config["FAISS_METADATA_PATH"])):
@@ -238,12 +259,26 @@ def agent_chat_stream():
     except Exception:
         logger.exception("Failed to append live history")
 
-    # Persist hook to DB
+    # Persist hook to DB: buffer turns for this request and flush them in one insert
+    pending_messages = []
+
     def log_hook(session_id, role_, message_, timestamp_, type_="message"):
+        pending_messages.append({
+            "role": role_,
+            "message": message_,
+            "timestamp": timestamp_,
+            "type": type_,
+            "created_at": datetime.utcnow(),
+        })
+
+    def flush_log():
+        if not pending_messages:
+            return
         try:
-            log_message(session_id, role_, message_, timestamp_, type_)
+            log_messages_bulk(sid, pending_messages)
         except Exception:
             logger.exception("DB log failed")
+        pending_messages.clear()
 
     # Pick the streaming generator
     # When Finalize is clicked, use real_actor (or live) to summarize - simulate has no Finalize path
@@ -282,7 +317,13 @@ def agent_chat_stream():
             session_id=sid,
         )
 
-    resp = Response(stream_with_context(generator), mimetype="text/event-stream")
+    def logged(gen):
+        try:
+            yield from gen
+        finally:
+            flush_log()
+
+    resp = Response(stream_with_context(logged(generator)), mimetype="text/event-stream")
     resp.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
     resp.headers["X-Accel-Buffering"] = "no"
     resp.headers["Connection"] = "keep-alive"
@@ -626,6 +667,7 @@ def reset_conv():
     # (otherwise we would clear state for the new cid, leaving old conversation's state orphaned)
     try:
         _reset_live_state()
+        forget_session(session.get("id"))
     except Exception:
         logger.exception("Failed to reset live state")
     cid = create_conversation(owner_user_id=current_user.id, patient_id=patient_id)
@@ -642,8 +684,8 @@ def reset_conv():
 # -----------------------------------------------------------------------------
 def _patients_display_order():
     """Single source of truth: patients for current user sorted by id (Patient 1 = smallest id)."""
-    patients = list_patients_for_user(current_user.id)
-    return sorted(patients, key=lambda p: p.id)
+    # list_patients_for_user already returns them in id order
+    return list_patients_for_user(current_user.id)
 
 
 def _patient_display_labels_for_current_user():
@@ -652,22 +694,10 @@ def _patient_display_labels_for_current_user():
 
     Primary identifier: patients.identifier (e.g. P010)
     Secondary hint: ordinal (Patient N) to preserve existing mental model
+
+    Cached per clinician until their patient set changes; callers must not mutate it.
     """
-    ordered = _patients_display_order()
-    out = {}
-    for i, p in enumerate(ordered):
-        ordinal = i + 1
-        ident = (getattr(p, "identifier", None) or "").strip()
-        disp = (getattr(p, "display_name", None) or "").strip()
-        if ident:
-            base = ident
-            if disp:
-                base = f"{base} — {disp}"
-            out[p.id] = f"{base} (Patient {ordinal})"
-        else:
-            # fallback to legacy label style if identifier is missing
-            out[p.id] = f"Patient {ordinal}"
-    return out
+    return patient_labels_for_user(current_user.id)
 
 
 _PATIENT_IDENT_RE = re.compile(r"^P?(\d+)$", re.IGNORECASE)
@@ -690,13 +720,17 @@ def api_my_conversations():
     """List current user's conversations (id, created_at, patient, message_count). Excludes empty conversations."""
     convos = list_conversations_for_user(current_user.id)
     plabels = _patient_display_labels_for_current_user()
+    # First message + count for every conversation in one query (not one per conversation)
+    previews = message_previews_for_user(current_user.id)
     out = []
     for c in convos:
-        msgs = get_conversation_messages(c.id)
         # Skip conversations with no messages (e.g. created on Reset but not yet used)
-        if not msgs:
+        if c.last_message_at is None:
             continue
-        first_msg = msgs[0].message if msgs and msgs[0].message else ""
+        first_msg, n_msgs = previews.get(c.id, (None, 0))
+        if not n_msgs:
+            continue
+        first_msg = first_msg or ""
         preview = (first_msg[:80] + "…") if len(first_msg) > 80 else first_msg
         # Use conversation's patient_id (column is source of truth; fallback to relationship if needed)
         pid = c.patient_id if c.patient_id is not None else (c.patient.id if getattr(c, "patient", None) else None)
@@ -707,9 +741,10 @@ def api_my_conversations():
             "id": c.id,
             "created_at": c.created_at.isoformat() if c.created_at else None,
             "status": (c.status or "active"),
+            "last_message_at": c.last_message_at.isoformat() if c.last_message_at else None,
             "patient_id": pid,
             "patient_label": patient_label,
-            "message_count": len(msgs),
+            "message_count": n_msgs,
             "preview": preview,
         })
     return jsonify({"ok": True, "conversations": out})
@@ -722,8 +757,6 @@ def api_conversation_messages(conversation_id):
     c = get_conversation_if_owned_by(conversation_id, current_user.id)
     if c is None:
         return jsonify({"ok": False, "error": "Not found or access denied"}), 403
-    msgs = get_conversation_messages(conversation_id)
-    plabels = _patient_display_labels_for_current_user()
     out = [
         {
             "id": m.id,
@@ -733,10 +766,10 @@ def api_conversation_messages(conversation_id):
             "timestamp": m.timestamp,
             "created_at": m.created_at.isoformat() if m.created_at else None,
         }
-        for m in msgs
+        for m in iter_conversation_messages(conversation_id)
     ]
     pid = c.patient_id if c.patient_id is not None else (c.patient.id if getattr(c, "patient", None) else None)
-    patient_label = plabels.get(int(pid)) if pid is not None else None
+    patient_label = patient_label_for(int(pid), current_user.id) if pid is not None else None
     if pid is not None and not patient_label:
         patient_label = "Patient"
     return jsonify({
@@ -835,16 +868,11 @@ def api_session_patient():
             "error": "Invalid patient number format. Use P001 or 001.",
         }), 400
 
-    # Manual identifier mode: resolve patient for this clinician (create if missing)
+    # Manual identifier mode: resolve patient for this clinician (create if missing). Match legacy
+    # identifiers case/space-insensitively first; create_patient only sees exact duplicates.
     if pid is None and ident:
-        existing = None
-        for p in list_patients_for_user(current_user.id):
-            if ((p.identifier or "").strip().upper() == ident):
-                existing = p
-                break
-        if existing is not None:
-            pid = existing.id
-        else:
+        pid = find_patient_id_for_clinician(ident, current_user.id)
+        if pid is None:
             pid = create_patient(identifier=ident, clinician_id=current_user.id, display_name=None)
 
     if pid is None:
@@ -900,6 +928,7 @@ def new_conversation():
     session["conv"] = []
     try:
         _reset_live_state()
+        forget_session(session.get("id"))
     except Exception:
         logger.exception("Failed to reset live state")
     cid = create_conversation(owner_user_id=current_user.id, patient_id=patient_id)
@@ -921,11 +950,14 @@ def api_patients():
     if request.method == "POST":
         data = request.get_json(force=True, silent=True) or {}
         identifier = (data.get("identifier") or data.get("display_name") or "").strip()
-        if not identifier:
-            # Auto-generate identifier: next global P001, P002, ... (continues from latest in DB across clinicians)
-            identifier = get_next_global_patient_identifier()
         display_name = (data.get("display_name") or "").strip() or None
-        pid = create_patient(identifier=identifier, clinician_id=current_user.id, display_name=display_name)
+        if identifier:
+            pid = create_patient(identifier=identifier, clinician_id=current_user.id, display_name=display_name)
+        else:
+            # Auto-generate identifier: next global P001, P002, ... (allocated atomically across clinicians)
+            pid, identifier = create_patient_with_next_identifier(
+                clinician_id=current_user.id, display_name=display_name
+            )
         return jsonify({"ok": True, "patient_id": pid})
     # Same order as history (single source of truth)
     ordered = _patients_display_order()
@@ -961,7 +993,7 @@ def favicon():
 @login_required
 def history_page():
     """History list: my conversations (Date | Patient | Preview). Admin only."""
-    if not any(r.name == "admin" for r in current_user.roles):
+    if not current_user.has_role("admin"):
         return "Forbidden", 403
     return render_template("history.html")
 
@@ -970,15 +1002,15 @@ def history_page():
 @login_required
 def history_detail_page(conversation_id):
     """Single conversation detail (messages). Admin only."""
-    if not any(r.name == "admin" for r in current_user.roles):
+    if not current_user.has_role("admin"):
         return "Forbidden", 403
     c = get_conversation_if_owned_by(conversation_id, current_user.id)
     if c is None:
         return "Not found or access denied", 404
     msgs = get_conversation_messages(conversation_id)
-    plabels = _patient_display_labels_for_current_user()
     pid = c.patient_id if c.patient_id is not None else (c.patient.id if getattr(c, "patient", None) else None)
-    patient_label = plabels.get(int(pid)) if pid is not None else None
+    # Only this conversation's patient is labelled; no need to load the whole patient list
+    patient_label = patient_label_for(int(pid), current_user.id) if pid is not None else None
     if pid is not None and not patient_label:
         patient_label = "Patient"
     return render_template(
@@ -1145,7 +1177,7 @@ def set_role():
 @app.route("/admin")
 @login_required
 def admin_page():
-    if not any(r.name == "admin" for r in current_user.roles):
+    if not current_user.has_role("admin"):
         return "Forbidden", 403
     return render_template("admin.html")
 
@@ -1,6 +1,6 @@
 from flask import Blueprint, jsonify, request, redirect, url_for, session
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from models import SessionLocal, User, Role, user_roles
+from models import SessionLocal, User, user_roles, get_role_id
 from security import hash_password, verify_password
 
 auth_bp = Blueprint("auth", __name__, url_prefix="/auth")
@@ -15,9 +15,9 @@ def load_user(user_id):
         db.close()
 
 def grant_role(db, user: User, role_name: str):
-    role = db.query(Role).filter_by(name=role_name).first()
-    if role and not any(r.id == role.id for r in user.roles):
-        db.execute(user_roles.insert().values(user_id=user.id, role_id=role.id))
+    rid = get_role_id(role_name, db=db)
+    if rid is not None and not any(r.id == rid for r in user.roles):
+        db.execute(user_roles.insert().values(user_id=user.id, role_id=rid))
         db.commit()
 
 @auth_bp.post("/signup")  # switch to invite-only later if you want
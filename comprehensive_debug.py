@@ -5,6 +5,7 @@ Comprehensive debug script to diagnose and fix FAISS database issues
 
 import json
 import numpy as np
+import orjson
 import faiss
 import pickle
 import os
@@ -121,12 +122,13 @@ def diagnose_faiss_issue():
 
     metadata = {
         'cases': processed_cases,
-        'case_embeddings': embeddings,
         'dimension': dimension
     }
 
     with open(metadata_file, 'wb') as f:
         pickle.dump(metadata, f)
+    # MedicalCaseFAISS reads this sidecar in preference to the pickle
+    Path(metadata_file).with_suffix('.json').write_bytes(orjson.dumps(metadata))
 
     print(f"✅ Saved new index and metadata")
 
@@ -1,9 +1,13 @@
 from crewai import Crew, Task
 from agent_loader import load_llm, load_agents_from_yaml, load_tasks_from_yaml
 from datetime import datetime
-import json
 import re
 import logging
+import threading
+import time
+import orjson
+from collections import OrderedDict, deque
+from functools import lru_cache
 from typing import List, Dict, Any
 from difflib import SequenceMatcher
 
@@ -21,6 +25,52 @@ faiss_system.load_index('medical_cases.index', 'medical_cases_metadata.pkl')
 
 # ---------------------------- NEW: Listener bundle (Live Stop) ----------------------------
 
+# Prompt text that does not depend on the conversation is assembled once at import time;
+# per call only the transcript / question list is spliced in.
+_LISTENER_PREFIX = "Conversation transcript:\n"
+_LISTENER_SUFFIX = {
+    "swahili": "\n\n" + (
+        "Andika muhtasari wa mazungumzo haya kwa Kiswahili (vipengele vya nukta), "
+        "kisha toa mpango wa hatua kwa hatua wa nini kinachofuata kliniki. "
+        "Fuata muundo HUU hasa:\n\n"
+        "Listener:\n"
+        "**Swahili Summary:**\n"
+        "- ...\n\n"
+        "**FINAL PLAN:**\n"
+        "- Step 1: ...\n"
+        "- Step 2: ...\n\n"
+        "Weka kwa ufupi, wa kitabibu, na wa vitendo."
+    ),
+    "english": "\n\n" + (
+        "Summarize this medical conversation in English (bullet points), then provide "
+        "a practical step-by-step clinical plan. "
+        "Follow THIS exact structure:\n\n"
+        "Listener:\n"
+        "**English Summary:**\n"
+        "- ...\n\n"
+        "**FINAL PLAN:**\n"
+        "- Step 1: ...\n"
+        "- Step 2: ...\n\n"
+        "Keep it concise, medical, and actionable."
+    ),
+    "bilingual": "\n\n" + (
+        "Summarize this medical conversation in two parts (English + Swahili) using bullet points, "
+        "then provide a practical step-by-step clinical plan. "
+        "Follow THIS exact structure (no extra text):\n\n"
+        "Listener:\n"
+        "**English Summary:**\n"
+        "- ...\n\n"
+        "**Swahili Summary:**\n"
+        "- ...\n\n"
+        "**FINAL PLAN:**\n"
+        "- Step 1: ...\n"
+        "- Step 2: ...\n"
+        "- Step 3: ...\n\n"
+        "Make the plan clinically sensible (tests, referral, follow-up) and keep it short."
+    ),
+}
+
+
 def build_listener_bundle(convo_text: str, language_mode: str = "bilingual") -> str:
     """
     Live mic mode has *real* clinicians, so we don't generate a clinician final plan.
@@ -40,50 +90,8 @@ def build_listener_bundle(convo_text: str, language_mode: str = "bilingual") ->
     convo_text = (convo_text or "").strip()
     convo_clip = convo_text[-9000:] if len(convo_text) > 9000 else convo_text
 
-    if language_mode == "swahili":
-        instruction = (
-            "Andika muhtasari wa mazungumzo haya kwa Kiswahili (vipengele vya nukta), "
-            "kisha toa mpango wa hatua kwa hatua wa nini kinachofuata kliniki. "
-            "Fuata muundo HUU hasa:\n\n"
-            "Listener:\n"
-            "**Swahili Summary:**\n"
-            "- ...\n\n"
-            "**FINAL PLAN:**\n"
-            "- Step 1: ...\n"
-            "- Step 2: ...\n\n"
-            "Weka kwa ufupi, wa kitabibu, na wa vitendo."
-        )
-    elif language_mode == "english":
-        instruction = (
-            "Summarize this medical conversation in English (bullet points), then provide "
-            "a practical step-by-step clinical plan. "
-            "Follow THIS exact structure:\n\n"
-            "Listener:\n"
-            "**English Summary:**\n"
-            "- ...\n\n"
-            "**FINAL PLAN:**\n"
-            "- Step 1: ...\n"
-            "- Step 2: ...\n\n"
-            "Keep it concise, medical, and actionable."
-        )
-    else:
-        instruction = (
-            "Summarize this medical conversation in two parts (English + Swahili) using bullet points, "
-            "then provide a practical step-by-step clinical plan. "
-            "Follow THIS exact structure (no extra text):\n\n"
-            "Listener:\n"
-            "**English Summary:**\n"
-            "- ...\n\n"
-            "**Swahili Summary:**\n"
-            "- ...\n\n"
-            "**FINAL PLAN:**\n"
-            "- Step 1: ...\n"
-            "- Step 2: ...\n"
-            "- Step 3: ...\n\n"
-            "Make the plan clinically sensible (tests, referral, follow-up) and keep it short."
-        )
-
-    prompt = f"Conversation transcript:\n{convo_clip}\n\n{instruction}"
+    suffix = _LISTENER_SUFFIX.get(language_mode, _LISTENER_SUFFIX["bilingual"])
+    prompt = "".join((_LISTENER_PREFIX, convo_clip, suffix))
     return run_task(listener, prompt, name="Listener Summary + Final Plan")
 
 
@@ -100,15 +108,48 @@ def normalize_text(text: str) -> str:
     return t
 
 
+def _find_json_span(text: str) -> str | None:
+    """Return the first balanced [...] or {...} substring in a single pass (string literals are skipped)."""
+    start = None
+    depth = 0
+    open_ch = close_ch = ""
+    in_str = False
+    escaped = False
+    for i, c in enumerate(text):
+        if start is None:
+            if c in "[{":
+                start = i
+                open_ch = c
+                close_ch = "]" if c == "[" else "}"
+                depth = 1
+            continue
+        if in_str:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_str = False
+            continue
+        if c == '"':
+            in_str = True
+        elif c == open_ch:
+            depth += 1
+        elif c == close_ch:
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+
 def _safe_json_from_text(text: str) -> Any:
     """Try hard to parse JSON from model output."""
     if not text:
         return None
     # Find first JSON array/object in the response
-    m = re.search(r"(\[.*\]|\{.*\})", text, re.DOTALL)
-    candidate = m.group(1) if m else text
+    candidate = _find_json_span(text) or text
     try:
-        return json.loads(candidate)
+        return orjson.loads(candidate)
     except Exception:
         return None
 
@@ -168,10 +209,18 @@ def is_coherent_medical_text(text: str, conversation_context: str = "") -> bool:
     Validate if transcribed text is coherent and relevant to medical conversation.
     Returns False for hallucinations, noise, or gibberish.
     """
-    if not text or len(text.strip()) < 3:
+    if not text:
         return False
+    # conversation_context only matters for the "be more strict" branch, so collapse it to a flag;
+    # repeated ASR hallucinations ("okay", "thank you for watching") then hit the cache.
+    strict = bool(conversation_context) and len(conversation_context) > 100
+    return _is_coherent_medical_text_cached(text.lower().strip(), strict)
 
-    text_lower = text.lower().strip()
+
+@lru_cache(maxsize=2048)
+def _is_coherent_medical_text_cached(text_lower: str, strict: bool) -> bool:
+    if len(text_lower) < 3:
+        return False
 
     # Filter out common hallucination patterns
     hallucination_patterns = [
@@ -188,7 +237,7 @@ def is_coherent_medical_text(text: str, conversation_context: str = "") -> bool:
             return False
 
     # If text is just numbers or very short, likely noise
-    if len(text.strip()) < 5 and text.strip().isdigit():
+    if len(text_lower) < 5 and text_lower.isdigit():
         return False
 
     # Check for medical relevance keywords (expanded list)
@@ -202,7 +251,7 @@ def is_coherent_medical_text(text: str, conversation_context: str = "") -> bool:
     ]
 
     # If conversation context exists and text is reasonably long, check relevance
-    if len(text.split()) >= 3:
+    if len(text_lower.split()) >= 3:
         # Allow medical context or reasonable conversational responses
         has_medical_keyword = any(keyword in text_lower for keyword in medical_keywords)
 
@@ -216,12 +265,35 @@ def is_coherent_medical_text(text: str, conversation_context: str = "") -> bool:
 
         if not (has_medical_keyword or has_conversational):
             # If no clear relevance and we have context, be more strict
-            if conversation_context and len(conversation_context) > 100:
+            if strict:
                 return False
 
     return True
 
 
+_SCORING_PREFIX = "Medical conversation context (most recent):\n"
+_SCORING_MID = "\n\nQuestions to evaluate for critical diagnostic importance:\n"
+_SCORING_SUFFIX_SW = "\n\n" + (
+    "Tathmini maswali yafuatayo kwa umuhimu wake wa msingi katika kuchunguza saratani (0 hadi 1). "
+    "MUHIMU: Toa alama ya juu zaidi kwa maswali ambayo:\n"
+    "1. Yanaweza kufichua dalili za saratani zinazobadilisha maisha (red flags)\n"
+    "2. Yangepunguzwa mgonjwa anaweza kuwa na uchunguzi usio sahihi wa saratani\n"
+    "3. Yanahitaji kuulizwa sasa ili kupata historia ya kutosha ya matibabu\n\n"
+    "Toa JSON pekee: [{\"question\":\"...\",\"score\":0.0,\"rationale\":\"...\"}, ...]. "
+    "Panga kwa score kubwa kwenda ndogo. Weka maswali 5-10 ya juu PEKEE. Hakuna maelezo mengine."
+)
+_SCORING_SUFFIX_EN = "\n\n" + (
+    "Score the following questions by their CRITICAL IMPORTANCE for cancer diagnosis (0 to 1). "
+    "IMPORTANT: Give highest scores to questions that:\n"
+    "1. Could reveal life-changing cancer red flags or symptoms\n"
+    "2. If not asked, the patient might be misdiagnosed or cancer missed\n"
+    "3. Are essential for establishing proper medical history NOW\n\n"
+    "Return ONLY JSON in this exact format: "
+    "[{\"question\":\"...\",\"score\":0.0,\"rationale\":\"why this is critical\"}, ...]. "
+    "Sort by descending score. Include ONLY the top 5-10 most critical questions. No extra text."
+)
+
+
 def rank_questions_for_unasked(convo_text: str, questions: List[str], language_mode: str = "bilingual") -> List[
     Dict[str, Any]]:
     """
@@ -238,6 +310,18 @@ def rank_questions_for_unasked(convo_text: str, questions: List[str], language_m
     questions = deduplicate_questions(questions)
 
     convo_text = (convo_text or "").strip()
+    conv_norm = normalize_text(convo_text)
+
+    # Questions that already appear verbatim in the conversation have been asked
+    if conv_norm:
+        questions = [q for q in questions if normalize_text(q) not in conv_norm]
+        if not questions:
+            return []
+
+    # Few questions left: the LLM would return the whole set anyway, so skip the round-trip
+    if len(questions) <= 5:
+        return [{"question": q, "score": 1.0} for q in questions]
+
     # Keep prompt bounded
     convo_clip = convo_text[-6000:] if len(convo_text) > 6000 else convo_text
 
@@ -249,33 +333,8 @@ def rank_questions_for_unasked(convo_text: str, questions: List[str], language_m
         if scorer:
             # Enhanced prompt with focus on critical diagnostic questions
             q_list = "\n".join([f"- {q}" for q in questions])
-            if language_mode == "swahili":
-                instruction = (
-                    "Tathmini maswali yafuatayo kwa umuhimu wake wa msingi katika kuchunguza saratani (0 hadi 1). "
-                    "MUHIMU: Toa alama ya juu zaidi kwa maswali ambayo:\n"
-                    "1. Yanaweza kufichua dalili za saratani zinazobadilisha maisha (red flags)\n"
-                    "2. Yangepunguzwa mgonjwa anaweza kuwa na uchunguzi usio sahihi wa saratani\n"
-                    "3. Yanahitaji kuulizwa sasa ili kupata historia ya kutosha ya matibabu\n\n"
-                    "Toa JSON pekee: [{\"question\":\"...\",\"score\":0.0,\"rationale\":\"...\"}, ...]. "
-                    "Panga kwa score kubwa kwenda ndogo. Weka maswali 5-10 ya juu PEKEE. Hakuna maelezo mengine."
-                )
-            else:
-                instruction = (
-                    "Score the following questions by their CRITICAL IMPORTANCE for cancer diagnosis (0 to 1). "
-                    "IMPORTANT: Give highest scores to questions that:\n"
-                    "1. Could reveal life-changing cancer red flags or symptoms\n"
-                    "2. If not asked, the patient might be misdiagnosed or cancer missed\n"
-                    "3. Are essential for establishing proper medical history NOW\n\n"
-                    "Return ONLY JSON in this exact format: "
-                    "[{\"question\":\"...\",\"score\":0.0,\"rationale\":\"why this is critical\"}, ...]. "
-                    "Sort by descending score. Include ONLY the top 5-10 most critical questions. No extra text."
-                )
-
-            prompt = (
-                f"Medical conversation context (most recent):\n{convo_clip}\n\n"
-                f"Questions to evaluate for critical diagnostic importance:\n{q_list}\n\n"
-                f"{instruction}"
-            )
+            suffix = _SCORING_SUFFIX_SW if language_mode == "swahili" else _SCORING_SUFFIX_EN
+            prompt = "".join((_SCORING_PREFIX, convo_clip, _SCORING_MID, q_list, suffix))
 
             scored_text = run_task(scorer, prompt, name="Critical Question Scoring")
             parsed = _safe_json_from_text(scored_text)
@@ -325,7 +384,6 @@ def rank_questions_for_unasked(convo_text: str, questions: List[str], language_m
 
     # ---------------- fallback heuristic ranking ----------------
     # Basic relevance: overlap with conversation tokens (last N chars)
-    conv_norm = normalize_text(convo_text)
     conv_tokens = set(conv_norm.split())
 
     ranked = []
@@ -350,39 +408,147 @@ def rank_questions_for_unasked(convo_text: str, questions: List[str], language_m
 LIVE_RECO_MIN_INTERVAL_SEC = 7
 
 
-def _recent_recommender_emitted(history: list | None, min_interval_sec: int) -> bool:
+# session_id -> time.monotonic() of the last recommender event emitted for that session.
+# Updated by sse_recommender so the live throttle is a dict lookup instead of a history scan.
+_LAST_RECO: dict[str, float] = {}
+_LAST_RECO_LOCK = threading.Lock()
+# Past this many sessions, entries older than the throttle interval (which can no longer throttle) are pruned
+_LAST_RECO_PRUNE_AT = 256
+
+
+def _mark_recommender_emitted(session_id) -> None:
+    if session_id is None:
+        return
+    now = time.monotonic()
+    with _LAST_RECO_LOCK:
+        _LAST_RECO[str(session_id)] = now
+        if len(_LAST_RECO) > _LAST_RECO_PRUNE_AT:
+            cutoff = now - LIVE_RECO_MIN_INTERVAL_SEC
+            for sid in [k for k, t in _LAST_RECO.items() if t < cutoff]:
+                del _LAST_RECO[sid]
+
+
+def _recent_recommender_emitted(session_id, min_interval_sec: int) -> bool:
     """
-    True if a question_recommender was emitted within the last min_interval_sec (based on timestamps in history).
-    Works with your stored history objects that include:
-      - type == "question_recommender"
-      - timestamp == "HH:MM:SS"
+    True if a question_recommender was emitted for this session within the last min_interval_sec.
     """
-    if not history:
+    if session_id is None:
         return False
+    with _LAST_RECO_LOCK:
+        last = _LAST_RECO.get(str(session_id))
+    if last is None:
+        return False
+    return (time.monotonic() - last) < float(min_interval_sec)
 
-    now = datetime.now()
 
-    for m in reversed(history):
-        try:
-            if (m.get("type") or "").strip().lower() != "question_recommender":
-                continue
-            ts = (m.get("timestamp") or "").strip()
-            if not ts:
-                return False
+# ---------------------------- ROLLING RECOMMENDER CONTEXT ----------------------------
 
-            dt = datetime.strptime(ts, "%H:%M:%S").time()
-            last_dt = datetime.combine(now.date(), dt)
+# Recommender prompts only need the recent tail of the conversation; keep it pre-formatted per session
+# so each turn formats just the new messages instead of the whole history.
+RECO_CONTEXT_MAX_CHARS = 9000
+RECO_CONTEXT_MAX_LINES = 200
+# Sessions kept at once; least recently used ones are dropped (and rebuilt from history if they return)
+RECO_CONTEXT_MAX_SESSIONS = 256
 
-            # handle midnight rollover safely (very rare)
-            if last_dt > now:
-                last_dt = datetime.combine(now.date(), dt)  # keep best-effort
 
-            return (now - last_dt).total_seconds() < float(min_interval_sec)
-        except Exception:
-            # If parsing fails, don't block recommendations
-            return False
+class _RollingContext:
+    """Pre-formatted "role: message" lines for one session, trimmed from the left to a char budget."""
+
+    __slots__ = ("lines", "total", "seen")
+
+    def __init__(self):
+        self.lines: deque[str] = deque()
+        self.total = 0  # sum of len(line) + 1 (newline) over self.lines
+        self.seen = 0   # number of history entries already appended
+
+    def append(self, line: str) -> None:
+        self.lines.append(line)
+        self.total += len(line) + 1
+        while len(self.lines) > 1 and (self.total > RECO_CONTEXT_MAX_CHARS or len(self.lines) > RECO_CONTEXT_MAX_LINES):
+            self.total -= len(self.lines.popleft()) + 1
+
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+
+_CONTEXT_BUFFERS: "OrderedDict[str, _RollingContext]" = OrderedDict()
+_CONTEXT_BUFFERS_LOCK = threading.Lock()
 
-    return False
+
+def forget_session(session_id) -> None:
+    """Drop per-session recommender state once its conversation is replaced (e.g. /reset_conv)."""
+    if session_id is None:
+        return
+    with _CONTEXT_BUFFERS_LOCK:
+        _CONTEXT_BUFFERS.pop(str(session_id), None)
+    with _LAST_RECO_LOCK:
+        _LAST_RECO.pop(str(session_id), None)
+
+
+def _session_context_text(session_id, history: list) -> str:
+    """Return the bounded recommender context for this session, appending only unseen history entries."""
+    if session_id is None:
+        ctx = _RollingContext()
+        for m in history:
+            ctx.append(f"{m.get('role')}: {m.get('message')}")
+        return ctx.text()
+
+    key = str(session_id)
+    with _CONTEXT_BUFFERS_LOCK:
+        ctx = _CONTEXT_BUFFERS.get(key)
+        if ctx is None or len(history) < ctx.seen:
+            # New session, or the history was reset underneath us
+            ctx = _RollingContext()
+            _CONTEXT_BUFFERS[key] = ctx
+            while len(_CONTEXT_BUFFERS) > RECO_CONTEXT_MAX_SESSIONS:
+                _CONTEXT_BUFFERS.popitem(last=False)
+        _CONTEXT_BUFFERS.move_to_end(key)
+        for m in history[ctx.seen:]:
+            ctx.append(f"{m.get('role')}: {m.get('message')}")
+        ctx.seen = len(history)
+        return ctx.text()
+
+
+# ---------------------------- RECOMMENDER PROMPTS ----------------------------
+
+# Bilingual recommender output: "English: ...\n\nSwahili: ..."
+_LANG_RE = re.compile(r"English:\s*(.+?)\n+Swahili:\s*(.+)", re.DOTALL)
+
+_RECO_INSTRUCTION = {
+    "english": "Suggest the next most relevant diagnostic question. Format: English: ...",
+    "swahili": "Pendekeza swali fupi la uchunguzi linalofuata. Format: Swahili: ...",
+    "bilingual": "Suggest the next most relevant bilingual question only. Format as:\nEnglish: ...\n\nSwahili: ...",
+}
+
+_FIRST_QUESTION_NOTE = (
+    " This is the FIRST question - the patient has just presented. You MUST suggest a specific diagnostic question "
+    "based on their opening statement. Do NOT say you need more information or ask for details - use what they said.\n\n"
+)
+
+_EARLY_TURN_NOTE = (
+    " This is the first or early turn - the patient has just presented. You MUST suggest a specific diagnostic question "
+    "based on what they said. Do NOT say you need more information or ask for details - use what they said.\n\n"
+)
+
+
+def _split_recommendation(rec: str, language_mode: str) -> tuple[str, str]:
+    """Split recommender output into (english, swahili) for the session's language mode."""
+    stripped = rec.strip()
+    if language_mode == "english":
+        return stripped, ""
+    if language_mode == "swahili":
+        return "", stripped
+    # Only run the regex when both labels are actually present
+    if "English:" in stripped and "Swahili:" in stripped:
+        match = _LANG_RE.search(stripped)
+        if match:
+            return match.group(1).strip(), match.group(2).strip()
+    return stripped, ""
+
+
+def _recommender_prompt(context_text: str, first_turn_note: str, language_mode: str) -> str:
+    instruction = _RECO_INSTRUCTION.get(language_mode, _RECO_INSTRUCTION["bilingual"])
+    return "".join((context_text, "\n\n", first_turn_note, instruction))
 
 
 # ---------------------------- EXISTING CORE ----------------------------
@@ -403,23 +569,42 @@ def run_task(agent, input_text, name="Step"):
 
 
 # Helpers
+_LAST_TS: tuple[int, str] = (0, "")
+
+
+def _ts_now() -> str:
+    """Local "HH:MM:SS", formatted at most once per wall-clock second."""
+    global _LAST_TS
+    t = int(time.time())
+    cached = _LAST_TS
+    if cached[0] != t:
+        cached = (t, time.strftime("%H:%M:%S", time.localtime(t)))
+        _LAST_TS = cached  # single tuple swap, safe to race between SSE threads
+    return cached[1]
+
+
+def _sse_data(payload: dict) -> bytes:
+    """Serialize one SSE `data:` frame; orjson returns UTF-8 bytes, which Flask streams as-is."""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
 def format_event(role, message):
-    return "data: " + json.dumps({
+    return _sse_data({
         "role": role,
         "message": (message or "").strip(),
-        "timestamp": datetime.now().strftime("%H:%M:%S")
-    }) + "\n\n"
+        "timestamp": _ts_now()
+    })
 
 
 def format_event_recommender(english, swahili):
-    return "data: " + json.dumps({
+    return _sse_data({
         "type": "question_recommender",
         "question": {
             "english": (english or "").strip(),
             "swahili": (swahili or "").strip()
         },
-        "timestamp": datetime.now().strftime("%H:%M:%S"),
-    }) + "\n\n"
+        "timestamp": _ts_now(),
+    })
 
 
 def format_bilingual(english: str, swahili: str) -> str:
@@ -427,15 +612,15 @@ def format_bilingual(english: str, swahili: str) -> str:
 
 
 def sse_message(role, message, log_hook=None, session_id=None):
-    ts = datetime.now().strftime("%H:%M:%S")
+    ts = _ts_now()
     payload = {"role": role, "message": (message or "").strip(), "timestamp": ts}
     if log_hook:
         log_hook(session_id, role, payload["message"], ts, "message")
-    return "data: " + json.dumps(payload) + "\n\n"
+    return _sse_data(payload)
 
 
 def sse_recommender(english, swahili, log_hook=None, session_id=None):
-    ts = datetime.now().strftime("%H:%M:%S")
+    ts = _ts_now()
     payload = {
         "type": "question_recommender",
         "question": {"english": (english or "").strip(), "swahili": (swahili or "").strip()},
@@ -444,7 +629,8 @@ def sse_recommender(english, swahili, log_hook=None, session_id=None):
     if log_hook:
         msg = f"Recommended Q | EN: {payload['question']['english']} | SW: {payload['question']['swahili']}"
         log_hook(session_id, "Question Recommender", msg, ts, "question_recommender")
-    return "data: " + json.dumps(payload) + "\n\n"
+    _mark_recommender_emitted(session_id)
+    return _sse_data(payload)
 
 
 # Mode 1: Fully simulated
@@ -478,19 +664,8 @@ def simulate_agent_chat_stepwise(initial_message: str, turns: int = 6, language_
 
     for turn in range(turns):
         # question recommender
-        first_turn_note = "" if turn > 0 else (
-            " This is the FIRST question - the patient has just presented. You MUST suggest a specific diagnostic question "
-            "based on their opening statement. Do NOT say you need more information or ask for details - use what they said.\n\n"
-        )
-        if language_mode == "english":
-            recommender_input = "\n".join(
-                context_log) + f"\n\n{first_turn_note}Suggest the next most relevant diagnostic question. Format: English: ..."
-        elif language_mode == "swahili":
-            recommender_input = "\n".join(
-                context_log) + f"\n\n{first_turn_note}Pendekeza swali fupi la uchunguzi linalofuata. Format: Swahili: ..."
-        else:
-            recommender_input = "\n".join(
-                context_log) + f"\n\n{first_turn_note}Suggest the next most relevant bilingual question only. Format as:\nEnglish: ...\n\nSwahili: ..."
+        first_turn_note = "" if turn > 0 else _FIRST_QUESTION_NOTE
+        recommender_input = _recommender_prompt("\n".join(context_log), first_turn_note, language_mode)
 
         try:
             recommended = run_task(agents["question_recommender_agent"], recommender_input,
@@ -500,16 +675,7 @@ def simulate_agent_chat_stepwise(initial_message: str, turns: int = 6, language_
             yield sse_message("system", f"[Error: AI failed on this turn. {e}]", log_hook, session_id)
             return
 
-        if language_mode == "english":
-            english_q, swahili_q = recommended.strip(), ""
-        elif language_mode == "swahili":
-            english_q, swahili_q = "", recommended.strip()
-        else:
-            match = re.search(r"English:\s*(.+?)\n+Swahili:\s*(.+)", recommended, re.DOTALL)
-            if match:
-                english_q, swahili_q = match.group(1).strip(), match.group(2).strip()
-            else:
-                english_q, swahili_q = recommended.strip(), ""
+        english_q, swahili_q = _split_recommendation(recommended, language_mode)
 
         if language_mode == "english":
             plain_q = f"{english_q}"
@@ -589,31 +755,13 @@ def real_actor_chat_stepwise(initial_message: str, language_mode: str = 'bilingu
     # Suggest next question after any message (patient or clinician)
     lower_role = speaker_role.lower()
     if lower_role in ("patient", "clinician"):
-        context_lines = [f"{m.get('role')}: {m.get('message')}" for m in history]
-        context_text = "\n".join(context_lines)
-        first_turn_note = "" if len(history) > 2 else (
-            " This is the first or early turn - the patient has just presented. You MUST suggest a specific diagnostic question "
-            "based on what they said. Do NOT say you need more information or ask for details - use what they said.\n\n"
-        )
-        if language_mode == "english":
-            recommender_input = context_text + f"\n\n{first_turn_note}Suggest the next most relevant diagnostic question. Format: English: ..."
-        elif language_mode == "swahili":
-            recommender_input = context_text + f"\n\n{first_turn_note}Pendekeza swali fupi la uchunguzi linalofuata. Format: Swahili: ..."
-        else:
-            recommender_input = context_text + f"\n\n{first_turn_note}Suggest the next most relevant bilingual question only. Format as:\nEnglish: ...\n\nSwahili: ..."
+        context_text = _session_context_text(session_id, history)
+        first_turn_note = "" if len(history) > 2 else _EARLY_TURN_NOTE
+        recommender_input = _recommender_prompt(context_text, first_turn_note, language_mode)
 
         rec = run_task(agents["question_recommender_agent"], recommender_input, "Question Suggestion")
 
-        if language_mode == "english":
-            english_q, swahili_q = rec.strip(), ""
-        elif language_mode == "swahili":
-            english_q, swahili_q = "", rec.strip()
-        else:
-            match = re.search(r"English:\s*(.+?)\n+Swahili:\s*(.+)", rec, re.DOTALL)
-            if match:
-                english_q, swahili_q = match.group(1).strip(), match.group(2).strip()
-            else:
-                english_q, swahili_q = rec.strip(), ""
+        english_q, swahili_q = _split_recommendation(rec, language_mode)
 
         yield sse_recommender(english_q, swahili_q, log_hook, session_id)
 
@@ -663,40 +811,23 @@ def live_transcription_stream(initial_message: str,
     # -------------------- SURGICAL THROTTLE (NEW) --------------------
     # If we recently emitted a recommender item, skip generating another one too quickly.
     # This reduces "normal" live suggestion flooding without affecting other modes.
-    if _recent_recommender_emitted(history, LIVE_RECO_MIN_INTERVAL_SEC):
+    if _recent_recommender_emitted(session_id, LIVE_RECO_MIN_INTERVAL_SEC):
         return
     # ---------------------------------------------------------------
 
     # 2) Build recommender context from full history (incl. current patient message for first turn)
     # For first turn, history may not include the just-emitted patient line; include it in context
-    effective_history = list(history)
-    if not any((m.get("role") or "").lower() == "patient" and (m.get("message") or "").strip() == final_text.strip() for m in effective_history):
-        effective_history = [{"role": "Patient", "message": final_text}] + list(effective_history)
-    context_lines = [f"{m.get('role')}: {m.get('message')}" for m in effective_history]
-    context_text = "\n".join(context_lines)
-    first_turn_note = "" if len(effective_history) > 2 else (
-        " This is the first or early turn - the patient has just presented. You MUST suggest a specific diagnostic question "
-        "based on what they said. Do NOT say you need more information or ask for details - use what they said.\n\n"
-    )
-    if language_mode == "english":
-        recommender_input = context_text + f"\n\n{first_turn_note}Suggest the next most relevant diagnostic question. Format: English: ..."
-    elif language_mode == "swahili":
-        recommender_input = context_text + f"\n\n{first_turn_note}Pendekeza swali fupi la uchunguzi linalofuata. Format: Swahili: ..."
-    else:
-        recommender_input = context_text + f"\n\n{first_turn_note}Suggest the next most relevant bilingual question only. Format as:\nEnglish: ...\n\nSwahili: ..."
+    context_text = _session_context_text(session_id, history)
+    n_effective = len(history)
+    if not any((m.get("role") or "").lower() == "patient" and (m.get("message") or "").strip() == final_text for m in history):
+        context_text = f"Patient: {final_text}" + ("\n" + context_text if context_text else "")
+        n_effective += 1
+    first_turn_note = "" if n_effective > 2 else _EARLY_TURN_NOTE
+    recommender_input = _recommender_prompt(context_text, first_turn_note, language_mode)
 
     rec = run_task(agents["question_recommender_agent"], recommender_input, "Question Suggestion")
 
-    if language_mode == "english":
-        english_q, swahili_q = rec.strip(), ""
-    elif language_mode == "swahili":
-        english_q, swahili_q = "", rec.strip()
-    else:
-        match = re.search(r"English:\s*(.+?)\n+Swahili:\s*(.+)", rec, re.DOTALL)
-        if match:
-            english_q, swahili_q = match.group(1).strip(), match.group(2).strip()
-        else:
-            english_q, swahili_q = rec.strip(), ""
+    english_q, swahili_q = _split_recommendation(rec, language_mode)
 
     yield sse_recommender(english_q, swahili_q, log_hook, session_id)
     return
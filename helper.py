@@ -1,11 +1,17 @@
 import os
-import json
 import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+import orjson
 from docx import Document
 from dotenv import load_dotenv, find_dotenv
 from langdetect import detect
 # pyttsx3, speech_recognition: optional - only for speak()/listen(); imported lazily
 
+# Headings like: Standardized Patient Case 10
+_CASE_RE = re.compile(r'Standardized Patient Case\s+(\d+)', re.IGNORECASE)
+
 # === ENV HANDLING ===
 def load_env():
     _ = load_dotenv(find_dotenv())
@@ -17,24 +23,59 @@ def get_openai_api_key():
 # === READER ===
 def read_docx(file_path):
     doc = Document(file_path)
-    return "\n".join([p.text for p in doc.paragraphs])
+    return "\n".join(p.text for p in doc.paragraphs)
 
 # === LANGUAGE DETECTION UTILS ===
-def detect_lang(text):
+# fasttext lid.176 is optional; without it (or its model file) we fall back to langdetect
+LID_MODEL_PATH = os.getenv("LID_MODEL_PATH", "lid.176.ftz")
+_LID = None
+
+def _get_lid_model():
+    global _LID
+    if _LID is None:
+        try:
+            import fasttext
+            _LID = fasttext.load_model(LID_MODEL_PATH)
+        except (ImportError, ValueError, OSError):
+            _LID = False
+    return _LID
+
+@lru_cache(maxsize=4096)
+def _detect_lang_cached(snippet):
+    lid = _get_lid_model()
     try:
-        return detect(text)
-    except:
+        if lid:
+            return lid.predict(snippet.replace("\n", " "), k=1)[0][0].replace("__label__", "")
+        return detect(snippet)
+    except Exception:
         return "unknown"
 
+def detect_lang(text):
+    # The first 64 chars identify the language and keep the cache key small
+    return _detect_lang_cached(text[:64])
+
 # === SECTION EXTRACTOR ===
-def extract_section_lines(lines, start_headers, stop_headers):
+def _header_re(headers):
+    """One alternation over the lowercased headers; matched against lines lowercased once per case."""
+    return re.compile("|".join(re.escape(h.lower()) for h in headers))
+
+_PB_START_RE = _header_re(["Patient Background", "Asili ya Mgonjwa"])
+_PB_STOP_RE = _header_re(["Chief Complaint", "Malalamiko makuu"])
+_CC_START_RE = _header_re(["Chief Complaint", "History of Present Illness", "Malalamiko makuu", "Historia ya Ugonjwa wa Sasa"])
+_CC_STOP_RE = _header_re(["Medical & Social History", "Historia ya Matibabu", "Opening Statement", "Taarifa ya ufunguzi"])
+_MS_START_RE = _header_re(["Medical & Social History", "Historia ya Matibabu na Jamii"])
+_MS_STOP_RE = _header_re(["Opening Statement", "Taarifa ya ufunguzi"])
+_OP_START_RE = _header_re(["Opening statement:", "Taarifa ya ufunguzi:"])
+_OP_STOP_RE = _header_re(["Provider Questions", "Maswali ya Mtoa Huduma"])
+
+def extract_section_lines(lines, lines_lower, start_re, stop_re):
     section_lines = []
     in_section = False
-    for line in lines:
-        if any(h.lower() in line.lower() for h in start_headers):
+    for line, line_lower in zip(lines, lines_lower):
+        if start_re.search(line_lower):
             in_section = True
             continue
-        if in_section and any(h.lower() in line.lower() for h in stop_headers):
+        if in_section and stop_re.search(line_lower):
             break
         if in_section:
             section_lines.append(line)
@@ -50,45 +91,41 @@ def split_by_language_block(section_lines):
     swahili = " ".join(lines[midpoint:])
     return english.strip(), swahili.strip()
 
+def split_block_range(lines):
+    """Like split_by_language_block, for lines that are already stripped and non-empty."""
+    midpoint = len(lines) // 2
+    return " ".join(lines[:midpoint]), " ".join(lines[midpoint:])
+
 # === CASE SPLITTER ===
 def split_cases(full_text):
-    # Match headings like: Standardized Patient Case 10
-    cases = re.split(r'Standardized Patient Case\s+(\d+)', full_text, flags=re.IGNORECASE)
-    cases = cases[1:]  # remove anything before the first match
-    return [{'case_id': cases[i], 'content': cases[i+1]} for i in range(0, len(cases), 2)]
+    # Locate headings once and slice each case body straight out of full_text;
+    # anything before the first heading is never copied.
+    matches = list(_CASE_RE.finditer(full_text))
+    ends = [m.start() for m in matches[1:]] + [len(full_text)]
+    return [{'case_id': m.group(1), 'content': full_text[m.end():end]} for m, end in zip(matches, ends)]
 
 # === PARSER ===
 def extract_case_fields(case_data):
     content = case_data['content']
+    # Stripped and non-empty from here on, so section blocks can be split without re-stripping
     lines = [line.strip() for line in content.split('\n') if line.strip()]
+    lines_lower = [line.lower() for line in lines]
 
     # Patient Background
-    pb_lines = extract_section_lines(lines, ["Patient Background", "Asili ya Mgonjwa"], ["Chief Complaint", "Malalamiko makuu"])
-    pb_en, pb_sw = split_by_language_block(pb_lines)
+    pb_lines = extract_section_lines(lines, lines_lower, _PB_START_RE, _PB_STOP_RE)
+    pb_en, pb_sw = split_block_range(pb_lines)
 
     # Chief Complaint & History of Present Illness
-    cc_lines = extract_section_lines(
-        lines,
-        ["Chief Complaint", "History of Present Illness", "Malalamiko makuu", "Historia ya Ugonjwa wa Sasa"],
-        ["Medical & Social History", "Historia ya Matibabu", "Opening Statement", "Taarifa ya ufunguzi"]
-    )
-    cc_en, cc_sw = split_by_language_block(cc_lines)
+    cc_lines = extract_section_lines(lines, lines_lower, _CC_START_RE, _CC_STOP_RE)
+    cc_en, cc_sw = split_block_range(cc_lines)
 
     # Medical & Social History
-    ms_lines = extract_section_lines(
-        lines,
-        ["Medical & Social History", "Historia ya Matibabu na Jamii"],
-        ["Opening Statement", "Taarifa ya ufunguzi"]
-    )
-    ms_en, ms_sw = split_by_language_block(ms_lines)
+    ms_lines = extract_section_lines(lines, lines_lower, _MS_START_RE, _MS_STOP_RE)
+    ms_en, ms_sw = split_block_range(ms_lines)
 
     # Opening Statement
-    op_lines = extract_section_lines(
-        lines,
-        ["Opening statement:", "Taarifa ya ufunguzi:"],
-        ["Provider Questions", "Maswali ya Mtoa Huduma"]
-    )
-    op_en, op_sw = split_by_language_block(op_lines)
+    op_lines = extract_section_lines(lines, lines_lower, _OP_START_RE, _OP_STOP_RE)
+    op_en, op_sw = split_block_range(op_lines)
 
     # Extract Provider Questions and SP Responses
     questions = extract_questions_bilingual(lines)
@@ -117,41 +154,38 @@ def extract_case_fields(case_data):
     }
 
 def extract_questions_bilingual(lines):
-    questions = []
-    in_section = False
-    i = 0
-    while i < len(lines):
-        line = lines[i]
-        if "Provider Questions" in line or "Maswali ya Mtoa Huduma" in line:
-            in_section = True
-            i += 1
-            continue
+    try:
+        start = next(i for i, line in enumerate(lines)
+                     if "Provider Questions" in line or "Maswali ya Mtoa Huduma" in line) + 1
+    except StopIteration:
+        return []
 
-        if in_section:
-            if i + 3 < len(lines):
-                q_en = lines[i].strip()
-                q_sw = lines[i+1].strip()
-                a_en_line = lines[i+2].strip()
-                a_sw = lines[i+3].strip()
-
-                a_en = ""
-                if a_en_line.lower().startswith('a.'):
-                    a_en = a_en_line[2:].strip()
-                else:
-                    a_en = a_en_line
-
-                questions.append({
-                    "question": {"english": q_en, "swahili": q_sw},
-                    "response": {"english": a_en, "swahili": a_sw}
-                })
-                i += 4
-            else:
-                break
-        else:
-            i += 1
+    # Question EN, question SW, answer EN ("A. ..."), answer SW; a trailing partial group is dropped
+    questions = []
+    it = iter(lines[start:])
+    for q_en, q_sw, a_en_line, a_sw in zip(it, it, it, it):
+        a_en = a_en_line[2:].strip() if a_en_line[:2].lower() == 'a.' else a_en_line
+        questions.append({
+            "question": {"english": q_en, "swahili": q_sw},
+            "response": {"english": a_en, "swahili": a_sw}
+        })
 
     return questions
 
+# === PIPELINE ===
+# Below this many cases, worker start-up costs more than parsing in-process
+_PARALLEL_MIN_CASES = 32
+
+def parse_cases(full_text, max_workers=None):
+    """Split a document into cases and parse + red-flag them, across processes for large documents."""
+    cases = split_cases(full_text)
+    if len(cases) < _PARALLEL_MIN_CASES:
+        parsed = [extract_case_fields(c) for c in cases]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as ex:
+            parsed = list(ex.map(extract_case_fields, cases, chunksize=8))
+    return [label_red_flags(c) for c in parsed]
+
 # === JSON WRITER ===
 def write_to_json(cases, filename="cases.json"):
     # Convert red_flags list to dictionary format if needed
@@ -169,8 +203,7 @@ def write_to_json(cases, filename="cases.json"):
                     red_dict[flag] = True  # fallback
             case["red_flags"] = red_dict
 
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(cases, f, ensure_ascii=False, indent=2)
+    Path(filename).write_bytes(orjson.dumps(cases, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
 
 #def write_to_json(cases, filename="cases_new.jsonl"):
  #   with open(filename, "w", encoding="utf-8") as f:
@@ -186,18 +219,20 @@ def write_to_json(cases, filename="cases.json"):
     #return filename
 
 # === RED FLAG TAGGER ===
+# Every term the rules below look for, found in one case-insensitive pass per section
+_FLAG_TERMS_RE = re.compile(r"months|pain|bleeding|weight loss|blood", re.IGNORECASE)
+
 def label_red_flags(case_data):
     red_flags = []
     for section_key in ["patient_background", "chief_complaint_history", "medical_social_history"]:
         section_data = case_data.get(section_key, {})
-        en = section_data.get("english", "").lower()
-        sw = section_data.get("swahili", "").lower()
-        combined = en + " " + sw
-        if "months" in combined and ("pain" in combined or "bleeding" in combined):
+        combined = section_data.get("english", "") + " " + section_data.get("swahili", "")
+        found = {term.lower() for term in _FLAG_TERMS_RE.findall(combined)}
+        if "months" in found and ("pain" in found or "bleeding" in found):
             red_flags.append("Symptom duration > 3 months")
-        if "weight loss" in combined:
+        if "weight loss" in found:
             red_flags.append("Unintentional weight loss")
-        if "blood" in combined:
+        if "blood" in found:
             red_flags.append("Possible cancer-related bleeding")
     case_data["red_flags"] = red_flags
     return case_data
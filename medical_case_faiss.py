@@ -1,10 +1,17 @@
-import json
 import os
 import numpy as np
 import faiss
+import orjson
+import torch
 import pickle
-from typing import List, Dict, Any, Tuple
+import threading
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple
 from sentence_transformers import SentenceTransformer
+try:
+    import ijson  # optional: streams very large case files in build_database
+except ImportError:
+    ijson = None
 import logging
 from dataclasses import dataclass
 from pathlib import Path
@@ -13,6 +20,23 @@ from pathlib import Path
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Below this many cases an exact IndexFlatIP scan is cheap and needs no training;
+# larger corpora use IVF{nlist},PQ{PQ_M}x8 with nlist ~ 4*sqrt(N).
+FLAT_MAX_CASES = 10_000
+PQ_M = 48  # sub-quantizers; must divide the 384-d MiniLM embedding
+
+# Case files at least this large are streamed with ijson (when installed) and
+# encoded every STREAM_ENCODE_CHUNK cases instead of being parsed in one go.
+STREAM_JSON_MIN_BYTES = 64 * 1024 * 1024
+STREAM_ENCODE_CHUNK = 256
+
+# Query-time beam width for HNSW indexes saved by earlier builds
+HNSW_EF_SEARCH = 16
+
+# Token cap for the ONNX encoder: the sentence-transformer's max_seq_length for MiniLM
+# (its tokenizer alone reports 512)
+ONNX_MAX_SEQ_LENGTH = 256
+
 
 @dataclass
 class CaseSearchResult:
@@ -34,19 +58,65 @@ class MedicalCaseFAISS:
     Optimized for Flask web application use
     """
 
-    def __init__(self, model_name: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'all-MiniLM-L6-v2')):
+    # (case key, label used in the embedded text)
+    _BILINGUAL_FIELDS = (
+        ('patient_background', "Background"),
+        ('chief_complaint_history', "Chief Complaint"),
+        ('medical_social_history', "Medical History"),
+        ('opening_statement', "Opening Statement"),
+    )
+
+    def __init__(self, model_name: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'all-MiniLM-L6-v2'),
+                 use_onnx: bool = False, use_gpu: bool = False, num_threads: Optional[int] = None):
         """
         Initialize the FAISS database system
 
         Args:
             model_name: Name of the sentence transformer model to use for embeddings
+            use_onnx: Encode through an int8-quantized ONNX Runtime export of the model
+            use_gpu: Clone the index to GPU 0 after build/load when FAISS sees a GPU
+            num_threads: FAISS OpenMP threads for this process (1 for per-request serving,
+                cores / workers for bulk); None keeps the all-cores default
         """
-        self.model = SentenceTransformer(model_name)
+        if num_threads:
+            faiss.omp_set_num_threads(num_threads)
+        self.model_name = model_name
+        # Encode on the GPU when torch sees one; the FAISS index itself can stay on CPU
+        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        # The SentenceTransformer is loaded on first use (see the model property), so
+        # processes that only load an index and look cases up never pay for it.
+        self._model = None
+        self._model_lock = threading.Lock()
+        self.use_onnx = use_onnx
+        self._onnx_model = None
+        self._onnx_tokenizer = None
+        self._onnx_max_length = None
+        self.use_gpu = use_gpu
+        self._gpu_resources = None
         self.index = None
         self.cases = []
-        self.case_embeddings = []
+        self._case_by_id: Dict[str, Dict[str, Any]] = {}
         self.dimension = None
-        logger.info(f"Initialized MedicalCaseFAISS with model: {model_name}")
+        self.nprobe = None
+        self._ivf = None  # IVF layer of self.index, if any (nprobe is tuned per query)
+        # Per-instance LRU of normalized query vectors, keyed by the stripped, lowercased query
+        self._encode_query = lru_cache(maxsize=1024)(self._encode_query_uncached)
+        logger.info(f"Initialized MedicalCaseFAISS with model: {model_name} on {self.device}")
+
+    @property
+    def model(self) -> SentenceTransformer:
+        """The sentence-transformer, loaded once on first access (thread-safe)."""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    logger.info(f"Loading sentence-transformer {self.model_name} on {self.device}")
+                    self._model = SentenceTransformer(self.model_name, device=self.device)
+        return self._model
+
+    @classmethod
+    def set_encode_threads(cls, n: int) -> None:
+        """Cap torch intra-op threads used by the encoder (process-wide)."""
+        torch.set_num_threads(n)
 
     def _extract_case_text(self, case: Dict[str, Any]) -> str:
         """
@@ -60,49 +130,18 @@ class MedicalCaseFAISS:
         """
         text_parts = []
 
-        # Patient background (both languages)
-        if 'patient_background' in case:
-            bg = case['patient_background']
-            if isinstance(bg, dict):
-                if 'english' in bg and bg['english']:
-                    text_parts.append(f"Background: {bg['english']}")
-                if 'swahili' in bg and bg['swahili']:
-                    text_parts.append(f"Background (Swahili): {bg['swahili']}")
-            elif isinstance(bg, str) and bg:
-                text_parts.append(f"Background: {bg}")
-
-        # Chief complaint history
-        if 'chief_complaint_history' in case:
-            cc = case['chief_complaint_history']
-            if isinstance(cc, dict):
-                if 'english' in cc and cc['english']:
-                    text_parts.append(f"Chief Complaint: {cc['english']}")
-                if 'swahili' in cc and cc['swahili']:
-                    text_parts.append(f"Chief Complaint (Swahili): {cc['swahili']}")
-            elif isinstance(cc, str) and cc:
-                text_parts.append(f"Chief Complaint: {cc}")
-
-        # Medical social history
-        if 'medical_social_history' in case:
-            msh = case['medical_social_history']
-            if isinstance(msh, dict):
-                if 'english' in msh and msh['english']:
-                    text_parts.append(f"Medical History: {msh['english']}")
-                if 'swahili' in msh and msh['swahili']:
-                    text_parts.append(f"Medical History (Swahili): {msh['swahili']}")
-            elif isinstance(msh, str) and msh:
-                text_parts.append(f"Medical History: {msh}")
-
-        # Opening statement
-        if 'opening_statement' in case:
-            os = case['opening_statement']
-            if isinstance(os, dict):
-                if 'english' in os and os['english']:
-                    text_parts.append(f"Opening Statement: {os['english']}")
-                if 'swahili' in os and os['swahili']:
-                    text_parts.append(f"Opening Statement (Swahili): {os['swahili']}")
-            elif isinstance(os, str) and os:
-                text_parts.append(f"Opening Statement: {os}")
+        # Bilingual narrative sections (dict with english/swahili, or a plain string)
+        for key, label in self._BILINGUAL_FIELDS:
+            value = case.get(key)
+            if isinstance(value, dict):
+                english = value.get('english')
+                swahili = value.get('swahili')
+                if english:
+                    text_parts.append(f"{label}: {english}")
+                if swahili:
+                    text_parts.append(f"{label} (Swahili): {swahili}")
+            elif isinstance(value, str) and value:
+                text_parts.append(f"{label}: {value}")
 
         # Recommended questions (extract key symptoms/conditions)
         if 'recommended_questions' in case and isinstance(case['recommended_questions'], list):
@@ -118,21 +157,14 @@ class MedicalCaseFAISS:
             if questions:
                 text_parts.append(f"Questions and Responses: {' '.join(questions)}")
 
-        # Red flags
-        if 'red_flags' in case and isinstance(case['red_flags'], dict):
-            red_flags_text = []
-            for key, value in case['red_flags'].items():
-                if value and str(value).strip():  # Only include non-empty values
-                    red_flags_text.append(f"{key}: {value}")
-            if red_flags_text:
-                text_parts.append(f"Red Flags: {' '.join(red_flags_text)}")
-        if 'Suspected_illness' in case and isinstance(case['Suspected_illness'], dict):
-            Suspected_illness = []
-            for key, value in case['Suspected_illness'].items():
-                if value and str(value).strip():  # Only include non-empty values
-                    Suspected_illness.append(f"{key}: {value}")
-            if Suspected_illness:
-                text_parts.append(f"Suspected_illness: {' '.join(red_flags_text)}")
+        # Red flags / suspected illness: "key: value" pairs, skipping empty values
+        for key, label in (('red_flags', "Red Flags"), ('Suspected_illness', "Suspected_illness")):
+            value = case.get(key)
+            if isinstance(value, dict):
+                joined = " ".join(f"{k}: {v}" for k, v in value.items()
+                                  if v and (not isinstance(v, str) or v.strip()))
+                if joined:
+                    text_parts.append(f"{label}: {joined}")
 
         return " ".join(text_parts)
 #Suspected_illness
@@ -145,17 +177,20 @@ class MedicalCaseFAISS:
         """
         logger.info(f"Loading cases from {json_file_path}")
 
-        # Load JSON data
-        with open(json_file_path, 'r', encoding='utf-8') as f:
-            cases_data = json.load(f)
-
-        logger.info(f"Loaded {len(cases_data)} cases from JSON")
+        path = Path(json_file_path)
+        streaming = ijson is not None and path.stat().st_size >= STREAM_JSON_MIN_BYTES
+        if streaming:
+            logger.info("Streaming cases with ijson, encoding every %d cases", STREAM_ENCODE_CHUNK)
+        batch_size = 128 if self.device == 'cuda' else 32
 
         # Process cases and filter out empty ones
         processed_cases = []
-        case_texts = []
+        case_texts = []  # texts not yet encoded
+        chunks = []
+        n_loaded = 0
 
-        for i, case in enumerate(cases_data):
+        for i, case in enumerate(self._iter_cases(path, streaming)):
+            n_loaded += 1
             # Add case_id if not present
             if 'case_id' not in case:
                 case['case_id'] = f"case_{i + 1}"
@@ -166,31 +201,215 @@ class MedicalCaseFAISS:
             if text.strip():  # Only include cases with non-empty text
                 processed_cases.append(case)
                 case_texts.append(text)
-                logger.info(f"Processed case {i + 1}: {case['case_id']} ({len(text)} chars)")
+                logger.debug("Processed case %d: %s (%d chars)", i + 1, case['case_id'], len(text))
             else:
-                logger.warning(f"Skipped case {i + 1}: {case.get('case_id', 'no-id')} (empty text)")
+                logger.warning("Skipped case %d: %s (empty text)", i + 1, case.get('case_id', 'no-id'))
+
+            if streaming and len(case_texts) >= STREAM_ENCODE_CHUNK:
+                chunks.append(self.encode_texts(case_texts, batch_size=batch_size))
+                case_texts = []
 
         self.cases = processed_cases
-        logger.info(f"Processing {len(self.cases)} cases with valid text content")
+        logger.info("Processed %d/%d cases (%d skipped)",
+                    len(processed_cases), n_loaded, n_loaded - len(processed_cases))
 
-        if not case_texts:
+        if not processed_cases:
             raise ValueError("No valid cases found with text content")
 
         logger.info("Creating embeddings...")
-        embeddings = self.model.encode(case_texts, show_progress_bar=True)
-        self.case_embeddings = embeddings
+        # Normalized in the encoder so inner product equals cosine similarity
+        if case_texts:
+            chunks.append(self.encode_texts(case_texts, batch_size=batch_size, show_progress_bar=not streaming))
+        embeddings = chunks[0] if len(chunks) == 1 else np.vstack(chunks)
 
-        # Initialize FAISS index
+        # Initialize FAISS index (inner product for similarity)
         self.dimension = embeddings.shape[1]
-        self.index = faiss.IndexFlatIP(self.dimension)  # Inner product for similarity
+        n_cases = len(embeddings)
+        if n_cases < FLAT_MAX_CASES:
+            self.index = faiss.IndexFlatIP(self.dimension)
+        else:
+            nlist = int(4 * np.sqrt(n_cases))
+            self.index = faiss.index_factory(self.dimension, f"IVF{nlist},PQ{PQ_M}x8", faiss.METRIC_INNER_PRODUCT)
+            self.index.train(embeddings)
+            self.nprobe = max(1, nlist // 32)
+
+        # Add embeddings to index; the index is the only copy kept (see sample_embeddings)
+        self.index.add(embeddings)
+        del embeddings
+        self._apply_search_params()
+        self._maybe_to_gpu()
+
+        self.clear_query_cache()
+        self._index_cases()
 
-        # Normalize embeddings for cosine similarity
-        faiss.normalize_L2(embeddings)
+        logger.info(f"Built FAISS index with {self.index.ntotal} cases")
 
-        # Add embeddings to index
-        self.index.add(embeddings.astype('float32'))
+    @staticmethod
+    def _iter_cases(path: Path, streaming: bool):
+        """Yield case dicts from a JSON array file, incrementally when streaming."""
+        if streaming:
+            with open(path, 'rb') as f:
+                yield from ijson.items(f, 'item', use_float=True)
+        else:
+            yield from orjson.loads(path.read_bytes())
+
+    def encode_texts(self, texts: List[str], batch_size: int = 32, normalize: bool = True,
+                     show_progress_bar: bool = False) -> np.ndarray:
+        """
+        Encode texts in token-length order so each batch pads to a similar length
 
-        logger.info(f"Built FAISS index with {self.index.ntotal} cases")
+        Args:
+            texts: Texts to embed
+            batch_size: Encoder batch size
+            normalize: L2-normalise embeddings inside the encoder
+            show_progress_bar: Forwarded to SentenceTransformer.encode
+
+        Returns:
+            float32 embeddings in the original order of ``texts``
+        """
+        if self.use_onnx:
+            # Measure with the ONNX tokenizer so the PyTorch encoder is never loaded on this path
+            if self._onnx_model is None:
+                self._load_onnx_encoder()
+            tokenizer = self._onnx_tokenizer
+        else:
+            tokenizer = self.model.tokenizer
+        lengths = [len(tokenizer.tokenize(t)) for t in texts]
+        order = np.argsort(lengths, kind='stable')
+        sorted_texts = [texts[i] for i in order]
+        if self.use_onnx:
+            embeddings = self.encode_onnx(sorted_texts, batch_size=batch_size, normalize=normalize)
+        else:
+            embeddings = self.model.encode(
+                sorted_texts,
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=normalize,
+                show_progress_bar=show_progress_bar,
+            )
+        # Undo the length sort so row i matches texts[i]; fancy indexing yields a fresh C-contiguous array
+        return np.ascontiguousarray(embeddings[np.argsort(order)], dtype=np.float32)
+
+    def _load_onnx_encoder(self) -> None:
+        """Export the model to ONNX with int8 dynamic quantization (once) and load it."""
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        onnx_dir = Path(f"{self.model_name.rstrip(os.sep)}-onnx")
+        quantized = onnx_dir / 'model_quantized.onnx'
+        if not quantized.exists():
+            logger.info(f"Exporting {self.model_name} to ONNX in {onnx_dir}")
+            ORTModelForFeatureExtraction.from_pretrained(self.model_name, export=True).save_pretrained(onnx_dir)
+            quantize_dynamic(str(onnx_dir / 'model.onnx'), str(quantized), weight_type=QuantType.QInt8)
+
+        self._onnx_model = ORTModelForFeatureExtraction.from_pretrained(
+            onnx_dir, file_name=quantized.name, provider="CPUExecutionProvider"
+        )
+        self._onnx_tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        # Same truncation as the sentence-transformer (MiniLM: 256), without loading it
+        self._onnx_max_length = min(self._onnx_tokenizer.model_max_length, ONNX_MAX_SEQ_LENGTH)
+
+    def encode_onnx(self, texts: List[str], batch_size: int = 32, normalize: bool = True) -> np.ndarray:
+        """
+        Encode texts with the quantized ONNX Runtime model (mean pooling, like MiniLM)
+
+        Args:
+            texts: Texts to embed
+            batch_size: Number of texts per forward pass
+            normalize: L2-normalise the pooled embeddings
+
+        Returns:
+            float32 embeddings, one row per text
+        """
+        if self._onnx_model is None:
+            self._load_onnx_encoder()
+
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            tokens = self._onnx_tokenizer(
+                texts[start:start + batch_size], padding=True, truncation=True,
+                max_length=self._onnx_max_length, return_tensors='np'
+            )
+            hidden = self._onnx_model(**tokens).last_hidden_state
+            mask = tokens['attention_mask'][..., None].astype('float32')
+            batches.append((hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None))
+
+        embeddings = np.vstack(batches).astype(np.float32, copy=False)
+        if normalize:
+            faiss.normalize_L2(embeddings)
+        return embeddings
+
+    def _encode_query_uncached(self, query: str) -> np.ndarray:
+        """Encode one query as a (1, d) L2-normalized float32 array."""
+        if self.use_onnx:
+            query_embedding = self.encode_onnx([query])
+        else:
+            # Normalized inside the encoder, so no separate faiss.normalize_L2 pass
+            query_embedding = self.model.encode([query], normalize_embeddings=True, convert_to_numpy=True)
+        # float32 + C-contiguous lets the SWIG wrapper hand the buffer to FAISS without copying
+        return np.ascontiguousarray(query_embedding, dtype=np.float32)
+
+    def _index_cases(self) -> None:
+        """Map case_id -> case for O(1) get_case_details (first case wins on duplicate ids)."""
+        self._case_by_id = {}
+        for i, case in enumerate(self.cases):
+            self._case_by_id.setdefault(case.get('case_id', f'case_{i}'), case)
+
+    def clear_query_cache(self) -> None:
+        """Drop cached query vectors (called whenever a new index is built or loaded)."""
+        self._encode_query.cache_clear()
+
+    def _apply_search_params(self) -> None:
+        """Set query-time parameters on the loaded index (no-op for flat indexes)."""
+        self._ivf = None
+        if hasattr(self.index, 'hnsw'):
+            self.index.hnsw.efSearch = HNSW_EF_SEARCH
+            return
+        try:
+            ivf = faiss.extract_index_ivf(self.index)
+        except RuntimeError:
+            return
+        if self.nprobe is None:
+            self.nprobe = max(1, ivf.nlist // 32)
+        ivf.nprobe = self.nprobe
+        self._ivf = ivf
+
+    def _maybe_to_gpu(self) -> None:
+        """Move the index to GPU 0 if requested and available; HNSW has no GPU version and stays on CPU."""
+        if not self.use_gpu or not hasattr(faiss, 'StandardGpuResources') or faiss.get_num_gpus() == 0:
+            return
+        try:
+            res = self._gpu_resources or faiss.StandardGpuResources()
+            self.index = faiss.index_cpu_to_gpu(res, 0, self.index)
+            self._gpu_resources = res
+            # GPU IVF indexes keep the nprobe they were cloned with
+            self._ivf = None
+            logger.info("Moved FAISS index to GPU 0")
+        except RuntimeError as e:
+            logger.warning(f"Keeping FAISS index on CPU: {e}")
+
+    def _search_k(self, k: int) -> int:
+        """Candidates to fetch for k results (4x over-fetch); IVF probes at least max(8, k) lists."""
+        if self._ivf is not None:
+            self._ivf.nprobe = max(self.nprobe, 8, k)
+        return min(len(self.cases), max(k * 4, k + 10))
+
+    def _threshold_search(self, query_embedding: np.ndarray, k: int,
+                          similarity_threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Best-first (similarities, indices) of shape (1, <=k) for cases scoring >= threshold
+
+        Uses range_search so no valid match is cut off by a fixed candidate count; indexes
+        without range search support (e.g. on GPU) fall back to an over-fetched top-k.
+        """
+        search_k = self._search_k(k)
+        try:
+            lims, distances, labels = self.index.range_search(query_embedding, similarity_threshold)
+        except RuntimeError:
+            return self.index.search(query_embedding, search_k)
+        order = np.argsort(-distances[lims[0]:lims[1]], kind='stable')[:k]
+        return distances[order][None, :], labels[order][None, :]
 
     def search_similar_cases(self, query: str, k: int = 5, similarity_threshold: float = 0.5) -> List[CaseSearchResult]:
         """
@@ -207,49 +426,45 @@ class MedicalCaseFAISS:
         if self.index is None:
             raise ValueError("Database not built. Call build_database() first.")
 
-        # Create embedding for query
-        query_embedding = self.model.encode([query])
-        faiss.normalize_L2(query_embedding)
+        # Create embedding for query (cached across repeated requests)
+        query_embedding = self._encode_query(query.strip().lower())
 
-        # Search ALL cases to find best matches
-        search_k = min(len(self.cases), 50)  # Search more cases to find best matches
-        similarities, indices = self.index.search(query_embedding.astype('float32'), search_k)
+        # Every case at or above the threshold, best first (capped at k)
+        similarities, indices = self._threshold_search(query_embedding, k, similarity_threshold)
 
-        # Debug logging
-        logger.info(f"Query: {query}")
-        logger.info(f"Search returned {len(indices[0])} results")
-        logger.info(f"Top 5 similarities: {similarities[0][:5]}")
-        logger.info(f"Top 5 indices: {indices[0][:5]}")
+        # Debug logging (skipped entirely unless DEBUG is enabled)
+        verbose = logger.isEnabledFor(logging.DEBUG)
+        if verbose:
+            logger.debug("Query: %s", query)
+            logger.debug("Search returned %d results", len(indices[0]))
+            logger.debug("Top 5 similarities: %s", similarities[0][:5])
+            logger.debug("Top 5 indices: %s", indices[0][:5])
 
-        # Prepare results and filter by similarity threshold
-        results = []
-        for i, (similarity, idx) in enumerate(zip(similarities[0], indices[0])):
-            # Check if index is valid and similarity meets threshold
-            if idx >= 0 and idx < len(self.cases) and similarity >= similarity_threshold:
-                case = self.cases[idx]
+        # Filter by index validity and similarity threshold in one vectorized mask
+        sims, idxs = similarities[0], indices[0]
+        mask = (idxs >= 0) & (idxs < len(self.cases)) & (sims >= similarity_threshold)
+        valid_sims = sims[mask][:k].tolist()
+        valid_idxs = idxs[mask][:k].tolist()
 
-                # Additional debug info
-                logger.info(f"Result {i}: case_id={case.get('case_id', f'case_{idx}')}, "
-                            f"similarity={similarity:.4f}, index={idx}")
-
-                result = CaseSearchResult(
-                    case_id=case.get('case_id', f'case_{idx}'),
-                    similarity_score=float(similarity),
-                    patient_background=case.get('patient_background', {}),
-                    chief_complaint=case.get('chief_complaint_history', {}),
-                    medical_history=case.get('medical_social_history', {}),
-                    opening_statement=case.get('opening_statement', {}),
-                    recommended_questions=case.get('recommended_questions', []),
-                    red_flags=case.get('red_flags', {}),
-                    Suspected_illness=case.get('Suspected_illness', {})
-                )
-                results.append(result)
-
-                # Stop if we have enough results
-                if len(results) >= k:
-                    break
-
-        logger.info(f"Returning {len(results)} results after filtering")
+        results = []
+        for similarity, idx in zip(valid_sims, valid_idxs):
+            case = self.cases[idx]
+            if verbose:
+                logger.debug("Result: case_id=%s, similarity=%.4f, index=%d",
+                             case.get('case_id', f'case_{idx}'), similarity, idx)
+            results.append(CaseSearchResult(
+                case_id=case.get('case_id', f'case_{idx}'),
+                similarity_score=similarity,
+                patient_background=case.get('patient_background', {}),
+                chief_complaint=case.get('chief_complaint_history', {}),
+                medical_history=case.get('medical_social_history', {}),
+                opening_statement=case.get('opening_statement', {}),
+                recommended_questions=case.get('recommended_questions', []),
+                red_flags=case.get('red_flags', {}),
+                Suspected_illness=case.get('Suspected_illness', {})
+            ))
+
+        logger.debug("Returning %d results after filtering", len(results))
         return results
 
     # def suggest_questions(self, query: str, k: int = 3, max_questions: int = 10, similarity_threshold: float = 0.5) -> \
@@ -316,9 +531,9 @@ class MedicalCaseFAISS:
 
         logger.info(f"Found {len(similar_cases)} cases for suggestion extraction")
 
-        # Collect questions from those cases
-        all_questions = []
-        seen_questions = set()
+        # Cases arrive best-first, so the first time a question is seen is its best score;
+        # an insertion-ordered dict dedupes and keeps that order without a final sort.
+        best: Dict[Tuple[str, str], Dict] = {}
 
         for case_result in similar_cases:
             for q in case_result.recommended_questions:
@@ -328,25 +543,23 @@ class MedicalCaseFAISS:
 
                     # Create a unique key to avoid duplicates
                     key = (eng.lower(), swa.lower())
-                    if key in seen_questions:
+                    if key in best:
                         continue
 
-                    seen_questions.add(key)
-
-                    all_questions.append({
+                    best[key] = {
                         'question': {
                             'english': eng,
                             'swahili': swa
                         },
                         'case_id': case_result.case_id,
                         'similarity_score': case_result.similarity_score
-                    })
-
-        # Sort by similarity descending
-        all_questions.sort(key=lambda x: x['similarity_score'], reverse=True)
+                    }
+                    if len(best) >= max_questions:
+                        break
+            if len(best) >= max_questions:
+                break
 
-        # Limit to top N
-        suggestions = all_questions[:max_questions]
+        suggestions = list(best.values())[:max_questions]
 
         logger.info(f"Returning {len(suggestions)} suggested questions")
         return suggestions
@@ -362,19 +575,40 @@ class MedicalCaseFAISS:
         if self.index is None:
             raise ValueError("No index to save. Build database first.")
 
-        # Save FAISS index
-        faiss.write_index(self.index, index_path)
+        # Save FAISS index (GPU indexes are serialized from a CPU copy)
+        index = self.index
+        if self._gpu_resources is not None and hasattr(faiss, 'index_gpu_to_cpu'):
+            index = faiss.index_gpu_to_cpu(index)
+        faiss.write_index(index, index_path)
 
-        # Save metadata
+        # Save metadata (vectors live only in the index)
         metadata = {
             'cases': self.cases,
-            'case_embeddings': self.case_embeddings,
             'dimension': self.dimension
         }
         with open(metadata_path, 'wb') as f:
             pickle.dump(metadata, f)
 
-        logger.info(f"Saved index to {index_path} and metadata to {metadata_path}")
+        # JSON sidecar (cases only) for load_index_mmap
+        json_path = self._json_metadata_path(metadata_path)
+        Path(json_path).write_bytes(orjson.dumps({'cases': self.cases, 'dimension': self.dimension}))
+
+        logger.info(f"Saved index to {index_path} and metadata to {metadata_path} (+ {json_path})")
+
+    @staticmethod
+    def _json_metadata_path(metadata_path: str) -> str:
+        """medical_cases_metadata.pkl -> medical_cases_metadata.json"""
+        return str(Path(metadata_path).with_suffix('.json'))
+
+    def _read_metadata(self, metadata_path: str) -> Dict[str, Any]:
+        """Read cases + dimension, preferring the JSON sidecar (orjson) over the pickle."""
+        json_path = Path(self._json_metadata_path(metadata_path))
+        if json_path.exists():
+            return orjson.loads(json_path.read_bytes())
+
+        logger.info(f"No JSON metadata at {json_path}; unpickling {metadata_path}")
+        with open(metadata_path, 'rb') as f:
+            return pickle.load(f)
 
     def load_index(self, index_path: str, metadata_path: str) -> None:
         """
@@ -386,18 +620,55 @@ class MedicalCaseFAISS:
         """
         # Load FAISS index
         self.index = faiss.read_index(index_path)
+        self._apply_search_params()
+        self._maybe_to_gpu()
 
-        # Load metadata
-        with open(metadata_path, 'rb') as f:
-            metadata = pickle.load(f)
-
+        # Load metadata; older files also carry 'case_embeddings', which is not kept in memory
+        metadata = self._read_metadata(metadata_path)
         self.cases = metadata['cases']
-        self.case_embeddings = metadata['case_embeddings']
         self.dimension = metadata['dimension']
 
+        self.clear_query_cache()
+        self._index_cases()
+
         logger.info(f"Loaded index from {index_path} and metadata from {metadata_path}")
         logger.info(f"Database contains {len(self.cases)} cases")
 
+    def load_index_mmap(self, index_path: str, metadata_path: str) -> None:
+        """
+        Load a read-only, memory-mapped FAISS index and its metadata
+
+        Args:
+            index_path: Path to FAISS index file
+            metadata_path: Path to metadata file (the .json next to it is preferred)
+        """
+        self.index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        self._apply_search_params()
+        self._maybe_to_gpu()
+
+        metadata = self._read_metadata(metadata_path)
+        self.cases = metadata['cases']
+        self.dimension = metadata['dimension']
+
+        self.clear_query_cache()
+        self._index_cases()
+
+        logger.info(f"Memory-mapped index from {index_path}; database contains {len(self.cases)} cases")
+
+    def sample_embeddings(self, n: int = 64) -> np.ndarray:
+        """
+        Reconstruct the first n stored vectors from the index (for sanity checks)
+
+        Args:
+            n: Maximum number of vectors to reconstruct
+
+        Returns:
+            Array of shape (min(n, ntotal), dimension)
+        """
+        if self.index is None:
+            raise ValueError("Database not built. Call build_database() first.")
+        return self.index.reconstruct_n(0, min(n, self.index.ntotal))
+
     def get_case_details(self, case_id: str) -> Dict[str, Any]:
         """
         Get detailed information about a specific case
@@ -408,10 +679,7 @@ class MedicalCaseFAISS:
         Returns:
             Complete case information or None if not found
         """
-        for case in self.cases:
-            if case.get('case_id') == case_id:
-                return case
-        return None
+        return self._case_by_id.get(case_id)
 
     def get_stats(self) -> Dict[str, Any]:
         """
@@ -427,8 +695,9 @@ class MedicalCaseFAISS:
             'total_cases': len(self.cases),
             'index_built': self.index is not None,
             'dimension': self.dimension,
-            'model_name': self.model.get_sentence_embedding_dimension() if hasattr(self.model,
-                                                                                   'get_sentence_embedding_dimension') else 'Unknown'
+            # Reported without forcing the encoder to load
+            'model_name': self._model.get_sentence_embedding_dimension() if hasattr(self._model,
+                                                                                    'get_sentence_embedding_dimension') else self.dimension
         }
 
     def debug_search(self, query: str, k: int = 10) -> None:
@@ -439,12 +708,11 @@ class MedicalCaseFAISS:
             raise ValueError("Database not built. Call build_database() first.")
 
         # Create embedding for query
-        query_embedding = self.model.encode([query])
-        faiss.normalize_L2(query_embedding)
+        query_embedding = self._encode_query(query.strip().lower())
 
         # Search ALL cases
-        search_k = min(len(self.cases), 50)
-        similarities, indices = self.index.search(query_embedding.astype('float32'), search_k)
+        search_k = self._search_k(k)
+        similarities, indices = self.index.search(query_embedding, search_k)
 
         print(f"\nDEBUG: Query '{query}'")
         print(f"Total cases in database: {len(self.cases)}")
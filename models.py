@@ -1,11 +1,22 @@
 # models.py
+import logging
 import os
 import re
-from datetime import datetime
-from sqlalchemy import create_engine, Column, String, Text, DateTime, ForeignKey, Integer, Float
-from sqlalchemy.orm import sessionmaker, declarative_base, relationship, scoped_session, joinedload
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from sqlalchemy import (
+    create_engine, event, Column, String, Text, DateTime, ForeignKey, Integer, Float, Index, LargeBinary,
+    PrimaryKeyConstraint,
+)
+from sqlalchemy import bindparam, func, insert, select, update
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.orm import sessionmaker, declarative_base, relationship, scoped_session, joinedload, selectinload
 import uuid as _uuid
 
+logger = logging.getLogger(__name__)
+
 # --- Config ---
 def _normalized_db_url() -> str:
     """
@@ -30,21 +41,180 @@ def _normalized_db_url() -> str:
 
 DB_URL = _normalized_db_url()
 
+def _engine_kwargs(url: str) -> dict:
+    """Driver-specific create_engine options (pool sizing, batched executemany on Postgres)."""
+    kwargs = {"echo": False, "future": True, "pool_pre_ping": True}
+    if url.startswith("sqlite"):
+        if ":memory:" in url or "mode=memory" in url:
+            # In-memory DB lives only as long as its connection: share a single one
+            from sqlalchemy.pool import StaticPool
+            kwargs.update(poolclass=StaticPool, connect_args={"check_same_thread": False})
+        # Otherwise SQLite keeps SQLAlchemy's default pool; size/overflow/recycle don't apply
+        return kwargs
+    kwargs.update(
+        pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        pool_recycle=1800,
+    )
+    if url.startswith("postgresql+psycopg2"):
+        kwargs["executemany_mode"] = "values_plus_batch"
+        kwargs["executemany_values_page_size"] = 1000
+    elif url.startswith("postgresql"):
+        # psycopg 3 batches executemany INSERTs via insertmanyvalues already
+        kwargs["insertmanyvalues_page_size"] = 1000
+    return kwargs
+
+
 # --- SQLAlchemy setup ---
-engine = create_engine(DB_URL, echo=False, future=True, pool_pre_ping=True)
+engine = create_engine(DB_URL, **_engine_kwargs(DB_URL))
+
+
+if DB_URL.startswith("sqlite"):
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _record):
+        """WAL + synchronous=NORMAL so each commit does not fsync the whole DB file."""
+        cur = dbapi_conn.cursor()
+        try:
+            cur.execute("PRAGMA journal_mode=WAL")
+            cur.execute("PRAGMA synchronous=NORMAL")
+            cur.execute("PRAGMA temp_store=MEMORY")
+            cur.execute("PRAGMA cache_size=-16000")  # ~16 MiB page cache
+            cur.execute("PRAGMA mmap_size=268435456")
+        finally:
+            cur.close()
+
 SessionLocal = scoped_session(sessionmaker(bind=engine, autoflush=False, autocommit=False))
 Base = declarative_base()
 
+# Request-wide session bound by the web layer (see bind_request_session); None outside requests
+_request_db: ContextVar = ContextVar("request_db", default=None)
+
+
+@contextmanager
+def session_scope(db=None):
+    """
+    Session for one helper call.
+
+    An explicit db is used as-is; the caller owns its transaction. The request-wide session,
+    when one is bound, is reused so helpers in the same request share one session, and its
+    transaction is committed (or rolled back) on exit: the connection goes back to the pool
+    between helper calls instead of idling in a transaction, e.g. for a whole SSE stream.
+    Otherwise a session is opened here and closed on exit. Helpers still commit their own writes.
+    """
+    request_wide = False
+    if db is None:
+        db = _request_db.get()
+        request_wide = db is not None
+    owned = db is None
+    if owned:
+        db = SessionLocal()
+    try:
+        yield db
+        if request_wide:
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        if owned:
+            db.close()
+
+
+def bind_request_session():
+    """Start a request-wide session reused by every helper until release_request_session()."""
+    # A private session, not the thread-local SessionLocal() that other code closes freely.
+    # session_scope commits it after every helper; keep loaded objects usable without a refetch.
+    _request_db.set(SessionLocal.session_factory(expire_on_commit=False))
+
+
+def release_request_session():
+    """Drop the request-wide session and return its connection to the pool."""
+    db = _request_db.get()
+    _request_db.set(None)
+    if db is not None:
+        db.close()
+    SessionLocal.remove()
+
+# --- Column types ---
+_NIL_UUID = _uuid.UUID(int=0)
+
+
+class UUIDString(TypeDecorator):
+    """
+    UUID stored in 16 bytes (native UUID on Postgres, BLOB elsewhere) but exposed as a str.
+
+    Callers keep passing and receiving the usual 36-char strings. A value that is not a UUID
+    binds as the nil UUID, which never matches a generated id.
+    """
+    impl = LargeBinary(16)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import UUID
+            return dialect.type_descriptor(UUID(as_uuid=False))
+        return dialect.type_descriptor(LargeBinary(16))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if not isinstance(value, _uuid.UUID):
+            try:
+                value = _uuid.UUID(str(value))
+            except ValueError:
+                value = _NIL_UUID
+        return str(value) if dialect.name == "postgresql" else value.bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return str(_uuid.UUID(bytes=bytes(value)))
+        return str(value)
+
+
+_CLOCK_RE = re.compile(r"(\d{1,2}):(\d{2}):(\d{2})")
+
+
+class ClockTime(TypeDecorator):
+    """
+    Time of day stored as integer seconds (0..86399) but exposed as an "HH:MM:SS" string.
+
+    Values that are not HH:MM:SS are stored as NULL. Text values left in old databases are
+    passed through unchanged when read.
+    """
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, int):
+            return value
+        m = _CLOCK_RE.fullmatch(str(value).strip())
+        if not m:
+            return None
+        h, mi, se = (int(g) for g in m.groups())
+        return h * 3600 + mi * 60 + se
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str) and not value.isdigit():
+            return value
+        n = int(value)
+        return f"{n // 3600:02d}:{n // 60 % 60:02d}:{n % 60:02d}"
+
+
 # --- Models ---
 class Conversation(Base):
     __tablename__ = "conversations"
-    id = Column(String, primary_key=True)               # uuid string
+    id = Column(UUIDString, primary_key=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     owner_user_id = Column(Integer, ForeignKey("users.id"), index=True, nullable=True)
     patient_id = Column(Integer, ForeignKey("patients.id"), index=True, nullable=True)
     status = Column(String(16), default="active", nullable=False)  # active|paused|ended
     paused_at = Column(DateTime, nullable=True)
     resumed_at = Column(DateTime, nullable=True)
+    last_message_at = Column(DateTime, index=True, nullable=True)  # kept current by the message loggers
     messages = relationship(
         "Message",
         back_populates="conversation",
@@ -52,18 +222,30 @@ class Conversation(Base):
         order_by="Message.created_at.asc()",
     )
 
+    # Dashboard: WHERE owner_user_id = ? ORDER BY created_at DESC, served straight from the index
+    __table_args__ = (Index("ix_conv_owner_created", owner_user_id, created_at.desc()),)
+
 class Message(Base):
     __tablename__ = "messages"
-    id = Column(String, primary_key=True)               # uuid string
-    conversation_id = Column(String, ForeignKey("conversations.id"), index=True, nullable=False)
+    id = Column(UUIDString, nullable=False)
+    conversation_id = Column(UUIDString, ForeignKey("conversations.id"), nullable=False)
     role = Column(String, index=True)                   # patient|clinician|listener|Question Recommender
     type = Column(String, default="message")            # message|question_recommender
     message = Column(Text, nullable=True)
-    timestamp = Column(String, nullable=True)           # keep your "HH:MM:SS"
+    timestamp = Column(ClockTime, nullable=True)        # "HH:MM:SS" in Python, seconds of day in the DB
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
     conversation = relationship("Conversation", back_populates="messages")
 
+    __table_args__ = (
+        # Rows of one conversation stored together: clustered PK (SQLite WITHOUT ROWID),
+        # hash partitions on Postgres (created in _migrate_messages_layout)
+        PrimaryKeyConstraint("conversation_id", "id"),
+        # Per-conversation history in order without a sort step
+        Index("ix_messages_conversation_created", conversation_id, created_at),
+        {"sqlite_with_rowid": False, "postgresql_partition_by": "HASH (conversation_id)"},
+    )
+
     # --- ADD: Auth models ---
 from sqlalchemy import Integer, Boolean, Table, UniqueConstraint
 
@@ -85,7 +267,7 @@ class User(Base):
     email_verified = Column(Boolean, default=False, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
-    roles = relationship("Role", secondary=user_roles, back_populates="users", lazy="joined")
+    roles = relationship("Role", secondary=user_roles, back_populates="users", lazy="selectin")
 
     # Flask-Login helpers
     @property
@@ -95,7 +277,22 @@ class User(Base):
     def get_id(self): return str(self.id)
 
     def has_role(self, name: str) -> bool:
-        return any(r.name == name for r in self.roles)
+        # Role names cached on the instance (one per request via load_user); reset on roles edits
+        names = self.__dict__.get("_role_names")
+        if names is None:
+            names = self.__dict__["_role_names"] = frozenset(r.name for r in self.roles)
+        return name in names
+
+@event.listens_for(User.roles, "append")
+@event.listens_for(User.roles, "remove")
+def _reset_role_cache(user, _role, _initiator):
+    user.__dict__.pop("_role_names", None)
+
+
+@event.listens_for(User, "refresh")
+def _reset_role_cache_on_refresh(user, _context, _attrs):
+    user.__dict__.pop("_role_names", None)
+
 
 class Role(Base):
     __tablename__ = "roles"
@@ -106,7 +303,7 @@ class Role(Base):
 class ConversationOwner(Base):
     __tablename__ = "conversation_owners"
     id = Column(Integer, primary_key=True)
-    conversation_id = Column(String, ForeignKey("conversations.id"), index=True, nullable=False, unique=True)
+    conversation_id = Column(UUIDString, ForeignKey("conversations.id"), index=True, nullable=False, unique=True)
     owner_user_id = Column(Integer, ForeignKey("users.id"), index=True, nullable=False)
 
 
@@ -115,10 +312,25 @@ class Patient(Base):
     id = Column(Integer, primary_key=True)
     identifier = Column(String(128), nullable=False)   # e.g. "P001", "Case 123"
     display_name = Column(String(255), nullable=True) # optional label
-    clinician_id = Column(Integer, ForeignKey("users.id"), index=True, nullable=True)  # owning clinician
+    clinician_id = Column(Integer, ForeignKey("users.id"), nullable=True)  # owning clinician
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     conversations = relationship("Conversation", back_populates="patient", lazy="dynamic")
 
+    __table_args__ = (
+        Index("ix_patients_clinician_created", clinician_id, created_at.desc()),
+        # list_patients_for_user: WHERE clinician_id = ? ORDER BY id without a sort step
+        Index("ix_patients_clinician_id_id", clinician_id, id),
+        # One row per identifier per clinician; create_patient relies on it for insert-or-get
+        Index("uq_patient_identifier_clinician", identifier, clinician_id, unique=True),
+    )
+
+
+class PatientCounter(Base):
+    """Single row (id=1) holding the highest allocated P-number, bumped atomically."""
+    __tablename__ = "patient_counter"
+    id = Column(Integer, primary_key=True)
+    last_n = Column(Integer, nullable=False, default=0)
+
 
 # Conversation -> Patient relationship (patient_id already on Conversation)
 Conversation.patient = relationship("Patient", back_populates="conversations")
@@ -129,7 +341,7 @@ class ConversationDiseaseLikelihood(Base):
     One row per conversation; overwritten on re-analyze.
     """
     __tablename__ = "conversation_disease_likelihoods"
-    conversation_id = Column(String, ForeignKey("conversations.id"), primary_key=True)
+    conversation_id = Column(UUIDString, ForeignKey("conversations.id"), primary_key=True)
     analyzed_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     cancer_likelihood_pct = Column(Float, nullable=True)
     symptoms_json = Column(Text, nullable=True)       # JSON string
@@ -140,66 +352,261 @@ class ConversationDiseaseLikelihood(Base):
 
 
 # --- Init / helpers ---
-def _migrate_add_patient_fk():
-    """Ensure patients table exists and conversations.patient_id exists (for existing DBs)."""
-    from sqlalchemy import inspect, text
-    insp = inspect(engine)
-    if "patients" not in insp.get_table_names():
-        Base.metadata.tables["patients"].create(engine, checkfirst=True)
-    if "conversations" in insp.get_table_names():
-        cols = [c["name"] for c in insp.get_columns("conversations")]
-        if "patient_id" not in cols:
-            with engine.connect() as conn:
-                conn.execute(text("ALTER TABLE conversations ADD COLUMN patient_id INTEGER"))
-                conn.commit()
+# Columns holding conversation/message UUIDs (stored via UUIDString)
+_UUID_COLUMNS = (
+    ("conversations", "id"),
+    ("messages", "id"),
+    ("messages", "conversation_id"),
+    ("conversation_owners", "conversation_id"),
+    ("conversation_disease_likelihoods", "conversation_id"),
+)
 
+# Each step gets (conn, cols, insp): cols maps table -> {column name: reflected type}, taken
+# once before any step runs. Steps must be idempotent.
 
-def _migrate_add_user_username():
+def _migrate_add_patient_fk(conn, cols, insp):
+    """Ensure conversations.patient_id exists (for existing DBs)."""
+    from sqlalchemy import text
+    if "patient_id" not in cols["conversations"]:
+        conn.execute(text("ALTER TABLE conversations ADD COLUMN patient_id INTEGER"))
+
+
+def _migrate_add_user_username(conn, cols, insp):
     """Add users.username if missing (for existing DBs)."""
-    from sqlalchemy import inspect, text
-    insp = inspect(engine)
-    if "users" not in insp.get_table_names():
-        return
-    cols = [c["name"] for c in insp.get_columns("users")]
-    if "username" not in cols:
-        with engine.connect() as conn:
-            conn.execute(text("ALTER TABLE users ADD COLUMN username VARCHAR(64)"))
-            conn.commit()
-
-def _migrate_add_conversation_disease_likelihoods():
-    """Ensure conversation_disease_likelihoods table exists (for existing DBs)."""
-    from sqlalchemy import inspect
-    insp = inspect(engine)
-    if "conversation_disease_likelihoods" not in insp.get_table_names():
-        Base.metadata.tables["conversation_disease_likelihoods"].create(engine, checkfirst=True)
+    from sqlalchemy import text
+    if "username" not in cols["users"]:
+        conn.execute(text("ALTER TABLE users ADD COLUMN username VARCHAR(64)"))
 
 
-def _migrate_add_conversation_status():
+def _migrate_add_conversation_status(conn, cols, insp):
     """Ensure conversations.status/paused_at/resumed_at exist for existing DBs."""
-    from sqlalchemy import inspect, text
-    insp = inspect(engine)
-    if "conversations" not in insp.get_table_names():
+    from sqlalchemy import text
+    existing = cols["conversations"]
+    if "status" not in existing:
+        conn.execute(text("ALTER TABLE conversations ADD COLUMN status VARCHAR(16) DEFAULT 'active'"))
+        conn.execute(text("UPDATE conversations SET status = 'active' WHERE status IS NULL OR status = ''"))
+    if "paused_at" not in existing:
+        conn.execute(text("ALTER TABLE conversations ADD COLUMN paused_at TIMESTAMP"))
+    if "resumed_at" not in existing:
+        conn.execute(text("ALTER TABLE conversations ADD COLUMN resumed_at TIMESTAMP"))
+
+
+# Shared with scripts/migrate_from_sqlite.py. Empty conversations are left NULL (and hidden).
+_BACKFILL_LAST_MESSAGE_AT_SQL = (
+    "UPDATE conversations SET last_message_at = "
+    "(SELECT MAX(m.created_at) FROM messages m WHERE m.conversation_id = conversations.id) "
+    "WHERE last_message_at IS NULL "
+    "AND EXISTS (SELECT 1 FROM messages m WHERE m.conversation_id = conversations.id)"
+)
+
+
+def _migrate_add_conversation_last_message_at(conn, cols, insp):
+    """
+    Add conversations.last_message_at, and backfill it from messages wherever it is NULL.
+
+    The backfill runs on every start, not only when the column is added: rows copied in with
+    raw INSERTs (scripts/migrate_from_sqlite.py) arrive without it.
+    """
+    from sqlalchemy import text
+    if "last_message_at" not in cols["conversations"]:
+        conn.execute(text("ALTER TABLE conversations ADD COLUMN last_message_at TIMESTAMP"))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_conversations_last_message_at ON conversations(last_message_at)"
+        ))
+    conn.execute(text(_BACKFILL_LAST_MESSAGE_AT_SQL))
+
+
+def _migrate_message_timestamp_to_seconds(conn, cols, insp):
+    """Convert messages.timestamp from "HH:MM:SS" text to integer seconds of day (existing DBs)."""
+    from sqlalchemy import text
+    col_type = cols["messages"].get("timestamp")
+    if col_type is None or isinstance(col_type, Integer):
+        return
+    if engine.dialect.name == "postgresql":
+        conn.execute(text(
+            'ALTER TABLE messages ALTER COLUMN "timestamp" TYPE INTEGER USING '
+            "CASE WHEN \"timestamp\" ~ '^[0-9]{1,2}:[0-9]{2}:[0-9]{2}$' "
+            'THEN EXTRACT(EPOCH FROM "timestamp"::time)::integer END'
+        ))
+    elif engine.dialect.name == "sqlite":
+        import sqlite3
+        if sqlite3.sqlite_version_info < (3, 35, 0):
+            return  # no DROP COLUMN; ClockTime still reads the old text values
+        conn.execute(text("ALTER TABLE messages ADD COLUMN ts_sec INTEGER"))
+        conn.execute(text(
+            "UPDATE messages SET ts_sec = "
+            "CAST(substr(\"timestamp\", 1, 2) AS INTEGER) * 3600 "
+            "+ CAST(substr(\"timestamp\", 4, 2) AS INTEGER) * 60 "
+            "+ CAST(substr(\"timestamp\", 7, 2) AS INTEGER) "
+            "WHERE \"timestamp\" GLOB '[0-9][0-9]:[0-9][0-9]:[0-9][0-9]'"
+        ))
+        conn.execute(text('ALTER TABLE messages DROP COLUMN "timestamp"'))
+        conn.execute(text('ALTER TABLE messages RENAME COLUMN ts_sec TO "timestamp"'))
+
+
+def _migrate_uuid_columns(conn, cols, insp):
+    """Convert 36-char text UUIDs from older DBs to 16-byte storage (BLOB on SQLite, uuid on Postgres)."""
+    from sqlalchemy import text
+    if engine.dialect.name == "sqlite":
+        # SQLite stores BLOBs as-is in the old VARCHAR columns, so rewriting the values is enough
+        for table, col in _UUID_COLUMNS:
+            old_ids = conn.execute(
+                text(f"SELECT DISTINCT {col} FROM {table} WHERE typeof({col}) = 'text'")
+            ).scalars().all()
+            params = []
+            for v in old_ids:
+                try:
+                    params.append({"old": v, "new": _uuid.UUID(v).bytes})
+                except ValueError:
+                    continue
+            if params:
+                conn.execute(text(f"UPDATE {table} SET {col} = :new WHERE {col} = :old"), params)
+    elif engine.dialect.name == "postgresql":
+        from sqlalchemy import Uuid
+        pending = [(t, c) for t, c in _UUID_COLUMNS if not isinstance(cols[t].get(c), Uuid)]
+        if not pending:
+            return
+        # FKs to conversations.id must be dropped while the column types change
+        fks = [
+            (t, fk)
+            for t in {t for t, _ in _UUID_COLUMNS if t != "conversations"}
+            for fk in insp.get_foreign_keys(t)
+            if fk["referred_table"] == "conversations" and fk.get("name")
+        ]
+        for t, fk in fks:
+            conn.execute(text(f'ALTER TABLE {t} DROP CONSTRAINT "{fk["name"]}"'))
+        for t, c in pending:
+            conn.execute(text(f"ALTER TABLE {t} ALTER COLUMN {c} TYPE uuid USING {c}::uuid"))
+        for t, fk in fks:
+            fk_cols = ", ".join(fk["constrained_columns"])
+            conn.execute(text(
+                f'ALTER TABLE {t} ADD CONSTRAINT "{fk["name"]}" '
+                f"FOREIGN KEY ({fk_cols}) REFERENCES conversations (id)"
+            ))
+
+
+MESSAGE_PARTITIONS = 8
+
+
+def _migrate_messages_layout(conn, cols, insp):
+    """
+    Cluster messages by conversation.
+
+    SQLite: rebuild an old rowid table as WITHOUT ROWID keyed on (conversation_id, id).
+    Postgres: make sure the hash partitions exist when messages was created partitioned;
+    an existing unpartitioned table is left as is.
+    """
+    from sqlalchemy import text
+    if engine.dialect.name == "sqlite":
+        ddl = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'messages'")).scalar()
+        if not ddl or "WITHOUT ROWID" in ddl.upper():
+            return
+        conn.execute(text("ALTER TABLE messages RENAME TO messages_old"))
+        for (name,) in conn.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'messages_old' AND sql IS NOT NULL"
+        )).all():
+            conn.execute(text(f'DROP INDEX "{name}"'))
+        Message.__table__.create(conn)
+        names = ", ".join(f'"{c.name}"' for c in Message.__table__.columns)
+        conn.execute(text(f"INSERT INTO messages ({names}) SELECT {names} FROM messages_old"))
+        conn.execute(text("DROP TABLE messages_old"))
+    elif engine.dialect.name == "postgresql":
+        partitioned = conn.execute(text(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'messages'::regclass"
+        )).scalar()
+        if not partitioned:
+            return
+        for r in range(MESSAGE_PARTITIONS):
+            conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS messages_p{r} PARTITION OF messages "
+                f"FOR VALUES WITH (MODULUS {MESSAGE_PARTITIONS}, REMAINDER {r})"
+            ))
+
+
+def _migrate_add_indexes(conn, cols, insp):
+    """Indexes added after the first release: P-number lookup and (parent, created_at / id) listings."""
+    from sqlalchemy import text
+    for ddl in (
+        "CREATE INDEX IF NOT EXISTS ix_patients_pnum ON patients(identifier) WHERE identifier LIKE 'P%'",
+        "CREATE INDEX IF NOT EXISTS ix_conv_owner_created ON conversations(owner_user_id, created_at DESC)",
+        "CREATE INDEX IF NOT EXISTS ix_messages_conversation_created ON messages(conversation_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_patients_clinician_created ON patients(clinician_id, created_at DESC)",
+        "CREATE INDEX IF NOT EXISTS ix_patients_clinician_id_id ON patients(clinician_id, id)",
+    ):
+        conn.execute(text(ddl))
+
+
+def _migrate_add_patient_unique_identifier(conn, cols, insp):
+    """Unique (identifier, clinician_id) index for existing DBs; skipped while duplicates remain."""
+    from sqlalchemy import text
+    dup = conn.execute(text(
+        "SELECT identifier, clinician_id FROM patients "
+        "GROUP BY identifier, clinician_id HAVING COUNT(*) > 1 LIMIT 1"
+    )).first()
+    if dup is not None:
+        logger.warning(
+            "Not adding uq_patient_identifier_clinician: duplicate patient %r for clinician %r",
+            dup[0], dup[1],
+        )
         return
-    cols = [c["name"] for c in insp.get_columns("conversations")]
-    with engine.connect() as conn:
-        if "status" not in cols:
-            conn.execute(text("ALTER TABLE conversations ADD COLUMN status VARCHAR(16) DEFAULT 'active'"))
-            conn.execute(text("UPDATE conversations SET status = 'active' WHERE status IS NULL OR status = ''"))
-        if "paused_at" not in cols:
-            conn.execute(text("ALTER TABLE conversations ADD COLUMN paused_at TIMESTAMP"))
-        if "resumed_at" not in cols:
-            conn.execute(text("ALTER TABLE conversations ADD COLUMN resumed_at TIMESTAMP"))
-        conn.commit()
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_patient_identifier_clinician "
+        "ON patients(identifier, clinician_id)"
+    ))
+
+
+_SCHEMA_MIGRATIONS = (
+    _migrate_add_patient_fk,
+    _migrate_add_user_username,
+    _migrate_add_conversation_status,
+    _migrate_add_conversation_last_message_at,
+    _migrate_message_timestamp_to_seconds,
+    _migrate_uuid_columns,
+    _migrate_messages_layout,
+    _migrate_add_indexes,
+    _migrate_add_patient_unique_identifier,
+)
+
+
+def _migrate_schema():
+    """Bring an existing DB up to the models: one inspection pass, then every step in one transaction."""
+    from sqlalchemy import inspect
+    insp = inspect(engine)
+    cols = {
+        t: {c["name"]: c["type"] for c in insp.get_columns(t)}
+        for t in insp.get_table_names()
+    }
+    with engine.begin() as conn:
+        for step in _SCHEMA_MIGRATIONS:
+            step(conn, cols, insp)
+
+def _migrate_seed_patient_counter():
+    """Ensure the patient_counter row exists and is not behind identifiers already stored."""
+    db = SessionLocal()
+    try:
+        if db.get(PatientCounter, 1) is None:
+            db.add(PatientCounter(id=1, last_n=0))
+            db.flush()
+        _bump_patient_counter(db, _max_patient_number(db))
+        db.commit()
+    finally:
+        db.close()
+
+def seed_db():
+    """Rows every database needs: the patient counter and the roles."""
+    _migrate_seed_patient_counter()
+    _seed_roles()
 
 def init_db():
+    # create_all makes any missing tables (patients, likelihoods, counter, ...) before the column steps
     Base.metadata.create_all(bind=engine)
-    _migrate_add_patient_fk()
-    _migrate_add_user_username()
-    _migrate_add_conversation_disease_likelihoods()
-    _migrate_add_conversation_status()
-    _seed_roles()
+    _migrate_schema()
+    seed_db()
     _ensure_bootstrap_admin()
 
+# Role name -> id. The roles table is seeded here and never edited at runtime, so one copy per process.
+_role_ids: dict[str, int] = {}
+
 def _seed_roles():
     db = SessionLocal()
     try:
@@ -208,10 +615,22 @@ def _seed_roles():
             if name not in existing:
                 db.add(Role(name=name))
         db.commit()
+        _role_ids.clear()
+        _role_ids.update(db.query(Role.name, Role.id).all())
     finally:
         db.close()
 
 
+def get_role_id(name: str, db=None) -> int | None:
+    """Role id for a name from the per-process cache (loaded on first miss)."""
+    rid = _role_ids.get(name)
+    if rid is None:
+        with session_scope(db) as db:
+            _role_ids.update(db.query(Role.name, Role.id).all())
+        rid = _role_ids.get(name)
+    return rid
+
+
 def _ensure_bootstrap_admin():
     """
     If BOOTSTRAP_ADMIN_EMAIL and BOOTSTRAP_ADMIN_PASSWORD are set, create that user
@@ -238,124 +657,169 @@ def _ensure_bootstrap_admin():
         db.add(u)
         db.commit()
         for role_name in ("admin", "clinician"):
-            role = db.query(Role).filter_by(name=role_name).first()
-            if role and not any(r.id == role.id for r in u.roles):
-                db.execute(user_roles.insert().values(user_id=u.id, role_id=role.id))
+            rid = get_role_id(role_name, db=db)
+            if rid is not None and not any(r.id == rid for r in u.roles):
+                db.execute(user_roles.insert().values(user_id=u.id, role_id=rid))
         db.commit()
     finally:
         db.close()
 
 
-def create_conversation(owner_user_id: int | None = None, patient_id: int | None = None) -> str:
-    db = SessionLocal()
-    try:
+def create_conversation(owner_user_id: int | None = None, patient_id: int | None = None, db=None) -> str:
+    with session_scope(db) as db:
         cid = str(_uuid.uuid4())
-        db.add(Conversation(id=cid, owner_user_id=owner_user_id, patient_id=patient_id))
+        db.execute(insert(Conversation).values(id=cid, owner_user_id=owner_user_id, patient_id=patient_id))
         db.commit()
         return cid
-    finally:
-        db.close()
 
-def log_message(conversation_id: str, role: str, message: str, timestamp: str, type_: str = "message"):
-    """Insert a single message row."""
-    db = SessionLocal()
-    try:
-        db.add(Message(
-            id=str(_uuid.uuid4()),
-            conversation_id=conversation_id,
-            role=role,
-            type=type_,
-            message=message,
-            timestamp=timestamp
-        ))
+def _touch_last_message_at(db, conversation_id: str, ts: datetime) -> None:
+    """Move conversations.last_message_at forward to ts (never backwards)."""
+    from sqlalchemy import case, update
+    last = Conversation.last_message_at
+    db.execute(
+        update(Conversation)
+        .where(Conversation.id == conversation_id)
+        .values(last_message_at=case((last.is_(None) | (last < ts), ts), else_=last))
+    )
+
+def create_conversation_with_first_message(
+    owner_user_id: int | None,
+    patient_id: int | None,
+    role: str,
+    message: str,
+    timestamp: str,
+    type_: str = "message",
+    db=None,
+) -> str:
+    """Create a conversation and its opening message with a single commit; returns the conversation id."""
+    with session_scope(db) as db:
+        cid = str(_uuid.uuid4())
+        now = datetime.utcnow()
+        db.add_all([
+            Conversation(id=cid, owner_user_id=owner_user_id, patient_id=patient_id, last_message_at=now),
+            Message(
+                id=str(_uuid.uuid4()),
+                conversation_id=cid,
+                role=role,
+                type=type_,
+                message=message,
+                timestamp=timestamp,
+                created_at=now,
+            ),
+        ])
         db.commit()
-    finally:
-        db.close()
+        return cid
+
+def log_messages_bulk(conversation_id: str, rows: list[dict], db=None) -> int:
+    """
+    Insert several message rows for one conversation in a single transaction.
+
+    Each row is a dict with role, message, timestamp and optionally type / created_at.
+    Ids are generated here so the insert goes through Core executemany without ORM flushes.
+    Returns the number of rows inserted.
+    """
+    if not rows:
+        return 0
+    now = datetime.utcnow()
+    params = [
+        {
+            "id": str(_uuid.uuid4()),
+            "conversation_id": conversation_id,
+            "role": r.get("role"),
+            "type": r.get("type") or "message",
+            "message": r.get("message"),
+            "timestamp": r.get("timestamp"),
+            # Distinct default timestamps keep the batch in the given order
+            "created_at": r.get("created_at") or now + timedelta(microseconds=i),
+        }
+        for i, r in enumerate(rows)
+    ]
+    with session_scope(db) as db:
+        db.execute(Message.__table__.insert(), params)
+        _touch_last_message_at(db, conversation_id, max(p["created_at"] for p in params))
+        db.commit()
+        return len(params)
+
+def log_message(
+    conversation_id: str, role: str, message: str, timestamp: str, type_: str = "message", db=None
+):
+    """Insert a single message row."""
+    log_messages_bulk(conversation_id, [{
+        "role": role,
+        "type": type_,
+        "message": message,
+        "timestamp": timestamp,
+    }], db=db)
 
 # admin helpers
-def list_conversations():
-    db = SessionLocal()
-    try:
+def list_conversations(db=None):
+    with session_scope(db) as db:
         return db.query(Conversation).order_by(Conversation.created_at.desc()).all()
-    finally:
-        db.close()
 
 
-def list_conversations_for_user(user_id: int):
-    """Conversations owned by this clinician, newest first (with patient loaded)."""
-    db = SessionLocal()
-    try:
+def list_conversations_for_user(user_id: int, db=None):
+    """Conversations owned by this clinician, newest first (patients loaded in one IN query)."""
+    with session_scope(db) as db:
         return (
             db.query(Conversation)
-            .options(joinedload(Conversation.patient))
+            .options(selectinload(Conversation.patient))
             .filter(Conversation.owner_user_id == user_id)
             .order_by(Conversation.created_at.desc())
             .all()
         )
-    finally:
-        db.close()
 
 
-def get_conversation_if_owned_by(conversation_id: str, user_id: int):
-    """Return conversation only if it belongs to this user (or None). Loads patient."""
-    db = SessionLocal()
-    try:
-        c = (
-            db.query(Conversation)
-            .options(joinedload(Conversation.patient))
-            .filter(
-                Conversation.id == conversation_id,
-                Conversation.owner_user_id == user_id,
-            )
-            .first()
-        )
-        return c
-    finally:
-        db.close()
+# Statements for the per-request helpers, built once; callers only supply bind values
+_OWNED = (Conversation.id == bindparam("cid"), Conversation.owner_user_id == bindparam("uid"))
+_SELECT_OWNED_CONVERSATION = select(Conversation).options(joinedload(Conversation.patient)).where(*_OWNED)
+_SELECT_OWNED_STATUS = select(Conversation.status).where(*_OWNED)
+_UPDATE_CONVERSATION_PATIENT = (
+    update(Conversation)
+    .where(*_OWNED, Conversation.patient_id.is_distinct_from(bindparam("pid")))  # no-op writes skipped
+    .values(patient_id=bindparam("pid"))
+    .execution_options(synchronize_session=False)
+)
+_SELECT_PATIENT = select(Patient).where(Patient.id == bindparam("pid"))
 
 
-def update_conversation_patient(conversation_id: str, user_id: int, patient_id: int | None) -> bool:
-    """Set patient_id on this conversation if owned by user. Returns True if updated."""
-    db = SessionLocal()
-    try:
-        n = (
-            db.query(Conversation)
-            .filter(
-                Conversation.id == conversation_id,
-                Conversation.owner_user_id == user_id,
-            )
-            .update({Conversation.patient_id: patient_id}, synchronize_session=False)
-        )
-        db.commit()
-        return n > 0
-    finally:
-        db.close()
+def get_conversation_if_owned_by(conversation_id: str, user_id: int, db=None):
+    """Return conversation only if it belongs to this user (or None). Loads patient."""
+    with session_scope(db) as db:
+        return db.execute(
+            _SELECT_OWNED_CONVERSATION, {"cid": conversation_id, "uid": user_id}
+        ).scalar_one_or_none()
 
 
-def get_conversation_status_if_owned(conversation_id: str, user_id: int) -> str | None:
+def update_conversation_patient(conversation_id: str, user_id: int, patient_id: int | None, db=None) -> bool:
+    """Set patient_id on this conversation if owned by user. Returns True if updated."""
+    with session_scope(db) as db:
+        n = db.execute(
+            _UPDATE_CONVERSATION_PATIENT, {"cid": conversation_id, "uid": user_id, "pid": patient_id}
+        ).rowcount
+        if n:
+            db.commit()
+            return True
+        # Nothing written: either not owned, or patient_id already had this value. No rollback:
+        # the session may be shared with earlier helpers in this request.
+        return db.execute(
+            _SELECT_OWNED_STATUS, {"cid": conversation_id, "uid": user_id}
+        ).first() is not None
+
+
+def get_conversation_status_if_owned(conversation_id: str, user_id: int, db=None) -> str | None:
     """Return status for an owned conversation, else None."""
-    db = SessionLocal()
-    try:
-        row = (
-            db.query(Conversation.status)
-            .filter(
-                Conversation.id == conversation_id,
-                Conversation.owner_user_id == user_id,
-            )
-            .first()
-        )
-        return row[0] if row else None
-    finally:
-        db.close()
+    with session_scope(db) as db:
+        return db.execute(
+            _SELECT_OWNED_STATUS, {"cid": conversation_id, "uid": user_id}
+        ).scalar_one_or_none()
 
 
-def set_conversation_status_if_owned(conversation_id: str, user_id: int, status: str) -> bool:
+def set_conversation_status_if_owned(conversation_id: str, user_id: int, status: str, db=None) -> bool:
     """Update status for an owned conversation. Returns True if updated."""
     status = (status or "").strip().lower()
     if status not in {"active", "paused", "ended"}:
         return False
-    db = SessionLocal()
-    try:
+    with session_scope(db) as db:
         values = {Conversation.status: status}
         if status == "paused":
             values[Conversation.paused_at] = datetime.utcnow()
@@ -371,109 +835,314 @@ def set_conversation_status_if_owned(conversation_id: str, user_id: int, status:
         )
         db.commit()
         return n > 0
-    finally:
-        db.close()
 
 
-def delete_conversation_by_id(conversation_id: str) -> bool:
+def _delete_conversations_where(db, *criteria) -> bool:
+    """
+    Core DELETEs for conversations matching criteria plus their dependent rows, children first.
+
+    Each table is cleared with one statement (no per-message ORM cascade); returns True if a
+    conversation was deleted.
+    """
+    from sqlalchemy import delete, select
+    ids = select(Conversation.id).where(*criteria)
+    for model in (Message, ConversationDiseaseLikelihood, ConversationOwner):
+        db.execute(delete(model).where(model.conversation_id.in_(ids)))
+    n = db.execute(delete(Conversation).where(*criteria)).rowcount
+    db.commit()
+    return n > 0
+
+
+def delete_conversation_by_id(conversation_id: str, db=None) -> bool:
     """Admin helper: delete a conversation (and its messages) regardless of owner."""
-    db = SessionLocal()
-    try:
-        c = db.query(Conversation).filter(Conversation.id == conversation_id).first()
-        if c is None:
-            return False
-        db.delete(c)
-        db.commit()
-        return True
-    finally:
-        db.close()
+    with session_scope(db) as db:
+        return _delete_conversations_where(db, Conversation.id == conversation_id)
 
 
-def delete_conversation_if_owned_by(conversation_id: str, user_id: int) -> bool:
-    """Delete this conversation if owned by user (messages cascade). Returns True if deleted."""
-    db = SessionLocal()
-    try:
-        c = (
-            db.query(Conversation)
-            .filter(
-                Conversation.id == conversation_id,
-                Conversation.owner_user_id == user_id,
-            )
-            .first()
+def delete_conversation_if_owned_by(conversation_id: str, user_id: int, db=None) -> bool:
+    """Delete this conversation if owned by user (messages included). Returns True if deleted."""
+    with session_scope(db) as db:
+        return _delete_conversations_where(
+            db,
+            Conversation.id == conversation_id,
+            Conversation.owner_user_id == user_id,
         )
-        if c is None:
-            return False
-        db.delete(c)
-        db.commit()
-        return True
-    finally:
-        db.close()
 
 
 # --- Patient helpers ---
-_P_ID_RE = re.compile(r"^P(\d+)$", re.IGNORECASE)
+_P_ID_RE = re.compile(r"\s*P(\d+)\s*", re.IGNORECASE)  # used with fullmatch; tolerates padding
+
+
+# Highest numeric suffix among "P<digits>" identifiers, computed in the database
+_MAX_P_NUM_SQL = {
+    "sqlite": (
+        "SELECT MAX(CAST(SUBSTR(TRIM(identifier), 2) AS INTEGER)) FROM patients "
+        "WHERE TRIM(identifier) LIKE 'P%' AND LENGTH(TRIM(identifier)) > 1 "
+        "AND SUBSTR(TRIM(identifier), 2) NOT GLOB '*[^0-9]*'"
+    ),
+    "postgresql": (
+        "SELECT MAX(CAST(SUBSTRING(TRIM(identifier) FROM 2) AS BIGINT)) FROM patients "
+        "WHERE TRIM(identifier) ~* '^P[0-9]+$'"
+    ),
+}
+
+
+def _max_patient_number(db) -> int:
+    """Highest N among "P<N>" identifiers in the patients table (0 if none)."""
+    from sqlalchemy import select, text
+    sql = _MAX_P_NUM_SQL.get(engine.dialect.name)
+    if sql is not None:
+        return int(db.execute(text(sql)).scalar() or 0)
+    # Other dialects: stream identifiers instead of materializing them all
+    rows = db.execute(select(Patient.identifier).execution_options(yield_per=1000)).scalars()
+    max_n = 0
+    for ident in rows:
+        if not ident or (ident[0] not in "Pp" and not ident[0].isspace()):
+            continue
+        m = _P_ID_RE.fullmatch(ident)
+        if m:
+            n = int(m.group(1))
+            if n > max_n:
+                max_n = n
+    return max_n
+
+
+def get_next_global_patient_identifier(db=None) -> str:
+    """Next patient identifier (P001, P002, ...) from the latest in the DB, so counts continue globally across clinicians."""
+    with session_scope(db) as db:
+        return f"P{_max_patient_number(db) + 1:03d}"
 
 
-def get_next_global_patient_identifier() -> str:
-    """Next patient identifier (P001, P002, ...) from the latest in the DB, so counts continue globally across clinicians."""
-    db = SessionLocal()
-    try:
-        rows = db.query(Patient.identifier).all()
-        max_n = 0
-        for (ident,) in rows:
-            if not ident:
-                continue
-            m = _P_ID_RE.match(ident.strip())
-            if m:
-                max_n = max(max_n, int(m.group(1)))
-        return f"P{max_n + 1:03d}"
-    finally:
-        db.close()
+def _bump_patient_counter(db, n: int) -> None:
+    """Raise the counter to at least n (manual "P<n>" identifiers must not be handed out again)."""
+    from sqlalchemy import text
+    db.execute(
+        text("UPDATE patient_counter SET last_n = CASE WHEN last_n < :n THEN :n ELSE last_n END WHERE id = 1"),
+        {"n": n},
+    )
 
 
-def list_patients_for_user(clinician_id: int):
-    """Patients created by this clinician."""
-    db = SessionLocal()
-    try:
+def _allocate_patient_number(db) -> int:
+    """
+    Atomically take the next P-number inside the caller's transaction.
+
+    The UPDATE locks the counter row (Postgres) / the database (SQLite) until commit,
+    so concurrent callers can never read the same value.
+    """
+    from sqlalchemy import text
+    db.execute(text("UPDATE patient_counter SET last_n = last_n + 1 WHERE id = 1"))
+    return int(db.execute(text("SELECT last_n FROM patient_counter WHERE id = 1")).scalar())
+
+
+def allocate_patient_identifier(db=None) -> str:
+    """Reserve and return the next global identifier (P001, P002, ...)."""
+    with session_scope(db) as db:
+        n = _allocate_patient_number(db)
+        db.commit()
+        return f"P{n:03d}"
+
+
+def list_patients_for_user(clinician_id: int, db=None):
+    """Patients created by this clinician, ordered by id (the app's "Patient N" order)."""
+    with session_scope(db) as db:
         return (
             db.query(Patient)
             .filter(Patient.clinician_id == clinician_id)
-            .order_by(Patient.created_at.desc())
+            .order_by(Patient.id)
             .all()
         )
-    finally:
-        db.close()
 
 
-def create_patient(identifier: str, clinician_id: int | None = None, display_name: str | None = None) -> int:
-    """Create a patient; returns new patient id."""
-    db = SessionLocal()
-    try:
-        p = Patient(identifier=identifier, clinician_id=clinician_id, display_name=display_name)
-        db.add(p)
+def format_patient_labels(patients) -> dict[int, str]:
+    """
+    patient_id -> display label for patients in id order.
+
+    Primary identifier: patients.identifier (e.g. P010)
+    Secondary hint: ordinal (Patient N) to preserve existing mental model
+    """
+    return {
+        p.id: _format_patient_label(ordinal, p.identifier, p.display_name)
+        for ordinal, p in enumerate(patients, 1)
+    }
+
+
+def _format_patient_label(ordinal: int, identifier: str | None, display_name: str | None) -> str:
+    ident = (identifier or "").strip()
+    if not ident:
+        # fallback to legacy label style if identifier is missing
+        return f"Patient {ordinal}"
+    disp = (display_name or "").strip()
+    return f"{ident} — {disp} (Patient {ordinal})" if disp else f"{ident} (Patient {ordinal})"
+
+
+def patient_label_for(patient_id: int, clinician_id: int, db=None) -> str | None:
+    """
+    Label for one of this clinician's patients, or None if it isn't theirs.
+
+    The ordinal comes from row_number() in SQL, so only the one row is loaded and formatted.
+    """
+    ranked = (
+        select(
+            Patient.id,
+            Patient.identifier,
+            Patient.display_name,
+            func.row_number().over(order_by=Patient.id).label("ordinal"),
+        )
+        .where(Patient.clinician_id == clinician_id)
+        .cte("ranked")
+    )
+    with session_scope(db) as db:
+        row = db.execute(
+            select(ranked.c.ordinal, ranked.c.identifier, ranked.c.display_name).where(ranked.c.id == patient_id)
+        ).first()
+    return _format_patient_label(*row) if row is not None else None
+
+
+# (clinician_id, (count, max_id)) -> labels. Patients are never edited or deleted, so a
+# new row always changes the signature; any process sees other processes' inserts too.
+_PATIENT_LABELS_MAX = 256
+_patient_labels: dict[tuple[int, tuple[int, int | None]], dict[int, str]] = {}
+_patient_labels_lock = threading.Lock()  # request threads read, evict and insert concurrently
+
+
+def patient_labels_for_user(clinician_id: int, db=None) -> dict[int, str]:
+    """Labels for this clinician's patients; cached until their patient set changes. Don't mutate."""
+    with session_scope(db) as db:
+        sig = tuple(
+            db.execute(
+                select(func.count(Patient.id), func.max(Patient.id)).where(Patient.clinician_id == clinician_id)
+            ).one()
+        )
+        key = (clinician_id, sig)
+        with _patient_labels_lock:
+            labels = _patient_labels.get(key)
+        if labels is None:
+            # Built outside the lock; a concurrent miss on the same key just builds it twice
+            labels = format_patient_labels(list_patients_for_user(clinician_id, db=db))
+            with _patient_labels_lock:
+                if key not in _patient_labels and len(_patient_labels) >= _PATIENT_LABELS_MAX:
+                    _patient_labels.pop(next(iter(_patient_labels)))
+                _patient_labels[key] = labels
+        return labels
+
+
+def _insert_ignoring_conflicts(model):
+    """INSERT that skips rows violating a unique constraint (SQLite / Postgres ON CONFLICT DO NOTHING)."""
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif engine.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy import insert
+        return insert(model)
+    return insert(model).on_conflict_do_nothing()
+
+
+def create_patient(
+    identifier: str, clinician_id: int | None = None, display_name: str | None = None, db=None
+) -> int:
+    """
+    Create a patient; returns its id.
+
+    If this clinician already has a patient with the same identifier, that patient's id is
+    returned instead (INSERT ... ON CONFLICT DO NOTHING, then a lookup).
+    """
+    from sqlalchemy import select
+    with session_scope(db) as db:
+        m = _P_ID_RE.fullmatch(identifier or "")
+        if m:
+            _bump_patient_counter(db, int(m.group(1)))
+        pid = db.execute(
+            _insert_ignoring_conflicts(Patient)
+            .values(identifier=identifier, clinician_id=clinician_id, display_name=display_name)
+            .returning(Patient.id)
+        ).scalar()
+        if pid is None:
+            pid = db.execute(
+                select(Patient.id).where(
+                    Patient.identifier == identifier,
+                    Patient.clinician_id == clinician_id,
+                )
+            ).scalar()
         db.commit()
-        return p.id
-    finally:
-        db.close()
+        return pid
+
+
+def create_patient_with_next_identifier(
+    clinician_id: int | None = None, display_name: str | None = None, db=None
+) -> tuple[int, str]:
+    """Allocate the next P-number and insert the patient in one transaction; returns (id, identifier)."""
+    with session_scope(db) as db:
+        identifier = f"P{_allocate_patient_number(db):03d}"
+        # Core INSERT ... RETURNING: no unit-of-work flush or post-commit refetch just for the id
+        pid = db.execute(
+            insert(Patient)
+            .values(identifier=identifier, clinician_id=clinician_id, display_name=display_name)
+            .returning(Patient.id)
+        ).scalar_one()
+        db.commit()
+        return pid, identifier
 
 
-def get_patient(patient_id: int):
+def get_patient(patient_id: int, db=None):
     """Return Patient by id or None."""
-    db = SessionLocal()
-    try:
-        return db.query(Patient).filter(Patient.id == patient_id).first()
-    finally:
-        db.close()
+    with session_scope(db) as db:
+        return db.execute(_SELECT_PATIENT, {"pid": patient_id}).scalar_one_or_none()
 
 
-def get_conversation_messages(conversation_id: str):
-    db = SessionLocal()
-    try:
+def find_patient_id_for_clinician(identifier: str, clinician_id: int, db=None) -> int | None:
+    """
+    Id of this clinician's patient whose identifier matches ignoring case and surrounding spaces.
+
+    Legacy rows may be stored as "p001" or " P001"; create_patient's exact-match conflict
+    check would not see them and would create a twin.
+    """
+    ident = (identifier or "").strip().upper()
+    with session_scope(db) as db:
+        return db.execute(
+            select(Patient.id)
+            .where(Patient.clinician_id == clinician_id, func.upper(func.trim(Patient.identifier)) == ident)
+            .order_by(Patient.id)
+            .limit(1)
+        ).scalar()
+
+
+def get_conversation_messages(conversation_id: str, db=None):
+    with session_scope(db) as db:
         return (
             db.query(Message)
               .filter(Message.conversation_id == conversation_id)
               .order_by(Message.created_at.asc())
               .all()
         )
-    finally:
-        db.close()
+
+
+def iter_conversation_messages(conversation_id: str, batch_size: int = 200, db=None):
+    """Yield messages oldest first, fetched in batches from a streaming cursor (session held while iterating)."""
+    with session_scope(db) as db:
+        yield from (
+            db.query(Message)
+              .filter(Message.conversation_id == conversation_id)
+              .order_by(Message.created_at.asc())
+              .execution_options(stream_results=True)
+              .yield_per(batch_size)
+        )
+
+
+def message_previews_for_user(user_id: int, db=None) -> dict[str, tuple[str | None, int]]:
+    """conversation_id -> (first message text, message count) for this clinician, in one query."""
+    ranked = (
+        select(
+            Message.conversation_id,
+            Message.message,
+            func.row_number().over(
+                partition_by=Message.conversation_id, order_by=Message.created_at.asc()
+            ).label("rn"),
+            func.count().over(partition_by=Message.conversation_id).label("n"),
+        )
+        .where(Message.conversation_id.in_(select(Conversation.id).where(Conversation.owner_user_id == user_id)))
+        .subquery()
+    )
+    with session_scope(db) as db:
+        rows = db.execute(select(ranked.c.conversation_id, ranked.c.message, ranked.c.n).where(ranked.c.rn == 1))
+        return {cid: (message, n) for cid, message, n in rows}
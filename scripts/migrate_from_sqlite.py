@@ -26,6 +26,7 @@ from __future__ import annotations
 
 import os
 import sys
+import uuid
 from pathlib import Path
 
 ROOT = Path(__file__).resolve().parents[1]
@@ -36,7 +37,15 @@ from dotenv import load_dotenv
 
 load_dotenv(ROOT / ".env")
 
-from sqlalchemy import create_engine, inspect, text
+from sqlalchemy import bindparam, create_engine, inspect, text
+
+import models  # after load_dotenv: binds to the same DATABASE_URL (the target)
+
+
+# table -> columns holding conversation/message UUIDs
+_UUID_COLS: dict[str, set[str]] = {}
+for _table, _col in models._UUID_COLUMNS:
+    _UUID_COLS.setdefault(_table, set()).add(_col)
 
 
 def _norm_sqlalchemy_url(raw: str) -> str:
@@ -55,6 +64,32 @@ def _colset(insp, table: str) -> set[str]:
         return set()
 
 
+def _plain_row(row, table: str) -> dict:
+    """Row as a dict, with this table's UUID columns (16-byte BLOBs in SQLite) as text."""
+    d = dict(row)
+    for k in _UUID_COLS.get(table, ()):
+        v = d.get(k)
+        if isinstance(v, (bytes, memoryview)) and len(v) == 16:
+            d[k] = str(uuid.UUID(bytes=bytes(v)))
+    return d
+
+
+def _uuid_sql(sql: str, *names: str):
+    """text() with the named parameters bound through UUIDString (BLOB on SQLite, uuid on Postgres)."""
+    return text(sql).bindparams(*(bindparam(n, type_=models.UUIDString()) for n in names))
+
+
+def _clock_seconds(value):
+    """messages.timestamp as integer seconds of day (older SQLite files hold "HH:MM:SS" text)."""
+    if value is None or isinstance(value, int):
+        return value
+    parts = str(value).strip().split(":")
+    if len(parts) != 3 or not all(p.isdigit() for p in parts):
+        return None
+    h, m, s = (int(p) for p in parts)
+    return h * 3600 + m * 60 + s
+
+
 def main() -> int:
     target = os.getenv("DATABASE_URL", "").strip()
     if not target:
@@ -229,7 +264,7 @@ def main() -> int:
         pid_map: dict[int, int] = {}
         p_ins = p_skip = 0
         for row in patients:
-            d = dict(row)
+            d = _plain_row(row, "patients")
             sid = int(d["id"])
             if conn.execute(
                 text("SELECT 1 FROM patients WHERE id = :i LIMIT 1"), {"i": sid}
@@ -256,6 +291,9 @@ def main() -> int:
             p_ins += 1
         stats["patients_inserted"] = p_ins
         stats["patients_skipped"] = p_skip
+        # init_db() seeded patient_counter before these rows existed; raise it past the copied
+        # P-numbers so create_patient_with_next_identifier can't hand them out again
+        models._bump_patient_counter(conn, models._max_patient_number(conn))
 
         def map_patient_fk(val) -> int | None:
             if val is None:
@@ -276,10 +314,10 @@ def main() -> int:
         # --- conversations ---
         c_ins = c_skip = 0
         for row in conversations:
-            d = dict(row)
+            d = _plain_row(row, "conversations")
             cid = d["id"]
             if conn.execute(
-                text("SELECT 1 FROM conversations WHERE id = :c LIMIT 1"), {"c": cid}
+                _uuid_sql("SELECT 1 FROM conversations WHERE id = :c LIMIT 1", "c"), {"c": cid}
             ).scalar():
                 c_skip += 1
                 continue
@@ -289,10 +327,11 @@ def main() -> int:
             paused_at = d.get("paused_at") if "paused_at" in conv_cols else None
             resumed_at = d.get("resumed_at") if "resumed_at" in conv_cols else None
             conn.execute(
-                text(
+                _uuid_sql(
                     "INSERT INTO conversations (id, created_at, owner_user_id, patient_id, "
                     "status, paused_at, resumed_at) VALUES "
-                    "(:id, :created_at, :owner_user_id, :patient_id, :status, :paused_at, :resumed_at)"
+                    "(:id, :created_at, :owner_user_id, :patient_id, :status, :paused_at, :resumed_at)",
+                    "id",
                 ),
                 {
                     "id": cid,
@@ -311,23 +350,24 @@ def main() -> int:
         # --- messages ---
         m_ins = m_skip = 0
         for row in messages:
-            d = dict(row)
+            d = _plain_row(row, "messages")
             mid = d["id"]
             if conn.execute(
-                text("SELECT 1 FROM messages WHERE id = :i LIMIT 1"), {"i": mid}
+                _uuid_sql("SELECT 1 FROM messages WHERE id = :i LIMIT 1", "i"), {"i": mid}
             ).scalar():
                 m_skip += 1
                 continue
             conv_ref = d.get("conversation_id")
             if not conv_ref or not conn.execute(
-                text("SELECT 1 FROM conversations WHERE id = :c LIMIT 1"), {"c": conv_ref}
+                _uuid_sql("SELECT 1 FROM conversations WHERE id = :c LIMIT 1", "c"), {"c": conv_ref}
             ).scalar():
                 m_skip += 1
                 continue
             conn.execute(
-                text(
+                _uuid_sql(
                     "INSERT INTO messages (id, conversation_id, role, type, message, timestamp, created_at) "
-                    "VALUES (:id, :conversation_id, :role, :type, :message, :timestamp, :created_at)"
+                    "VALUES (:id, :conversation_id, :role, :type, :message, :timestamp, :created_at)",
+                    "id", "conversation_id",
                 ),
                 {
                     "id": mid,
@@ -335,18 +375,22 @@ def main() -> int:
                     "role": d.get("role"),
                     "type": d.get("type") or "message",
                     "message": d.get("message"),
-                    "timestamp": d.get("timestamp"),
+                    "timestamp": _clock_seconds(d.get("timestamp")),
                     "created_at": d.get("created_at"),
                 },
             )
             m_ins += 1
         stats["messages_inserted"] = m_ins
         stats["messages_skipped"] = m_skip
+        # Raw INSERTs above bypass the message loggers; the dashboard hides rows without it
+        stats["last_message_at_backfilled"] = conn.execute(
+            text(models._BACKFILL_LAST_MESSAGE_AT_SQL)
+        ).rowcount
 
         # --- conversation_owners (legacy/aux) ---
         co_ins = co_skip = 0
         for row in conv_owners:
-            d = dict(row)
+            d = _plain_row(row, "conversation_owners")
             oid = d["id"]
             if conn.execute(
                 text("SELECT 1 FROM conversation_owners WHERE id = :i LIMIT 1"), {"i": oid}
@@ -355,7 +399,7 @@ def main() -> int:
                 continue
             cref = d.get("conversation_id")
             if not cref or not conn.execute(
-                text("SELECT 1 FROM conversations WHERE id = :c LIMIT 1"), {"c": cref}
+                _uuid_sql("SELECT 1 FROM conversations WHERE id = :c LIMIT 1", "c"), {"c": cref}
             ).scalar():
                 co_skip += 1
                 continue
@@ -364,9 +408,10 @@ def main() -> int:
                 co_skip += 1
                 continue
             conn.execute(
-                text(
+                _uuid_sql(
                     "INSERT INTO conversation_owners (id, conversation_id, owner_user_id) "
-                    "VALUES (:id, :conversation_id, :owner_user_id)"
+                    "VALUES (:id, :conversation_id, :owner_user_id)",
+                    "conversation_id",
                 ),
                 {
                     "id": oid,
@@ -381,29 +426,30 @@ def main() -> int:
         # --- conversation_disease_likelihoods ---
         dl_ins = dl_skip = 0
         for row in disease_rows:
-            d = dict(row)
+            d = _plain_row(row, "conversation_disease_likelihoods")
             conv_id = d["conversation_id"]
             if conn.execute(
-                text(
-                    "SELECT 1 FROM conversation_disease_likelihoods WHERE conversation_id = :c LIMIT 1"
+                _uuid_sql(
+                    "SELECT 1 FROM conversation_disease_likelihoods WHERE conversation_id = :c LIMIT 1", "c"
                 ),
                 {"c": conv_id},
             ).scalar():
                 dl_skip += 1
                 continue
             if not conn.execute(
-                text("SELECT 1 FROM conversations WHERE id = :c LIMIT 1"), {"c": conv_id}
+                _uuid_sql("SELECT 1 FROM conversations WHERE id = :c LIMIT 1", "c"), {"c": conv_id}
             ).scalar():
                 dl_skip += 1
                 continue
             conn.execute(
-                text(
+                _uuid_sql(
                     "INSERT INTO conversation_disease_likelihoods ("
                     "conversation_id, analyzed_at, cancer_likelihood_pct, symptoms_json, "
                     "top_diseases_json, faiss_matches_json, patient_label, clinician_label) "
                     "VALUES ("
                     ":conversation_id, :analyzed_at, :cancer_likelihood_pct, :symptoms_json, "
-                    ":top_diseases_json, :faiss_matches_json, :patient_label, :clinician_label)"
+                    ":top_diseases_json, :faiss_matches_json, :patient_label, :clinician_label)",
+                    "conversation_id",
                 ),
                 {
                     "conversation_id": conv_id,
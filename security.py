@@ -1,12 +1,37 @@
+import hashlib
+import hmac
+import os
+import time
+
 from argon2 import PasswordHasher
 from argon2.low_level import Type
 ph = PasswordHasher(time_cost=3, memory_cost=64*1024, parallelism=2, hash_len=32, type=Type.ID)
 
+# Short-lived record of successful verifies so re-checks within a session skip the KDF.
+# Keys are HMACs under a per-process secret; no password material is kept in memory.
+_VERIFY_TTL_SEC = 60
+_VERIFY_CACHE_MAX = 1024
+_verify_secret = os.urandom(32)
+_verify_cache: dict[bytes, float] = {}
+
 def hash_password(pw: str) -> str:
     return ph.hash(pw)
 
 def verify_password(hash_: str, pw: str) -> bool:
+    key = hmac.new(_verify_secret, f"{hash_}\0{pw}".encode(), hashlib.blake2b).digest()
+    now = time.monotonic()
+    if _verify_cache.get(key, 0.0) > now:
+        return True
     try:
-        return ph.verify(hash_, pw)
+        ok = ph.verify(hash_, pw)
     except Exception:
         return False
+    if ok:
+        if len(_verify_cache) >= _VERIFY_CACHE_MAX:
+            for k, exp in list(_verify_cache.items()):
+                if exp <= now:
+                    _verify_cache.pop(k, None)
+            if len(_verify_cache) >= _VERIFY_CACHE_MAX:
+                _verify_cache.clear()
+        _verify_cache[key] = now + _VERIFY_TTL_SEC
+    return ok
@@ -4,7 +4,9 @@
 # 2) Optional local faster-whisper fallback when Gemini is overloaded.
 
 import os
-import io
+import base64
+import hashlib
+import itertools
 import json
 import time
 import uuid
@@ -14,13 +16,23 @@ import tempfile
 import threading
 import subprocess
 import logging
-import wave
 import random
+import struct
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
 from typing import Optional, Callable, Any
+from urllib.parse import parse_qs
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
 
 import numpy as np
 import webrtcvad
 from flask import Blueprint, request, jsonify
+from flask_login import current_user, login_required
 
 from google import genai
 from google.genai import types as genai_types
@@ -52,28 +64,85 @@ VAD_VOICED_RATIO_MIN = float(os.getenv("VAD_VOICED_RATIO_MIN", "0.65")) # 0..1
 STT_SEGMENT_SILENCE_MS = int(os.getenv("STT_SEGMENT_SILENCE_MS", "1200"))
 STT_MAX_SEGMENT_MS = int(os.getenv("STT_MAX_SEGMENT_MS", "10000"))
 
+# ffmpeg decoder I/O: PCM read size per VAD tick and pipe buffer size
+STT_PCM_BLOCK_MS = int(os.getenv("STT_PCM_BLOCK_MS", "300"))
+STT_PIPE_BYTES = int(os.getenv("STT_PIPE_BYTES", str(1024 * 1024)))
+# Decoded PCM blocks buffered ahead of the VAD loop (default ~6.4 s of audio)
+STT_PCM_QUEUE_MAX = max(1, int(os.getenv("STT_PCM_QUEUE_MAX", str(max(1, 6400 // max(1, STT_PCM_BLOCK_MS))))))
+
 EMIT_PARTIALS = os.getenv("EMIT_PARTIALS", "false").lower() in ("1", "true", "yes", "y")
 STT_PARTIAL_MIN_INTERVAL_MS = int(os.getenv("STT_PARTIAL_MIN_INTERVAL_MS", "700"))
 
+# Segments transcribed in parallel per connection (finals are still emitted in order)
+STT_CONCURRENCY = max(1, int(os.getenv("STT_CONCURRENCY", "3")))
+# Segments allowed to wait behind those; older ones are dropped past this
+STT_INFLIGHT_MAX = max(1, int(os.getenv("STT_INFLIGHT_MAX", "4")))
+# Transcripts remembered by audio hash (0 disables)
+STT_TRANSCRIPT_CACHE_SIZE = int(os.getenv("STT_TRANSCRIPT_CACHE_SIZE", "256"))
+
+# Languages: accepted spellings -> canonical name -> prompt / whisper code
+_LANG_ALIASES = {
+    "english": "english",
+    "en": "english",
+    "swahili": "swahili",
+    "sw": "swahili",
+    "kiswahili": "swahili",
+    "bilingual": "bilingual",
+}
+_LANG_PROMPTS = {
+    "english": "Transcribe the audio in English.",
+    "swahili": "Transcribe the audio in Swahili.",
+    "bilingual": "Transcribe the audio. The speaker may use English and/or Swahili.",
+}
+_WHISPER_LANG_CODES = {"english": "en", "swahili": "sw", "bilingual": None}
+
+
+def _canonical_lang(lang: Optional[str]) -> str:
+    # Exact hit first: callers almost always pass an already-normalised name
+    return _LANG_ALIASES.get(lang) or _LANG_ALIASES.get((lang or "").lower(), "bilingual")
+
+
 # Retry behavior (overload handling)
 GEMINI_MAX_ATTEMPTS = int(os.getenv("GEMINI_MAX_ATTEMPTS", "6"))
 GEMINI_RETRY_BASE_DELAY = float(os.getenv("GEMINI_RETRY_BASE_DELAY", "0.6"))
 GEMINI_RETRY_MAX_DELAY = float(os.getenv("GEMINI_RETRY_MAX_DELAY", "8.0"))
+GEMINI_MAX_INFLIGHT = max(1, int(os.getenv("GEMINI_MAX_INFLIGHT", "8")))
 
 # Optional local fallback (faster-whisper)
 USE_LOCAL_WHISPER_FALLBACK = os.getenv("USE_LOCAL_WHISPER_FALLBACK", "true").lower() in ("1", "true", "yes", "y")
 WHISPER_MODEL_SIZE = os.getenv("WHISPER_MODEL_SIZE", "small")
-WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")  # int8 / float16 etc.
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "")  # int8 / float16 etc.; empty = float16 on CUDA, else int8
+WHISPER_PRELOAD = os.getenv("WHISPER_PRELOAD", "true").lower() in ("1", "true", "yes", "y")
 
 # -----------------------------------------------------------------------------
-# Optional faster-whisper
+# Optional faster-whisper / numba
 # -----------------------------------------------------------------------------
 try:
     from faster_whisper import WhisperModel  # type: ignore
 except Exception:  # pragma: no cover
     WhisperModel = None
 
+# Optional numba: JIT for the per-frame energy gate (numpy version otherwise)
+try:
+    from numba import njit  # type: ignore
+except Exception:  # pragma: no cover
+    njit = None
+
 _WHISPER_MODEL: Optional[Any] = None
+_WHISPER_LOAD_LOCK = threading.Lock()
+
+
+def _whisper_compute_type() -> str:
+    if WHISPER_COMPUTE_TYPE:
+        return WHISPER_COMPUTE_TYPE
+    try:
+        import ctranslate2  # faster-whisper's backend
+
+        if ctranslate2.get_cuda_device_count() > 0:
+            return "float16"
+    except Exception:
+        pass
+    return "int8"
 
 
 def _get_whisper_model() -> Optional[Any]:
@@ -86,25 +155,37 @@ def _get_whisper_model() -> Optional[Any]:
     if _WHISPER_MODEL is not None:
         return _WHISPER_MODEL
 
-    # If CUDA is available, faster-whisper can use it automatically when device='cuda'.
-    # We default to 'auto' to avoid hard failures.
-    device = os.getenv("WHISPER_DEVICE", "auto")
-    try:
-        _WHISPER_MODEL = WhisperModel(WHISPER_MODEL_SIZE, device=device, compute_type=WHISPER_COMPUTE_TYPE)
-        logger.info(f"Loaded faster-whisper model: size={WHISPER_MODEL_SIZE}, device={device}, compute={WHISPER_COMPUTE_TYPE}")
-    except Exception:
-        logger.exception("Failed to load faster-whisper model; local fallback disabled")
-        _WHISPER_MODEL = None
+    with _WHISPER_LOAD_LOCK:
+        if _WHISPER_MODEL is not None:
+            return _WHISPER_MODEL
+
+        # If CUDA is available, faster-whisper can use it automatically when device='cuda'.
+        # We default to 'auto' to avoid hard failures.
+        device = os.getenv("WHISPER_DEVICE", "auto")
+        compute_type = _whisper_compute_type()
+        try:
+            # num_workers > 1 lets concurrent WS sessions transcribe in parallel
+            _WHISPER_MODEL = WhisperModel(
+                WHISPER_MODEL_SIZE,
+                device=device,
+                compute_type=compute_type,
+                cpu_threads=max(1, (os.cpu_count() or 2) // 2),
+                num_workers=int(os.getenv("WHISPER_NUM_WORKERS", "2")),
+            )
+            logger.info(f"Loaded faster-whisper model: size={WHISPER_MODEL_SIZE}, device={device}, compute={compute_type}")
+        except Exception:
+            logger.exception("Failed to load faster-whisper model; local fallback disabled")
+            _WHISPER_MODEL = None
     return _WHISPER_MODEL
 
 
+# Warm the fallback model in the background so the first 503 doesn't also pay the load.
+if USE_LOCAL_WHISPER_FALLBACK and WHISPER_PRELOAD and WhisperModel is not None:
+    threading.Thread(target=_get_whisper_model, name="whisper-preload", daemon=True).start()
+
+
 def _whisper_lang_code(lang: str) -> Optional[str]:
-    lang = (lang or "bilingual").lower()
-    if lang in ("english", "en"):
-        return "en"
-    if lang in ("swahili", "sw", "kiswahili"):
-        return "sw"
-    return None  # auto
+    return _WHISPER_LANG_CODES[_canonical_lang(lang)]  # None = auto
 
 
 def whisper_transcribe_pcm16(pcm_s16le: bytes, lang: str) -> str:
@@ -113,19 +194,12 @@ def whisper_transcribe_pcm16(pcm_s16le: bytes, lang: str) -> str:
     if model is None:
         return ""
 
-    wav_bytes = write_wav_bytes(pcm_s16le, sample_rate=SAMPLE_RATE)
-
-    # Write to temp wav for faster-whisper (simple + reliable)
-    tmp = None
     try:
-        tmp = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
-        tmp.write(wav_bytes)
-        tmp.flush()
-        tmp.close()
-
+        # faster-whisper takes float32 mono @ 16 kHz directly; no WAV/tempfile/ffmpeg hop
+        audio_f32 = pcm_s16le_bytes_to_float32(pcm_s16le)
         language = _whisper_lang_code(lang)
         segments, _info = model.transcribe(
-            tmp.name,
+            audio_f32,
             language=language,
             beam_size=int(os.getenv("WHISPER_BEAM_SIZE", "3")),
             vad_filter=False,
@@ -139,20 +213,20 @@ def whisper_transcribe_pcm16(pcm_s16le: bytes, lang: str) -> str:
     except Exception:
         logger.exception("Local faster-whisper fallback transcription failed")
         return ""
-    finally:
-        try:
-            if tmp is not None and os.path.exists(tmp.name):
-                os.unlink(tmp.name)
-        except Exception:
-            pass
 
 
 # -----------------------------------------------------------------------------
 # Gemini client
 # -----------------------------------------------------------------------------
 
+_client_local = threading.local()
+
+
 def _gemini_client() -> genai.Client:
-    """Prefer GEMINI_API_KEY if present. Fall back to GOOGLE_API_KEY only if needed."""
+    """Prefer GEMINI_API_KEY if present. Fall back to GOOGLE_API_KEY only if needed.
+
+    Cached per thread so request threads reuse the SDK's HTTP connection pool.
+    """
     gemini_key = os.getenv("GEMINI_API_KEY")
     google_key = os.getenv("GOOGLE_API_KEY")
 
@@ -160,7 +234,12 @@ def _gemini_client() -> genai.Client:
     if not key:
         raise RuntimeError("Missing GEMINI_API_KEY (or GOOGLE_API_KEY) in environment.")
 
-    return genai.Client(api_key=key)
+    cached = getattr(_client_local, "client", None)
+    if cached is None or getattr(_client_local, "key", None) != key:
+        cached = genai.Client(api_key=key)
+        _client_local.client = cached
+        _client_local.key = key
+    return cached
 
 
 def _gemini_model_name() -> str:
@@ -193,6 +272,42 @@ def _is_overload_error(e: Exception) -> bool:
     return False
 
 
+# Process-wide cap on in-flight Gemini requests across all WS sessions and REST calls,
+# so we don't trip the project quota (and its 503s) ourselves.
+_GEMINI_INFLIGHT = threading.BoundedSemaphore(GEMINI_MAX_INFLIGHT)
+
+
+def _release_inflight_after(chunks):
+    try:
+        yield from chunks
+    finally:
+        _GEMINI_INFLIGHT.release()
+
+
+def _gemini_call(client: genai.Client, model: str, contents, config, stream: bool):
+    """One request under the in-flight cap; a stream holds its slot until fully consumed or closed."""
+    _GEMINI_INFLIGHT.acquire()
+    handed_off = False
+    try:
+        if stream:
+            chunks = iter(client.models.generate_content_stream(
+                model=model,
+                contents=contents,
+                config=config,
+            ))
+            first = next(chunks, None)
+            handed_off = True
+            return _release_inflight_after(itertools.chain(() if first is None else (first,), chunks))
+        return client.models.generate_content(
+            model=model,
+            contents=contents,
+            config=config,
+        )
+    finally:
+        if not handed_off:
+            _GEMINI_INFLIGHT.release()
+
+
 def gemini_generate_with_retry(
     client: genai.Client,
     contents,
@@ -202,8 +317,13 @@ def gemini_generate_with_retry(
     max_delay: float = GEMINI_RETRY_MAX_DELAY,
     on_retry: Optional[Callable[[str, int, int, float], None]] = None,
     on_model_switch: Optional[Callable[[str], None]] = None,
+    stream: bool = False,
 ):
-    """Retry on 503 overload with exponential backoff + jitter; try fallback models."""
+    """Retry on 503 overload with exponential backoff + jitter; try fallback models.
+
+    With stream=True returns an iterator of response chunks. Only opening the
+    stream (up to the first chunk, where a 503 surfaces) is retried.
+    """
     last_err: Optional[Exception] = None
     models = _gemini_model_candidates()
 
@@ -214,11 +334,7 @@ def gemini_generate_with_retry(
         delay = base_delay
         for attempt in range(1, max_attempts + 1):
             try:
-                return client.models.generate_content(
-                    model=model,
-                    contents=contents,
-                    config=config,
-                )
+                return _gemini_call(client, model, contents, config, stream)
             except Exception as e:
                 last_err = e
 
@@ -280,26 +396,53 @@ def convert_to_wav_16k(src_path: str) -> str:
     return dst_path
 
 
+def decode_to_pcm16(src_bytes: bytes) -> bytes:
+    """Decode any input audio to 16kHz mono PCM16 in memory (ffmpeg stdin -> stdout)."""
+    cmd = [
+        FFMPEG_BIN,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-i",
+        "pipe:0",
+        "-ac",
+        "1",
+        "-ar",
+        str(SAMPLE_RATE),
+        "-f",
+        "s16le",
+        "pipe:1",
+    ]
+    proc = subprocess.run(cmd, input=src_bytes, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=proc.stdout, stderr=proc.stderr)
+    return proc.stdout
+
+
+_PCM16_SCALE = np.float32(1.0 / 32768.0)
+
+
 def pcm_s16le_bytes_to_float32(pcm: bytes) -> np.ndarray:
-    a = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
-    return a / 32768.0
+    # Single cast-and-scale pass instead of astype() followed by a divide.
+    return np.multiply(np.frombuffer(pcm, dtype=np.int16), _PCM16_SCALE, dtype=np.float32)
 
 
 def write_wav_bytes(pcm_s16le: bytes, sample_rate: int = SAMPLE_RATE) -> bytes:
-    """Return WAV bytes for PCM16 mono."""
-    buf = io.BytesIO()
-    with wave.open(buf, "wb") as wf:
-        wf.setnchannels(1)
-        wf.setsampwidth(2)  # int16
-        wf.setframerate(sample_rate)
-        wf.writeframes(pcm_s16le)
-    return buf.getvalue()
+    """Return WAV bytes for PCM16 mono (fixed 44-byte RIFF header + data)."""
+    n = len(pcm_s16le)
+    hdr = struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + n, b"WAVE",
+        b"fmt ", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b"data", n,
+    )
+    return hdr + pcm_s16le
 
 
 def rms_level_f32(audio: np.ndarray) -> float:
     if audio.size == 0:
         return 0.0
-    return float(np.sqrt(np.mean(audio**2)))
+    return float(np.sqrt(np.dot(audio, audio) / audio.size))
 
 
 # -----------------------------------------------------------------------------
@@ -307,29 +450,40 @@ def rms_level_f32(audio: np.ndarray) -> float:
 # -----------------------------------------------------------------------------
 
 def _lang_prompt(lang: str) -> str:
-    lang = (lang or "bilingual").lower()
-    if lang in ("english", "en"):
-        return "Transcribe the audio in English."
-    if lang in ("swahili", "sw", "kiswahili"):
-        return "Transcribe the audio in Swahili."
-    return "Transcribe the audio. The speaker may use English and/or Swahili."
+    return _LANG_PROMPTS[_canonical_lang(lang)]
+
+
+# Request pieces that never change between segments; built once.
+_GEN_CFG = genai_types.GenerateContentConfig(temperature=0.0)
+_PROMPT_PARTS = {k: genai_types.Part.from_text(text=p) for k, p in _LANG_PROMPTS.items()}
+
+
+def _prompt_part(lang: str):
+    return _PROMPT_PARTS[_canonical_lang(lang)]
 
 
 def gemini_transcribe_wav_file(wav_path: str, lang: str = "bilingual") -> str:
     """Batch transcription for a WAV file."""
-    client = _gemini_client()
-    prompt = _lang_prompt(lang)
-
     with open(wav_path, "rb") as f:
         wav_bytes = f.read()
+    return gemini_transcribe_wav_bytes(wav_bytes, lang=lang)
+
 
+def gemini_transcribe_audio_bytes(src_bytes: bytes, lang: str = "bilingual") -> str:
+    """Batch transcription for uploaded audio of any format, without temp files."""
+    pcm = decode_to_pcm16(src_bytes)
+    return gemini_transcribe_wav_bytes(write_wav_bytes(pcm, sample_rate=SAMPLE_RATE), lang=lang)
+
+
+def gemini_transcribe_wav_bytes(wav_bytes: bytes, lang: str = "bilingual") -> str:
+    client = _gemini_client()
     audio_part = genai_types.Part.from_bytes(data=wav_bytes, mime_type="audio/wav")
 
     contents = [
         genai_types.Content(
             role="user",
             parts=[
-                genai_types.Part.from_text(text=prompt),
+                _prompt_part(lang),
                 audio_part,
             ],
         )
@@ -338,12 +492,98 @@ def gemini_transcribe_wav_file(wav_path: str, lang: str = "bilingual") -> str:
     resp = gemini_generate_with_retry(
         client=client,
         contents=contents,
-        config=genai_types.GenerateContentConfig(temperature=0.0),
+        config=_GEN_CFG,
     )
 
     return (resp.text or "").strip()
 
 
+# -----------------------------------------------------------------------------
+# Gemini transcription (Batch API, async)
+# -----------------------------------------------------------------------------
+
+def gemini_transcribe_batch(wav_paths: list[str], lang: str = "bilingual", keys: Optional[list[str]] = None) -> str:
+    """Submit WAV files as one Gemini Batch API job; returns the job name.
+
+    Batch jobs are billed at half the synchronous rate and don't compete for
+    the live quota, but may take up to 24h. Use for backfills, not live STT.
+    """
+    client = _gemini_client()
+    prompt = _lang_prompt(lang)
+    keys = keys or [os.path.basename(p) for p in wav_paths]
+
+    jsonl_path = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4().hex}.jsonl")
+    try:
+        with open(jsonl_path, "w", encoding="utf-8") as out:
+            for key, wav_path in zip(keys, wav_paths):
+                with open(wav_path, "rb") as f:
+                    data = base64.b64encode(f.read()).decode("ascii")
+                line = {
+                    "key": key,
+                    "request": {
+                        "contents": [{
+                            "role": "user",
+                            "parts": [
+                                {"text": prompt},
+                                {"inline_data": {"mime_type": "audio/wav", "data": data}},
+                            ],
+                        }],
+                        "generation_config": {"temperature": 0.0},
+                    },
+                }
+                out.write(json.dumps(line) + "\n")
+
+        uploaded = client.files.upload(
+            file=jsonl_path,
+            config=genai_types.UploadFileConfig(display_name="stt-batch", mime_type="jsonl"),
+        )
+        job = client.batches.create(
+            model=_gemini_model_name(),
+            src=uploaded.name,
+            config={"display_name": f"stt-batch-{len(wav_paths)}"},
+        )
+        return job.name
+    finally:
+        try:
+            os.unlink(jsonl_path)
+        except OSError:
+            pass
+
+
+def gemini_batch_results(job_name: str) -> dict:
+    """Return {"state": ..., "transcripts": {key: text}} for a batch job (transcripts once finished)."""
+    client = _gemini_client()
+    job = client.batches.get(name=job_name)
+    state = getattr(job.state, "name", str(job.state))
+    out: dict = {"job": job_name, "state": state}
+
+    dest = getattr(job, "dest", None)
+    if state != "JOB_STATE_SUCCEEDED" or not getattr(dest, "file_name", None):
+        return out
+
+    raw = client.files.download(file=dest.file_name).decode("utf-8")
+    transcripts: dict[str, str] = {}
+    errors: dict[str, Any] = {}
+    for line in raw.splitlines():
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        key = row.get("key")
+        if "response" not in row:
+            errors[key] = row.get("error") or "no response"
+            continue
+        parts = []
+        for cand in (row["response"].get("candidates") or [])[:1]:
+            for part in (cand.get("content") or {}).get("parts") or []:
+                if part.get("text"):
+                    parts.append(part["text"])
+        transcripts[key] = "".join(parts).strip()
+    out["transcripts"] = transcripts
+    if errors:
+        out["errors"] = errors
+    return out
+
+
 # -----------------------------------------------------------------------------
 # REST endpoint: POST /transcribe_audio
 # -----------------------------------------------------------------------------
@@ -358,13 +598,7 @@ def transcribe_audio():
         if not audio:
             return jsonify({"error": "No audio uploaded"}), 400
 
-        with tempfile.NamedTemporaryFile(suffix=".webm", delete=False) as tmp:
-            audio.save(tmp.name)
-            src_path = tmp.name
-
-        wav_path = convert_to_wav_16k(src_path)
-
-        text = gemini_transcribe_wav_file(wav_path, lang=language)
+        text = gemini_transcribe_audio_bytes(audio.read(), lang=language)
         return jsonify({"text": text, "engine": _effective_engine_name()})
 
     except Exception:
@@ -372,12 +606,93 @@ def transcribe_audio():
         return jsonify({"error": "Audio transcription failed"}), 500
 
 
+# Batch job name -> submitting user id. Status is only served to the owner; jobs submitted
+# before a restart (or on another worker) are refused rather than exposed.
+_BATCH_JOB_OWNERS: "OrderedDict[str, int]" = OrderedDict()
+_BATCH_JOB_OWNERS_MAX = 1024
+_BATCH_JOB_OWNERS_LOCK = threading.Lock()
+
+
+def _remember_batch_owner(job: str, user_id: int) -> None:
+    with _BATCH_JOB_OWNERS_LOCK:
+        _BATCH_JOB_OWNERS[job] = user_id
+        while len(_BATCH_JOB_OWNERS) > _BATCH_JOB_OWNERS_MAX:
+            _BATCH_JOB_OWNERS.popitem(last=False)
+
+
+def _batch_owner(job: str) -> Optional[int]:
+    with _BATCH_JOB_OWNERS_LOCK:
+        return _BATCH_JOB_OWNERS.get(job)
+
+
+@stt_bp.post("/transcribe_audio_batch")
+@login_required
+def transcribe_audio_batch():
+    """Accept multipart form: several `audio` files + lang; returns {job, keys}.
+
+    Poll /transcribe_batch_status/<job> for the transcripts.
+    """
+    src_paths: list[str] = []
+    wav_paths: list[str] = []
+    try:
+        files = [f for f in request.files.getlist("audio") if f]
+        language = (request.form.get("lang") or "bilingual").lower()
+
+        if not files:
+            return jsonify({"error": "No audio uploaded"}), 400
+
+        keys = []
+        for i, audio in enumerate(files):
+            with tempfile.NamedTemporaryFile(suffix=".webm", delete=False) as tmp:
+                audio.save(tmp.name)
+                src_paths.append(tmp.name)
+            wav_paths.append(convert_to_wav_16k(tmp.name))
+            keys.append(f"{i}:{audio.filename or 'audio'}")
+
+        job = gemini_transcribe_batch(wav_paths, lang=language, keys=keys)
+        _remember_batch_owner(job, current_user.id)
+        return jsonify({"job": job, "keys": keys})
+
+    except Exception:
+        logger.exception("Gemini batch transcription submit failed")
+        return jsonify({"error": "Batch transcription submit failed"}), 500
+    finally:
+        for p in src_paths + wav_paths:
+            try:
+                os.unlink(p)
+            except OSError:
+                pass
+
+
+@stt_bp.get("/transcribe_batch_status/<path:job>")
+@login_required
+def transcribe_batch_status(job: str):
+    # Same answer for "not yours" and "unknown" so job names can't be probed
+    if _batch_owner(job) != current_user.id:
+        return jsonify({"error": "Not found or access denied"}), 404
+    try:
+        return jsonify(gemini_batch_results(job))
+    except Exception:
+        logger.exception("Gemini batch status lookup failed")
+        return jsonify({"error": "Batch status lookup failed"}), 500
+
+
 # -----------------------------------------------------------------------------
 # WebSocket STT (live): WS /ws/stt
 # -----------------------------------------------------------------------------
 
+def _grow_pipe(f) -> None:
+    """Raise the kernel pipe capacity (Linux only; 64 KB default)."""
+    if fcntl is None:
+        return
+    try:
+        fcntl.fcntl(f.fileno(), getattr(fcntl, "F_SETPIPE_SZ", 1031), STT_PIPE_BYTES)
+    except OSError:
+        pass  # above /proc/sys/fs/pipe-max-size; keep the default
+
+
 def start_ffmpeg_decoder():
-    return subprocess.Popen(
+    ff = subprocess.Popen(
         [
             FFMPEG_BIN,
             "-hide_banner",
@@ -395,46 +710,164 @@ def start_ffmpeg_decoder():
         ],
         stdin=subprocess.PIPE,
         stdout=subprocess.PIPE,
-        bufsize=0,
+        bufsize=STT_PIPE_BYTES,
     )
+    _grow_pipe(ff.stdin)
+    _grow_pipe(ff.stdout)
+    return ff
 
 
 def parse_lang_query(qs: str) -> str:
-    qs = qs or ""
-    lang_raw = "bilingual"
-    if "lang=" in qs:
-        try:
-            lang_raw = qs.split("lang=")[1].split("&")[0].lower()
-        except Exception:
-            lang_raw = "bilingual"
-
-    if lang_raw in ("english", "en"):
-        return "english"
-    if lang_raw in ("swahili", "sw", "kiswahili"):
-        return "swahili"
-    return "bilingual"
+    return _canonical_lang(parse_qs(qs or "").get("lang", ["bilingual"])[0])
+
+
+def _energy_vad_np(pcm_i16: np.ndarray, frame_samples: int, thresh_sq: float) -> np.ndarray:
+    """uint8 mask of frames whose mean square (int16 units) exceeds thresh_sq."""
+    n = pcm_i16.size // frame_samples
+    frames = pcm_i16[: n * frame_samples].reshape(n, frame_samples).astype(np.int64)
+    return (np.einsum("ij,ij->i", frames, frames) > thresh_sq * frame_samples).astype(np.uint8)
+
+
+_energy_vad = _energy_vad_np
+
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def _energy_vad_jit(pcm_i16, frame_samples, thresh_sq):  # pragma: no cover - needs numba
+        n = pcm_i16.size // frame_samples
+        out = np.zeros(n, dtype=np.uint8)
+        limit = thresh_sq * frame_samples
+        for f in range(n):
+            base = f * frame_samples
+            acc = 0
+            for i in range(frame_samples):
+                v = np.int64(pcm_i16[base + i])
+                acc += v * v
+            if acc > limit:
+                out[f] = 1
+        return out
 
-
-def vad_voiced_ratio(pcm_s16le: bytes, sample_rate: int, vad: webrtcvad.Vad, frame_ms: int) -> float:
+    try:
+        # Compile now (or load from cache) so the first live block doesn't pay the JIT.
+        _energy_vad_jit(np.zeros(2 * int(SAMPLE_RATE * VAD_FRAME_MS / 1000), dtype=np.int16),
+                        int(SAMPLE_RATE * VAD_FRAME_MS / 1000), 1.0)
+        _energy_vad = _energy_vad_jit
+    except Exception:
+        logger.exception("numba energy VAD failed to compile; using numpy version")
+
+
+@dataclass
+class VadState:
+    """Per-frame VAD flags for the segment being built, so each block only classifies new frames."""
+    voiced: bytearray = field(default_factory=bytearray)
+    n_frames: int = 0
+    voiced_count: int = 0
+
+    @property
+    def ratio(self) -> float:
+        return self.voiced_count / float(self.n_frames) if self.n_frames else 0.0
+
+    def reset(self) -> None:
+        self.voiced.clear()
+        self.n_frames = 0
+        self.voiced_count = 0
+
+
+def vad_update(
+    state: VadState,
+    segment,
+    sample_rate: int,
+    vad: webrtcvad.Vad,
+    frame_ms: int,
+    silent: bool = False,
+    energy_thresh: float = 0.0,
+) -> float:
+    """Classify the complete frames appended to `segment` since the last call; return the voiced ratio.
+
+    `segment` is any bytes-like PCM16 buffer (bytearray, or a uint8 view of the segment ring).
+
+    With `silent=True` (the block already failed the energy gate) new frames are
+    recorded as unvoiced without calling webrtcvad. With `energy_thresh` (RMS,
+    0..1) only frames whose own RMS exceeds it are passed to webrtcvad.
+    """
     frame_bytes = int(sample_rate * (frame_ms / 1000.0) * 2)
     if frame_bytes <= 0:
         return 0.0
-    n = len(pcm_s16le) // frame_bytes
-    if n <= 0:
-        return 0.0
-    voiced = 0
-    for i in range(n):
-        frame = pcm_s16le[i * frame_bytes : (i + 1) * frame_bytes]
-        if len(frame) == frame_bytes and vad.is_speech(frame, sample_rate):
-            voiced += 1
-    return voiced / float(n)
+    new_frames = (len(segment) - state.n_frames * frame_bytes) // frame_bytes
+    if new_frames > 0 and silent:
+        state.voiced.extend(bytes(new_frames))
+        state.n_frames += new_frames
+    elif new_frames > 0:
+        start = state.n_frames * frame_bytes
+        energetic = None
+        if energy_thresh > 0.0:
+            frame_samples = frame_bytes // 2
+            pcm = np.frombuffer(segment, dtype=np.int16, count=new_frames * frame_samples, offset=start)
+            thresh_sq = (energy_thresh * 32768.0) ** 2
+            energetic = _energy_vad(pcm, frame_samples, thresh_sq).tobytes()
+            del pcm  # drop the buffer export before the segment can grow again
+        is_speech = vad.is_speech
+        sr = sample_rate
+        view = memoryview(segment)
+        try:
+            voiced = 0
+            for i in range(new_frames):
+                end = start + frame_bytes
+                if energetic is not None and not energetic[i]:
+                    flag = 0
+                else:
+                    flag = 1 if is_speech(view[start:end], sr) else 0
+                state.voiced.append(flag)
+                voiced += flag
+                start = end
+        finally:
+            # A live export would stop a bytearray from growing on the next block.
+            view.release()
+        state.n_frames += new_frames
+        state.voiced_count += voiced
+    return state.ratio
+
+
+def vad_voiced_ratio(pcm_s16le: bytes, sample_rate: int, vad: webrtcvad.Vad, frame_ms: int) -> float:
+    return vad_update(VadState(), bytearray(pcm_s16le), sample_rate, vad, frame_ms)
+
+
+# Recent transcripts keyed by (PCM digest, prompt): repeated partial buffers and
+# identical segments skip the Gemini round trip.
+_TRANSCRIPT_CACHE: "OrderedDict[tuple[bytes, str], str]" = OrderedDict()
+_TRANSCRIPT_CACHE_LOCK = threading.Lock()
+
+
+def _transcript_key(pcm_s16le: bytes, lang: str) -> tuple[bytes, str]:
+    return hashlib.blake2b(pcm_s16le, digest_size=16).digest(), _canonical_lang(lang)
+
+
+def _transcript_cache_get(key: tuple[bytes, str]) -> Optional[str]:
+    with _TRANSCRIPT_CACHE_LOCK:
+        text = _TRANSCRIPT_CACHE.get(key)
+        if text is not None:
+            _TRANSCRIPT_CACHE.move_to_end(key)
+        return text
+
+
+def _transcript_cache_put(key: tuple[bytes, str], text: str) -> None:
+    if STT_TRANSCRIPT_CACHE_SIZE <= 0:
+        return
+    with _TRANSCRIPT_CACHE_LOCK:
+        _TRANSCRIPT_CACHE[key] = text
+        _TRANSCRIPT_CACHE.move_to_end(key)
+        while len(_TRANSCRIPT_CACHE) > STT_TRANSCRIPT_CACHE_SIZE:
+            _TRANSCRIPT_CACHE.popitem(last=False)
 
 
 class GeminiWorker:
-    """Background worker that batches PCM segments and returns transcript text.
+    """Background worker that transcribes PCM segments and returns transcript text.
+
+    Up to STT_CONCURRENCY segments are transcribed in parallel; final events are
+    still emitted in submission order (each segment carries a sequence id).
 
     Emits events:
       - {"type": "final", "text": "...", "engine": "..."}
+      - {"type": "partial", "text": "..."}  (EMIT_PARTIALS; text streamed so far)
       - {"type": "status", "level": "warning|info", "message": "...", "code": "..."}
 
     Includes retry/backoff + model fallbacks for 503 overload.
@@ -442,128 +875,222 @@ class GeminiWorker:
     """
 
     def __init__(self):
-        self.q_in: "queue.Queue[tuple[bytes, str]]" = queue.Queue()
         self.q_out: "queue.Queue[dict]" = queue.Queue()
+        # Set whenever q_out gains an event, so readers only touch the queue when needed
+        self.out_event = threading.Event()
         self.stop = threading.Event()
-        self.thread = threading.Thread(target=self._run, daemon=True)
-        self.thread.start()
+        self.executor = ThreadPoolExecutor(max_workers=STT_CONCURRENCY, thread_name_prefix="stt-gemini")
+        self._client: Optional[genai.Client] = None
+        self._client_lock = threading.Lock()
+        # Ordered emission: results wait in _pending until every earlier seq is out.
+        self._order_lock = threading.Lock()
+        self._next_seq = 0
+        self._emit_seq = 0
+        self._pending: dict[int, list[dict]] = {}
+        self._queued: "deque[tuple[int, Future]]" = deque()
 
     def submit(self, pcm_segment: bytes, lang: str):
-        self.q_in.put((pcm_segment, lang))
+        with self._order_lock:
+            seq = self._next_seq
+            self._next_seq += 1
+        self._shed_backlog()
+        try:
+            fut = self.executor.submit(self._transcribe_one, pcm_segment, lang, seq)
+        except RuntimeError:
+            # Executor already shut down (connection closing).
+            self._complete(seq, [])
+            return
+        with self._order_lock:
+            self._queued.append((seq, fut))
+
+    def _shed_backlog(self):
+        """Keep at most STT_INFLIGHT_MAX segments waiting; drop the oldest so the newest speech wins."""
+        with self._order_lock:
+            while self._queued and self._queued[0][1].done():
+                self._queued.popleft()
+            waiting = [(s, f) for s, f in self._queued if not f.running() and not f.done()]
+        dropped = 0
+        for seq, fut in waiting[: max(0, len(waiting) - STT_INFLIGHT_MAX + 1)]:
+            if fut.cancel():
+                self._complete(seq, [])
+                dropped += 1
+        if dropped:
+            self._emit_status(
+                message="STT degraded: dropping segment, backlog full.",
+                level="warning",
+                code="STT_BACKLOG",
+            )
+
+    def close(self):
+        self.stop.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
     def get_event(self, timeout: float = 0.01) -> Optional[dict]:
         try:
+            if timeout <= 0:
+                return self.q_out.get_nowait()
             return self.q_out.get(timeout=timeout)
         except queue.Empty:
             return None
 
-    def _emit_status(self, message: str, level: str = "warning", code: str = "STT_DEGRADED"):
-        self.q_out.put({"type": "status", "level": level, "message": message, "code": code, "ts": time.time()})
+    def drain_events(self) -> list[dict]:
+        """Return every queued event, or [] without touching the queue if none arrived."""
+        if not self.out_event.is_set():
+            return []
+        self.out_event.clear()
+        events = []
+        while (evt := self.get_event(0)) is not None:
+            events.append(evt)
+        return events
 
-    def _emit_final(self, text: str, engine: str):
-        self.q_out.put({"type": "final", "text": text, "engine": engine, "ts": time.time()})
+    def _put(self, evt: dict):
+        self.q_out.put(evt)
+        self.out_event.set()
 
-    def _run(self):
-        # Reuse one client per worker thread to reduce overhead
+    def _emit_status(self, message: str, level: str = "warning", code: str = "STT_DEGRADED"):
+        self._put(self._status_event(message, level, code))
+
+    def _emit_partial(self, text: str):
+        self._put({"type": "partial", "text": text, "ts": time.time()})
+
+    @staticmethod
+    def _status_event(message: str, level: str = "warning", code: str = "STT_DEGRADED") -> dict:
+        return {"type": "status", "level": level, "message": message, "code": code, "ts": time.time()}
+
+    @staticmethod
+    def _final_event(text: str, engine: str) -> dict:
+        return {"type": "final", "text": text, "engine": engine, "ts": time.time()}
+
+    def _complete(self, seq: int, events: list[dict]):
+        """Record a segment's result events and flush every consecutive finished seq."""
+        with self._order_lock:
+            self._pending[seq] = events
+            while self._emit_seq in self._pending:
+                for evt in self._pending.pop(self._emit_seq):
+                    self._put(evt)
+                self._emit_seq += 1
+
+    def _get_client(self) -> genai.Client:
+        # One client per worker, shared by its pool threads
+        with self._client_lock:
+            if self._client is None:
+                self._client = _gemini_client()
+            return self._client
+
+    def _transcribe_one(self, pcm_segment: bytes, lang: str, seq: int):
+        events: list[dict] = []
         try:
-            client = _gemini_client()
+            if self.stop.is_set():
+                return
+            events = self._transcribe(pcm_segment, lang, seq)
         except Exception:
-            logger.exception("Failed to initialize Gemini client in worker")
-            client = None
-
-        while not self.stop.is_set():
-            try:
-                pcm_segment, lang = self.q_in.get(timeout=0.2)
-            except queue.Empty:
-                continue
-
-            try:
-                if client is None:
-                    client = _gemini_client()
-
-                wav_bytes = write_wav_bytes(pcm_segment, sample_rate=SAMPLE_RATE)
-                prompt = _lang_prompt(lang)
-
-                audio_part = genai_types.Part.from_bytes(data=wav_bytes, mime_type="audio/wav")
+            logger.exception("Gemini live transcription worker failed")
+            events = [self._status_event(
+                message="STT error: worker failure.",
+                level="warning",
+                code="STT_ERROR",
+            )]
+        finally:
+            self._complete(seq, events)
+
+    def _transcribe(self, pcm_segment: bytes, lang: str, seq: int) -> list[dict]:
+        """Transcribe one segment; returns the ordered events (final + status) for it."""
+        cache_key = _transcript_key(pcm_segment, lang)
+        cached = _transcript_cache_get(cache_key)
+        if cached is not None:
+            return [self._final_event(text=cached, engine=_effective_engine_name() + "/cache")]
+
+        client = self._get_client()
+
+        wav_bytes = write_wav_bytes(pcm_segment, sample_rate=SAMPLE_RATE)
+        audio_part = genai_types.Part.from_bytes(data=wav_bytes, mime_type="audio/wav")
+
+        contents = [
+            genai_types.Content(
+                role="user",
+                parts=[
+                    _prompt_part(lang),
+                    audio_part,
+                ],
+            )
+        ]
+
+        def _on_retry(model: str, attempt: int, max_attempts: int, sleep_s: float):
+            # Tell the browser this may be delayed
+            self._emit_status(
+                message=f"STT delayed: Gemini model overloaded; retrying ({attempt}/{max_attempts})…",
+                level="warning",
+                code="STT_RETRYING",
+            )
+
+        def _on_switch(new_model: str):
+            self._emit_status(
+                message=f"STT delayed: switching to fallback model ({new_model})…",
+                level="warning",
+                code="STT_MODEL_FALLBACK",
+            )
 
-                contents = [
-                    genai_types.Content(
-                        role="user",
-                        parts=[
-                            genai_types.Part.from_text(text=prompt),
-                            audio_part,
-                        ],
-                    )
+        try:
+            chunks = gemini_generate_with_retry(
+                client=client,
+                contents=contents,
+                config=_GEN_CFG,
+                on_retry=_on_retry,
+                on_model_switch=_on_switch,
+                stream=True,
+            )
+            parts: list[str] = []
+            for chunk in chunks:
+                if self.stop.is_set():
+                    # Connection closed: abandon the rest of the response
+                    return []
+                piece = chunk.text or ""
+                if not piece:
+                    continue
+                parts.append(piece)
+                # Show words as they arrive, but only for the newest segment
+                if EMIT_PARTIALS and seq == self._next_seq - 1:
+                    self._emit_partial("".join(parts).strip())
+            text = "".join(parts).strip()
+            if text:
+                _transcript_cache_put(cache_key, text)
+                # Clear banner hint once we get a clean final
+                return [
+                    self._final_event(text=text, engine=_effective_engine_name()),
+                    self._status_event(message="STT recovered.", level="info", code="STT_OK"),
                 ]
+            return []
 
-                def _on_retry(model: str, attempt: int, max_attempts: int, sleep_s: float):
-                    # Tell the browser this may be delayed
-                    self._emit_status(
-                        message=f"STT delayed: Gemini model overloaded; retrying ({attempt}/{max_attempts})…",
-                        level="warning",
-                        code="STT_RETRYING",
-                    )
-
-                def _on_switch(new_model: str):
+        except Exception as e:
+            # If overload persists: fallback locally (optional)
+            if _is_overload_error(e):
+                if USE_LOCAL_WHISPER_FALLBACK and _get_whisper_model() is not None:
                     self._emit_status(
-                        message=f"STT delayed: switching to fallback model ({new_model})…",
+                        message="STT degraded: Gemini is overloaded; using local Whisper fallback.",
                         level="warning",
-                        code="STT_MODEL_FALLBACK",
+                        code="STT_FALLBACK_LOCAL",
                     )
-
-                try:
-                    resp = gemini_generate_with_retry(
-                        client=client,
-                        contents=contents,
-                        config=genai_types.GenerateContentConfig(temperature=0.0),
-                        on_retry=_on_retry,
-                        on_model_switch=_on_switch,
-                    )
-                    text = (resp.text or "").strip()
-                    if text:
-                        self._emit_final(text=text, engine=_effective_engine_name())
-                        # Clear banner hint once we get a clean final
-                        self._emit_status(message="STT recovered.", level="info", code="STT_OK")
-                        continue
-
-                except Exception as e:
-                    # If overload persists: fallback locally (optional)
-                    if _is_overload_error(e):
-                        if USE_LOCAL_WHISPER_FALLBACK and _get_whisper_model() is not None:
-                            self._emit_status(
-                                message="STT degraded: Gemini is overloaded; using local Whisper fallback.",
-                                level="warning",
-                                code="STT_FALLBACK_LOCAL",
-                            )
-                            local_text = whisper_transcribe_pcm16(pcm_segment, lang)
-                            if local_text:
-                                self._emit_final(text=local_text, engine="local/faster-whisper")
-                                self._emit_status(message="STT recovered.", level="info", code="STT_OK")
-                                continue
-
-                        # If no fallback, surface degraded status (but don't kill the worker)
-                        self._emit_status(
-                            message="STT degraded: Gemini is overloaded and no fallback is available. You may miss a few seconds.",
-                            level="warning",
-                            code="STT_DEGRADED",
-                        )
-                        continue
-
-                    # Non-overload errors: log + surface a status (still keep worker alive)
-                    logger.exception("Gemini live transcription worker failed")
-                    self._emit_status(
-                        message="STT error: transcription failed for a segment.",
-                        level="warning",
-                        code="STT_ERROR",
-                    )
-
-            except Exception:
-                logger.exception("Gemini live transcription worker failed")
-                self._emit_status(
-                    message="STT error: worker failure.",
+                    local_text = whisper_transcribe_pcm16(pcm_segment, lang)
+                    if local_text:
+                        return [
+                            self._final_event(text=local_text, engine="local/faster-whisper"),
+                            self._status_event(message="STT recovered.", level="info", code="STT_OK"),
+                        ]
+
+                # If no fallback, surface degraded status (but don't kill the worker)
+                return [self._status_event(
+                    message="STT degraded: Gemini is overloaded and no fallback is available. You may miss a few seconds.",
                     level="warning",
-                    code="STT_ERROR",
-                )
+                    code="STT_DEGRADED",
+                )]
+
+            # Non-overload errors: log + surface a status (still keep worker alive)
+            logger.exception("Gemini live transcription worker failed")
+            return [self._status_event(
+                message="STT error: transcription failed for a segment.",
+                level="warning",
+                code="STT_ERROR",
+            )]
 
 
 def register_ws_routes(sock):
@@ -575,16 +1102,35 @@ def register_ws_routes(sock):
 
         ff = start_ffmpeg_decoder()
         stop = threading.Event()
-        pcm_q: "queue.Queue[bytes]" = queue.Queue()
+        # Bounded: if the loop falls behind, old audio is dropped rather than lagging forever
+        pcm_q: "queue.Queue[bytes]" = queue.Queue(maxsize=STT_PCM_QUEUE_MAX)
 
         def read_pcm():
             try:
-                chunk_bytes = int(SAMPLE_RATE * 0.1) * 2
+                chunk_bytes = int(SAMPLE_RATE * STT_PCM_BLOCK_MS / 1000.0) * 2
+                dropping = False
                 while not stop.is_set():
                     data = ff.stdout.read(chunk_bytes)
                     if not data:
                         break
-                    pcm_q.put(data)
+                    try:
+                        pcm_q.put_nowait(data)
+                    except queue.Full:
+                        try:
+                            pcm_q.get_nowait()
+                        except queue.Empty:
+                            pass
+                        pcm_q.put_nowait(data)
+                        if not dropping:
+                            dropping = True
+                            logger.warning("Live STT is behind the decoder; dropping oldest PCM")
+                            worker._emit_status(
+                                message="STT degraded: audio backlog full, dropping oldest audio.",
+                                level="warning",
+                                code="STT_BACKLOG",
+                            )
+                        continue
+                    dropping = False
             finally:
                 stop.set()
 
@@ -608,7 +1154,15 @@ def register_ws_routes(sock):
         threading.Thread(target=read_pcm, daemon=True).start()
         threading.Thread(target=write_webm, daemon=True).start()
 
-        segment = bytearray()
+        # Segment PCM lives in a preallocated int16 buffer; only finalize copies it out.
+        ring = np.empty(int(STT_MAX_SEGMENT_MS / 1000.0 * SAMPLE_RATE) + SAMPLE_RATE, dtype=np.int16)
+        w = 0
+        vad_state = VadState()
+        # Running energy of the segment so RMS only touches the newest block.
+        seg_sumsq = 0
+        seg_samples = 0
+        # Stage-1 energy gate: blocks well under the tracked noise floor skip webrtcvad.
+        noise_floor = 0.0
         last_voiced_ts = time.time()
         seg_start_ts = time.time()
         last_partial_emit = 0.0
@@ -625,16 +1179,34 @@ def register_ws_routes(sock):
                     block = pcm_q.get(timeout=0.5)
                 except queue.Empty:
                     # drain events
-                    evt = worker.get_event(timeout=0.001)
-                    if evt:
+                    for evt in worker.drain_events():
                         ws.send(json.dumps(evt))
                     continue
 
-                segment += block
+                n = len(block) // 2
+                if w + n > ring.size:
+                    # Decoder ran ahead of wall-clock segmentation; grow rather than drop audio
+                    ring = np.concatenate([ring[:w], np.empty(max(n, ring.size), dtype=np.int16)])
+                ring[w:w + n] = np.frombuffer(block, dtype=np.int16, count=n)
+                w += n
+                segment = ring[:w].view(np.uint8)
+
+                samples = ring[w - n:w].astype(np.int64)
+                block_sumsq = int(np.dot(samples, samples))
+                block_rms = (block_sumsq / samples.size) ** 0.5 / 32768.0 if samples.size else 0.0
+                seg_sumsq += block_sumsq
+                seg_samples += samples.size
+
+                below_gate = block_rms < max(0.002, 2.0 * noise_floor)
+                voiced_before = vad_state.voiced_count
+                voiced_ratio = vad_update(
+                    vad_state, segment, SAMPLE_RATE, vad, VAD_FRAME_MS,
+                    silent=below_gate, energy_thresh=max(0.002, 2.0 * noise_floor),
+                )
+                if vad_state.voiced_count == voiced_before:
+                    noise_floor = 0.99 * noise_floor + 0.01 * block_rms
 
-                voiced_ratio = vad_voiced_ratio(bytes(segment), SAMPLE_RATE, vad, VAD_FRAME_MS)
-                audio_f32 = pcm_s16le_bytes_to_float32(bytes(segment))
-                rms = rms_level_f32(audio_f32)
+                rms = (seg_sumsq / seg_samples) ** 0.5 / 32768.0 if seg_samples else 0.0
 
                 now = time.time()
                 is_voiced = voiced_ratio >= VAD_VOICED_RATIO_MIN and rms > 0.002
@@ -644,39 +1216,39 @@ def register_ws_routes(sock):
                 # Optional partials: submit the whole buffer occasionally while voice is active.
                 if EMIT_PARTIALS:
                     if (now - last_partial_emit) * 1000.0 >= STT_PARTIAL_MIN_INTERVAL_MS:
-                        if len(segment) >= int(SAMPLE_RATE * 0.8) * 2 and is_voiced:
-                            worker.submit(bytes(segment), lang)
+                        if w >= int(SAMPLE_RATE * 0.8) and is_voiced:
+                            worker.submit(ring[:w].tobytes(), lang)
                             last_partial_emit = now
 
                 silence_ms = (now - last_voiced_ts) * 1000.0
                 seg_ms = (now - seg_start_ts) * 1000.0
 
                 should_finalize = (
-                    (silence_ms >= STT_SEGMENT_SILENCE_MS and len(segment) >= int(SAMPLE_RATE * 0.35) * 2)
+                    (silence_ms >= STT_SEGMENT_SILENCE_MS and w >= int(SAMPLE_RATE * 0.35))
                     or (seg_ms >= STT_MAX_SEGMENT_MS)
                 )
 
                 if should_finalize:
                     # Only submit if there's some speechy content
-                    if vad_voiced_ratio(bytes(segment), SAMPLE_RATE, vad, VAD_FRAME_MS) >= 0.15:
-                        worker.submit(bytes(segment), lang)
+                    if vad_state.ratio >= 0.15:
+                        worker.submit(ring[:w].tobytes(), lang)
 
-                    segment.clear()
+                    w = 0
+                    vad_state.reset()
+                    seg_sumsq = 0
+                    seg_samples = 0
                     seg_start_ts = time.time()
                     last_voiced_ts = time.time()
                     last_partial_emit = 0.0
 
                 # Drain worker events
-                while True:
-                    evt = worker.get_event(timeout=0.001)
-                    if not evt:
-                        break
+                for evt in worker.drain_events():
                     ws.send(json.dumps(evt))
 
         finally:
             stop.set()
             try:
-                worker.stop.set()
+                worker.close()
             except Exception:
                 pass
             try:
@@ -0,0 +1,92 @@
+"""
+Shared pytest fixtures.
+
+The schema is built once per test session in an in-memory DB that models.py serves
+through a single shared connection (StaticPool); `db_session` wraps
+each test in an outer transaction that is rolled back afterwards (helpers' own
+commits only release SAVEPOINTs), so tests don't see each other's rows.
+"""
+import os
+import sys
+
+# Use in-memory DB before any model import so engine is created with it. Plain ":memory:"
+# gives each connection its own private DB; cache=shared makes the pool share one. Named
+# per pytest-xdist worker (pytest -n auto) so parallel workers never share a DB.
+_WORKER = os.environ.get("PYTEST_XDIST_WORKER", "main")
+os.environ["DATABASE_URL"] = f"sqlite:///file:mem_{_WORKER}?mode=memory&cache=shared&uri=true"
+
+# The app is a set of top-level modules, not an installed package: the one place the
+# project root goes on sys.path (test modules rely on conftest being imported first).
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import pytest
+from sqlalchemy import event
+
+from models import engine
+
+
+# Registered at import so the very first connection (schema creation) gets them.
+@event.listens_for(engine, "connect")
+def _sqlite_test_connection(dbapi_conn, _record):
+    # Throwaway DB: no fsyncs or on-disk journal bookkeeping on commit
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA synchronous=OFF")
+    cur.execute("PRAGMA journal_mode=MEMORY")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.close()
+    # pysqlite defers BEGIN until the first write and commits around DDL on its own, which
+    # breaks SAVEPOINT-based rollback; hand transaction control to SQLAlchemy instead.
+    dbapi_conn.isolation_level = None
+
+
+@event.listens_for(engine, "begin")
+def _sqlite_explicit_begin(conn):
+    conn.exec_driver_sql("BEGIN")
+
+
+@pytest.fixture(scope="session")
+def _db():
+    """Create schema + seed roles exactly once; yields the engine."""
+    from models import Base, seed_db
+
+    # Fresh DB: plain CREATEs (no per-table existence checks) and no migrations to run
+    Base.metadata.create_all(engine, checkfirst=False)
+    seed_db()
+    yield engine
+
+
+@pytest.fixture(autouse=True)
+def _schema(_db):
+    """Every test gets the session's schema instead of calling init_db() itself."""
+    yield
+
+
+@pytest.fixture(scope="session")
+def clinician_role_id(_db):
+    from models import get_role_id
+
+    role_id = get_role_id("clinician")
+    assert role_id is not None, "seed_db() should seed the clinician role"
+    return role_id
+
+
+@pytest.fixture
+def db_session(_db):
+    """Session joined to an outer transaction that is rolled back after the test.
+
+    Pass it to helpers as db=...: every session shares the one pooled connection, so a
+    helper opening its own session meanwhile would try to BEGIN inside this transaction.
+    """
+    from models import SessionLocal
+
+    connection = _db.connect()
+    trans = connection.begin()
+    session = SessionLocal.session_factory(bind=connection, join_transaction_mode="create_savepoint")
+    try:
+        yield session
+    finally:
+        session.close()
+        trans.rollback()
+        connection.close()
@@ -13,7 +13,7 @@ from models import (
     init_db,
     SessionLocal,
     User,
-    Role,
+    get_role_id,
     user_roles,
     create_conversation,
     create_patient,
@@ -28,11 +28,7 @@ def main():
 
     db = SessionLocal()
     try:
-        clinician_role = db.query(Role).filter_by(name="clinician").first()
-        if not clinician_role:
-            clinician_role = Role(name="clinician")
-            db.add(clinician_role)
-            db.commit()
+        clinician_role_id = get_role_id("clinician", db=db)  # seeded by init_db()
         u = User(
             email="manual_test@example.com",
             username="manual_test_user",
@@ -42,7 +38,7 @@ def main():
         db.add(u)
         db.commit()
         user_id = u.id
-        db.execute(user_roles.insert().values(user_id=user_id, role_id=clinician_role.id))
+        db.execute(user_roles.insert().values(user_id=user_id, role_id=clinician_role_id))
         db.commit()
     finally:
         db.close()
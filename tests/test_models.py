@@ -1,11 +1,4 @@
-import os
-import sys
-
-# Ensure project root is on sys.path so we can import app modules
-PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-if PROJECT_ROOT not in sys.path:
-    sys.path.insert(0, PROJECT_ROOT)
-
+# conftest.py puts the project root on sys.path and points DATABASE_URL at memory
 from models import init_db, create_conversation, list_conversations
 
 
@@ -31,3 +24,168 @@ def test_create_conversation_persists_in_db():
     ids = {c.id for c in conversations}
     assert cid in ids
 
+
+
+def test_log_messages_bulk_inserts_in_order():
+    from models import log_messages_bulk, get_conversation_messages
+    from datetime import datetime, timedelta
+
+    cid = create_conversation()
+    t0 = datetime.utcnow()
+    rows = [
+        {"role": "patient", "message": f"turn {i}", "timestamp": "00:00:0%d" % i,
+         "created_at": t0 + timedelta(milliseconds=i)}
+        for i in range(5)
+    ]
+    assert log_messages_bulk(cid, rows) == 5
+    assert log_messages_bulk(cid, []) == 0
+
+    msgs = get_conversation_messages(cid)
+    assert [m.message for m in msgs] == [f"turn {i}" for i in range(5)]
+    assert all(m.type == "message" for m in msgs)
+
+
+def test_request_session_is_shared_across_helpers():
+    from models import bind_request_session, release_request_session, session_scope
+
+    bind_request_session()
+    try:
+        with session_scope() as first, session_scope() as second:
+            assert first is second
+        cid = create_conversation()
+        assert cid in {c.id for c in list_conversations()}
+    finally:
+        release_request_session()
+
+
+def test_delete_conversation_removes_messages_only_for_owner():
+    from models import (
+        log_messages_bulk,
+        get_conversation_messages,
+        delete_conversation_if_owned_by,
+        delete_conversation_by_id,
+    )
+
+    cid = create_conversation(owner_user_id=None)
+    log_messages_bulk(cid, [{"role": "patient", "message": "hi", "timestamp": "00:00:01"}])
+
+    assert delete_conversation_if_owned_by(cid, 424242) is False
+    assert len(get_conversation_messages(cid)) == 1
+
+    assert delete_conversation_by_id(cid) is True
+    assert get_conversation_messages(cid) == []
+    assert cid not in {c.id for c in list_conversations()}
+    assert delete_conversation_by_id(cid) is False
+
+
+def test_create_conversation_with_first_message():
+    from models import create_conversation_with_first_message, get_conversation_messages
+
+    cid = create_conversation_with_first_message(None, None, "patient", "I have a cough", "00:00:01")
+    assert cid in {c.id for c in list_conversations()}
+    msgs = get_conversation_messages(cid)
+    assert [(m.role, m.message) for m in msgs] == [("patient", "I have a cough")]
+
+
+def test_iter_conversation_messages_streams_in_order():
+    from models import log_messages_bulk, iter_conversation_messages, get_conversation_messages
+
+    cid = create_conversation()
+    log_messages_bulk(cid, [
+        {"role": "patient", "message": f"m{i}", "timestamp": None} for i in range(7)
+    ])
+    streamed = [m.message for m in iter_conversation_messages(cid, batch_size=3)]
+    assert streamed == [f"m{i}" for i in range(7)]
+    assert streamed == [m.message for m in get_conversation_messages(cid)]
+
+
+def test_last_message_at_tracks_newest_logged_message():
+    from datetime import datetime, timedelta
+    from models import log_messages_bulk, SessionLocal, Conversation
+
+    cid = create_conversation()
+    t0 = datetime(2024, 1, 1, 12, 0, 0)
+    log_messages_bulk(cid, [
+        {"role": "patient", "message": "a", "timestamp": None, "created_at": t0},
+        {"role": "clinician", "message": "b", "timestamp": None, "created_at": t0 + timedelta(seconds=5)},
+    ])
+    # An older straggler must not move the marker backwards
+    log_messages_bulk(cid, [{"role": "patient", "message": "c", "timestamp": None, "created_at": t0}])
+
+    db = SessionLocal()
+    try:
+        assert db.get(Conversation, cid).last_message_at == t0 + timedelta(seconds=5)
+    finally:
+        db.close()
+
+
+def test_message_timestamp_round_trips_as_clock_string():
+    from models import log_message, get_conversation_messages, ClockTime
+
+    cid = create_conversation()
+    log_message(cid, "patient", "hello", "09:05:07")
+    assert get_conversation_messages(cid)[0].timestamp == "09:05:07"
+    assert ClockTime().process_bind_param("09:05:07", None) == 9 * 3600 + 5 * 60 + 7
+    assert ClockTime().process_bind_param("not a time", None) is None
+
+
+def test_message_previews_for_user_returns_first_message_and_count():
+    from datetime import datetime, timedelta
+    from models import log_messages_bulk, message_previews_for_user
+
+    t0 = datetime(2024, 2, 1, 8, 0, 0)
+    busy = create_conversation(owner_user_id=9400)
+    log_messages_bulk(busy, [
+        {"role": "patient", "message": "second", "timestamp": None, "created_at": t0 + timedelta(seconds=5)},
+        {"role": "patient", "message": "first", "timestamp": None, "created_at": t0},
+        {"role": "clinician", "message": "third", "timestamp": None, "created_at": t0 + timedelta(seconds=9)},
+    ])
+    empty = create_conversation(owner_user_id=9400)
+    other = create_conversation(owner_user_id=9401)
+    log_messages_bulk(other, [{"role": "patient", "message": "not mine", "timestamp": None}])
+
+    previews = message_previews_for_user(9400)
+    assert previews == {busy: ("first", 3)}
+    assert empty not in previews and other not in previews
+
+
+def test_last_message_at_backfill_repairs_rows_copied_without_it(db_session):
+    """Conversations inserted with last_message_at NULL (e.g. by the SQLite migration) get it back."""
+    from datetime import datetime
+    from sqlalchemy import update
+    import models
+
+    t0 = datetime(2024, 3, 1, 10, 0, 0)
+    cid = create_conversation(owner_user_id=9500, db=db_session)
+    empty = create_conversation(owner_user_id=9500, db=db_session)
+    models.log_messages_bulk(cid, [
+        {"role": "patient", "message": "hi", "timestamp": None, "created_at": t0},
+    ], db=db_session)
+    db_session.execute(
+        update(models.Conversation).where(models.Conversation.id == cid).values(last_message_at=None)
+    )
+
+    models._migrate_add_conversation_last_message_at(
+        db_session, {"conversations": {"last_message_at": None}}, None
+    )
+    assert models.get_conversation_if_owned_by(cid, 9500, db=db_session).last_message_at == t0
+    assert models.get_conversation_if_owned_by(empty, 9500, db=db_session).last_message_at is None
+
+
+def test_request_session_ends_transaction_after_each_helper():
+    """A helper on the request-wide session must not leave it idle in a transaction (e.g. during SSE)."""
+    from models import (
+        _request_db, bind_request_session, release_request_session,
+        get_conversation_status_if_owned, update_conversation_patient,
+    )
+
+    cid = create_conversation(owner_user_id=9700)
+    bind_request_session()
+    try:
+        db = _request_db.get()
+        assert get_conversation_status_if_owned(cid, 9700) == "active"
+        assert not db.in_transaction()
+        assert update_conversation_patient(cid, 9701, None) is False
+        assert not db.in_transaction()
+    finally:
+        release_request_session()
@@ -4,20 +4,11 @@ Test that conversation patient_id is persisted and that history shows "Patient 1
 Run (with venv activated and deps installed):
   pytest tests/test_patient_history.py -v
   # or: python tests/run_patient_test.py  (no pytest)
-Uses in-memory DB so it does not touch app.db.
+Uses the in-memory DB set up in conftest.py, so it does not touch app.db.
 """
-import os
-import sys
-
-# Use in-memory DB before any model import so engine is created with it
-os.environ["DATABASE_URL"] = "sqlite:///:memory:"
-
-PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-if PROJECT_ROOT not in sys.path:
-    sys.path.insert(0, PROJECT_ROOT)
+from sqlalchemy import insert
 
 from models import (
-    init_db,
     SessionLocal,
     User,
     Role,
@@ -25,27 +16,19 @@ from models import (
     create_conversation,
     create_patient,
     list_conversations_for_user,
+    get_conversation_if_owned_by,
     list_patients_for_user,
     update_conversation_patient,
+    get_next_global_patient_identifier,
+    create_patient_with_next_identifier,
+    format_patient_labels,
+    patient_labels_for_user,
+    patient_label_for,
+    find_patient_id_for_clinician,
+    get_role_id,
 )
 
 
-def _build_patient_labels(patients):
-    """Same spirit as app._patient_display_labels_for_current_user (stable order by id)."""
-    ordered = sorted(patients, key=lambda p: p.id)
-    out = {}
-    for i, p in enumerate(ordered):
-        ordinal = i + 1
-        ident = (getattr(p, "identifier", None) or "").strip()
-        disp = (getattr(p, "display_name", None) or "").strip()
-        if ident:
-            base = ident + (f" — {disp}" if disp else "")
-            out[p.id] = f"{base} (Patient {ordinal})"
-        else:
-            out[p.id] = f"Patient {ordinal}"
-    return out
-
-
 def _patient_label_for_conversation(conversation, plabels):
     """Same logic as app api_my_conversations."""
     pid = conversation.patient_id
@@ -55,53 +38,41 @@ def _patient_label_for_conversation(conversation, plabels):
     return patient_label
 
 
-def test_conversation_with_patient_shows_patient_label():
-    """Create user, patient, conversation with patient_id; label should include identifier and ordinal."""
-    init_db()
+def _make_clinician(db, role_id, email, username):
+    """Insert a user linked to the clinician role (Core inserts, no ORM flush); returns the user id."""
+    user_id = db.execute(
+        insert(User).values(email=email, username=username, password_hash="fake", email_verified=False)
+        .returning(User.id)
+    ).scalar_one()
+    db.execute(user_roles.insert().values(user_id=user_id, role_id=role_id))
+    db.commit()
+    return user_id
 
-    db = SessionLocal()
-    try:
-        # Ensure clinician role exists
-        clinician_role = db.query(Role).filter_by(name="clinician").first()
-        if not clinician_role:
-            clinician_role = Role(name="clinician")
-            db.add(clinician_role)
-            db.commit()
-        # Create user
-        u = User(
-            email="history_test@example.com",
-            username="history_test_user",
-            password_hash="fake",
-            email_verified=False,
-        )
-        db.add(u)
-        db.commit()
-        user_id = u.id
-        # Link user to clinician role
-        db.execute(user_roles.insert().values(user_id=user_id, role_id=clinician_role.id))
-        db.commit()
-    finally:
-        db.close()
+
+def test_conversation_with_patient_shows_patient_label(db_session, clinician_role_id):
+    """Create user, patient, conversation with patient_id; label should include identifier and ordinal."""
+    db = db_session
+    user_id = _make_clinician(db, clinician_role_id, "history_test@example.com", "history_test_user")
 
     # Create patient for this clinician
-    patient_id = create_patient(identifier="P001", clinician_id=user_id)
+    patient_id = create_patient(identifier="P001", clinician_id=user_id, db=db)
     assert patient_id is not None
 
     # Create conversation with owner and patient
-    cid = create_conversation(owner_user_id=user_id, patient_id=patient_id)
+    cid = create_conversation(owner_user_id=user_id, patient_id=patient_id, db=db)
     assert cid
 
     # Same logic as api_my_conversations
-    convos = list_conversations_for_user(user_id)
+    convos = list_conversations_for_user(user_id, db=db)
     assert len(convos) >= 1
     c = convos[0]
     assert c.id == cid
     assert c.patient_id is not None, "Conversation should have patient_id set"
     assert c.patient_id == patient_id
 
-    patients = list_patients_for_user(user_id)
+    patients = list_patients_for_user(user_id, db=db)
     assert len(patients) >= 1
-    plabels = _build_patient_labels(patients)
+    plabels = format_patient_labels(patients)
     assert patient_id in plabels
     assert "P001" in plabels[patient_id]
     assert "Patient 1" in plabels[patient_id]
@@ -112,45 +83,139 @@ def test_conversation_with_patient_shows_patient_label():
     )
 
 
-def test_update_conversation_patient_then_list_shows_label():
+def test_update_conversation_patient_then_list_shows_label(db_session, clinician_role_id):
     """Update a conversation's patient_id via update_conversation_patient; list should show label."""
-    init_db()
-
-    db = SessionLocal()
-    try:
-        clinician_role = db.query(Role).filter_by(name="clinician").first()
-        if not clinician_role:
-            clinician_role = Role(name="clinician")
-            db.add(clinician_role)
-            db.commit()
-        u = User(
-            email="update_test@example.com",
-            username="update_test_user",
-            password_hash="fake",
-            email_verified=False,
-        )
-        db.add(u)
-        db.commit()
-        user_id = u.id
-        db.execute(user_roles.insert().values(user_id=user_id, role_id=clinician_role.id))
-        db.commit()
-    finally:
-        db.close()
+    db = db_session
+    user_id = _make_clinician(db, clinician_role_id, "update_test@example.com", "update_test_user")
 
     # Conversation created WITHOUT patient first
-    cid = create_conversation(owner_user_id=user_id, patient_id=None)
-    patient_id = create_patient(identifier="P002", clinician_id=user_id)
+    cid = create_conversation(owner_user_id=user_id, patient_id=None, db=db)
+    patient_id = create_patient(identifier="P002", clinician_id=user_id, db=db)
 
     # Simulate user selecting patient from dropdown: update current conversation
-    updated = update_conversation_patient(cid, user_id, patient_id)
+    updated = update_conversation_patient(cid, user_id, patient_id, db=db)
     assert updated is True
 
-    convos = list_conversations_for_user(user_id)
-    c = next((x for x in convos if x.id == cid), None)
+    c = get_conversation_if_owned_by(cid, user_id, db=db)
     assert c is not None
     assert c.patient_id == patient_id
 
-    patients = list_patients_for_user(user_id)
-    plabels = _build_patient_labels(patients)
+    patients = list_patients_for_user(user_id, db=db)
+    plabels = format_patient_labels(patients)
     label = _patient_label_for_conversation(c, plabels)
     assert "Patient 1" in label or "Patient 2" in label, f"Expected numbered label, got {label!r}"
+
+
+def test_next_global_patient_identifier_skips_non_numeric_ids():
+    """Next identifier follows the highest P<number>, ignoring free-form identifiers."""
+    before = get_next_global_patient_identifier()
+    n = int(before[1:])
+    create_patient(identifier=f"p{n + 40:03d}")
+    create_patient(identifier="Case 999")
+    create_patient(identifier="P12a")
+    assert get_next_global_patient_identifier() == f"P{n + 41:03d}"
+
+
+def test_allocated_identifiers_are_unique_and_skip_manual_ones():
+    """Auto-allocated identifiers never repeat and jump past manually entered P-numbers."""
+    _, first = create_patient_with_next_identifier()
+    _, second = create_patient_with_next_identifier()
+    assert int(second[1:]) == int(first[1:]) + 1
+
+    manual = int(second[1:]) + 10
+    create_patient(identifier=f"P{manual:03d}")
+    _, third = create_patient_with_next_identifier()
+    assert third == f"P{manual + 1:03d}"
+
+
+def test_has_role_cache_follows_role_changes():
+    """has_role caches role names per instance but sees roles added through the relationship."""
+    db = SessionLocal()
+    try:
+        clinician = db.get(Role, get_role_id("clinician"))
+        admin = db.get(Role, get_role_id("admin"))
+        u = User(email="roles_test@example.com", password_hash="fake", email_verified=False)
+        u.roles.append(clinician)
+        db.add(u)
+        db.commit()
+        uid = u.id
+    finally:
+        db.close()
+
+    db = SessionLocal()
+    try:
+        u = db.get(User, uid)
+        assert u.has_role("clinician") and not u.has_role("admin")
+        u.roles.append(admin)
+        assert u.has_role("admin")
+    finally:
+        db.close()
+
+
+def test_role_id_cache_matches_roles_table():
+    db = SessionLocal()
+    try:
+        for role in db.query(Role).all():
+            assert get_role_id(role.name) == role.id
+    finally:
+        db.close()
+    assert get_role_id("no-such-role") is None
+
+
+def test_create_patient_returns_existing_for_same_clinician():
+    """Same identifier for the same clinician resolves to one row; other clinicians get their own."""
+    first = create_patient(identifier="P777", clinician_id=9001)
+    again = create_patient(identifier="P777", clinician_id=9001)
+    other = create_patient(identifier="P777", clinician_id=9002)
+    assert first == again
+    assert other != first
+
+
+def test_update_conversation_patient_same_value_is_a_successful_no_op():
+    """Re-assigning the current patient reports success; a different owner still gets False."""
+    cid = create_conversation(owner_user_id=9100)
+    pid = create_patient(identifier="P910", clinician_id=9100)
+    assert update_conversation_patient(cid, 9100, pid) is True
+    assert update_conversation_patient(cid, 9100, pid) is True
+    assert update_conversation_patient(cid, 9101, pid) is False
+
+
+def test_list_patients_for_user_is_in_id_order(db_session):
+    """Ordinals ("Patient N") rely on list_patients_for_user returning patients by id."""
+    ids = [create_patient(identifier=f"Case {n}", clinician_id=9200, db=db_session) for n in range(3)]
+    assert [p.id for p in list_patients_for_user(9200, db=db_session)] == sorted(ids)
+
+
+def test_patient_labels_cached_until_patient_set_changes(db_session):
+    """Unchanged patients return the cached dict; a new patient rebuilds it."""
+    create_patient(identifier="P930", clinician_id=9300, db=db_session)
+    first = patient_labels_for_user(9300, db=db_session)
+    assert patient_labels_for_user(9300, db=db_session) is first
+
+    pid = create_patient(identifier="P931", display_name="Amina", clinician_id=9300, db=db_session)
+    second = patient_labels_for_user(9300, db=db_session)
+    assert second is not first
+    assert second[pid] == "P931 — Amina (Patient 2)"
+
+
+def test_patient_label_for_matches_full_label_map(db_session):
+    """Single-patient label (SQL row_number ordinal) agrees with the full map; other clinicians get None."""
+    for ident in ("P940", "", "P942"):
+        create_patient(identifier=ident, display_name="Zawadi" if ident == "P942" else None, clinician_id=9400, db=db_session)
+    other = create_patient(identifier="P949", clinician_id=9401, db=db_session)
+
+    plabels = format_patient_labels(list_patients_for_user(9400, db=db_session))
+    for pid, label in plabels.items():
+        assert patient_label_for(pid, 9400, db=db_session) == label
+    assert patient_label_for(other, 9400, db=db_session) is None
+
+
+def test_find_patient_id_for_clinician_ignores_case_and_spaces(db_session):
+    """Legacy identifiers stored as "p001" / " P002 " still resolve for the normalized form."""
+    lower = create_patient(identifier="p001", clinician_id=9600, db=db_session)
+    spaced = create_patient(identifier=" P002 ", clinician_id=9600, db=db_session)
+    create_patient(identifier="P003", clinician_id=9601, db=db_session)
+
+    assert find_patient_id_for_clinician("P001", 9600, db=db_session) == lower
+    assert find_patient_id_for_clinician("P002", 9600, db=db_session) == spaced
+    assert find_patient_id_for_clinician("P003", 9600, db=db_session) is None